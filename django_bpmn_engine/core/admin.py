@@ -1,9 +1,10 @@
 from django import forms
 from django.contrib import admin
-from django.db import transaction
 from django.db.models import ForeignKey
 from django.db.models.fields.related import OneToOneField
 
+from django_bpmn_engine.core.models import EventSubscription
+from django_bpmn_engine.core.models import EventSubscriptionState
 from django_bpmn_engine.core.models import Incident
 from django_bpmn_engine.core.models import MessageTaskEvent
 from django_bpmn_engine.core.models import MessageTaskEventState
@@ -16,10 +17,18 @@ from django_bpmn_engine.core.models import WorkflowInstance
 from django_bpmn_engine.core.models import WorkflowState
 from django_bpmn_engine.core.models import WorkflowTaskInstance
 from django_bpmn_engine.core.workflow.service import WorkflowService
-from django_bpmn_engine.core.workflow.service import run_workflow
+from django_bpmn_engine.core.workflow.service import dispatch_workflow_runs
 from django_bpmn_engine.core.utils import convert_form_dict_to_json_schema
 
 
+def _queue_workflow_run(workflow_instance_id: str, extra_data=None):
+    """
+    Queue a run of the instance once the admin change is committed, the engine never runs inside the
+    admin request.
+    """
+    dispatch_workflow_runs([workflow_instance_id], reason="Admin change", extra_data=extra_data, queue=True)
+
+
 class ModelAdminMixin(admin.ModelAdmin):
     ordering = ["created_at"]
 
@@ -58,14 +67,8 @@ class WorkflowAdmin(ModelAdminMixin):
     readonly_fields = ("version",)
 
     def save_model(self, request, obj, form, change) -> None:
-        with transaction.atomic():
-            service = WorkflowService()
-
-            # Validate the workflow
-            service.parse_workflow(obj.xml, obj.workflow_process_id)
-
-            workflow = super().save_model(request, obj, form, change)
-            return workflow
+        # Validate the workflow and store its compiled spec
+        obj.save(compile_spec=True)
 
 
 @admin.register(WorkflowInstance)
@@ -90,6 +93,12 @@ class WorkflowTaskInstanceAdmin(ModelAdminMixin):
     ]
     list_display = ["created_at", "updated_at", "workflow", "state", "task_spec"]
     list_filter = ["created_at", "updated_at", "state"]
+    exclude = ["data", "payload"]
+    readonly_fields = ["task_data"]
+
+    @admin.display(description="Data")
+    def task_data(self, obj):
+        return obj.get_data()
 
     @admin.display(description="Workflow", ordering="workflow_instance__workflow__name")
     def workflow(self, obj):
@@ -110,10 +119,7 @@ class ServiceTaskAdmin(ModelAdminMixin):
             ServiceTaskState.COMPLETED,
             ServiceTaskState.FAILURE,
         ]:
-            run_workflow.apply_async(
-                args=[str(obj.workflow_instance.id)], queue="run_workflow"
-            )
-            # run_workflow(str(obj.workflow_instance.id))
+            _queue_workflow_run(str(obj.workflow_instance_id))
 
 
 @admin.register(MessageTaskEvent)
@@ -124,10 +130,18 @@ class MessageTaskEventAdmin(ModelAdminMixin):
     def save_model(self, request, obj, form, change) -> None:
         obj.save()
         if obj.state == MessageTaskEventState.RECEIVED:
-            run_workflow.apply_async(
-                args=[str(obj.workflow_instance.id)], queue="run_workflow"
-            )
-            # run_workflow(str(obj.workflow_instance.id))
+            _queue_workflow_run(str(obj.workflow_instance_id))
+
+
+@admin.register(EventSubscription)
+class EventSubscriptionAdmin(ModelAdminMixin):
+    list_display = ["created_at", "updated_at", "task_name", "event_type", "event_name", "state"]
+    list_filter = ["created_at", "updated_at", "event_type", "state"]
+
+    def save_model(self, request, obj, form, change) -> None:
+        obj.save()
+        if obj.state == EventSubscriptionState.RECEIVED:
+            _queue_workflow_run(str(obj.workflow_instance_id))
 
 
 @admin.register(Incident)
@@ -140,10 +154,7 @@ class IncidentAdmin(ModelAdminMixin):
         if obj.resolved:
             obj.workflow_instance.state = WorkflowState.RUNNING
             obj.workflow_instance.save()
-            run_workflow.s(
-                str(obj.workflow_instance.id), extra_data=obj.input
-            ).apply_async(queue="run_workflow")
-            # run_workflow(str(obj.workflow_instance.id))
+            _queue_workflow_run(str(obj.workflow_instance_id), extra_data=obj.input)
 
 
 class UserTaskForm(forms.ModelForm):
@@ -164,7 +175,4 @@ class UserTaskAdmin(ModelAdminMixin):
         obj.save()
 
         if obj.state == UserTaskState.COMPLETED:
-            # run_workflow.apply_async(
-            #     args=[str(obj.workflow_instance.id)], queue="run_workflow"
-            # )
-            run_workflow(str(obj.workflow_instance.id))
+            _queue_workflow_run(str(obj.workflow_instance_id))
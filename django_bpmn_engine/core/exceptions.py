@@ -9,3 +9,12 @@ class WorkflowTaskError(Exception):
 
     def __str__(self):
         return f"Error on task ({self.task_id=}): {self.message}"
+
+
+class WorkflowSnapshotConflictError(Exception):
+    def __init__(self, workflow_instance_id: str, snapshot_version: int):
+        self.workflow_instance_id = workflow_instance_id
+        self.snapshot_version = snapshot_version
+
+    def __str__(self):
+        return f"Snapshot of workflow instance ({self.workflow_instance_id=}) changed after {self.snapshot_version=}"
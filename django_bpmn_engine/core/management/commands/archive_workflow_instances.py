@@ -0,0 +1,33 @@
+from datetime import timedelta
+from time import sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from django_bpmn_engine.core.workflow.archive import archive_workflow_instances
+
+
+class Command(BaseCommand):
+    help = "Move the COMPLETED/CANCELED workflow instances out of the engine tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.WORKFLOW_ARCHIVE_AFTER_DAYS, help="Minimum age")
+        parser.add_argument("--batch-size", type=int, default=settings.WORKFLOW_ARCHIVE_BATCH_SIZE)
+        parser.add_argument("--max-batches", type=int, default=None, help="Stop after this many batches")
+        parser.add_argument(
+            "--throttle", type=float, default=settings.WORKFLOW_ARCHIVE_THROTTLE, help="Seconds between batches"
+        )
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - timedelta(days=options["days"])
+        batches = 0
+        archived = 0
+        while options["max_batches"] is None or batches < options["max_batches"]:
+            batch = archive_workflow_instances(options["batch_size"], older_than)
+            archived += batch
+            batches += 1
+            if batch < options["batch_size"]:
+                break
+            sleep(options["throttle"])
+        self.stdout.write(f"Archived {archived} workflow instances")
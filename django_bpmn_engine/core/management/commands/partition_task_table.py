@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+
+from django_bpmn_engine.core.workflow.partitions import convert_to_partitioned
+from django_bpmn_engine.core.workflow.partitions import create_partitions
+from django_bpmn_engine.core.workflow.partitions import drop_partitions
+from django_bpmn_engine.core.workflow.partitions import is_partitioned
+
+
+class Command(BaseCommand):
+    help = "Partition the task instance table by month on PostgreSQL, and create or drop its partitions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convert", action="store_true", help="Rebuild the table as a partitioned one, it is locked meanwhile"
+        )
+        parser.add_argument("--ahead", type=int, default=settings.WORKFLOW_TASK_PARTITIONS_AHEAD)
+        parser.add_argument("--drop-before", help="Drop the partitions of the months ending before this YYYY-MM date")
+        parser.add_argument("--force", action="store_true", help="Drop partitions with tasks of unfinished instances")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning is only supported on PostgreSQL")
+        if options["convert"]:
+            convert_to_partitioned(options["ahead"])
+            self.stdout.write("Task instance table partitioned")
+        if not is_partitioned():
+            raise CommandError("The task instance table is not partitioned, run with --convert first")
+        for name in create_partitions(options["ahead"]):
+            self.stdout.write(f"Created {name}")
+        if options["drop_before"]:
+            try:
+                before = datetime.strptime(options["drop_before"], "%Y-%m").date()
+            except ValueError:
+                raise CommandError("--drop-before must be a YYYY-MM date")
+            for name in drop_partitions(before, options["force"]):
+                self.stdout.write(f"Dropped {name}")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from django_bpmn_engine.core.models import WorkflowTaskStateCounter
+
+
+class Command(BaseCommand):
+    help = "Recount the task states shown by the workflow stats from the WorkflowTaskInstance rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workflow", action="append", help="Workflow id, all the workflows by default")
+
+    def handle(self, *args, **options):
+        # Runs saved while the counters are rebuilt may be counted twice or missed, run it again if needed
+        WorkflowTaskStateCounter.objects.rebuild(options["workflow"])
+        self.stdout.write("Task state counters rebuilt")
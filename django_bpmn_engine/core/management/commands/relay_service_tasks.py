@@ -0,0 +1,36 @@
+import logging
+
+from time import sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from django_bpmn_engine.core.workflow.service import relay_service_tasks
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Publish the service tasks waiting in the outbox"
+    running = True
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.SERVICE_TASK_RELAY_BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=1, help="Seconds to wait when the outbox is empty")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        try:
+            while self.running:
+                try:
+                    published = relay_service_tasks(batch_size)
+                except Exception:
+                    logger.exception("Error relaying the service task outbox")
+                    sleep(options["interval"])
+                    continue
+                if published:
+                    logger.info(f"Published {published} service tasks")
+                if published < batch_size:
+                    sleep(options["interval"])
+        except KeyboardInterrupt:
+            self.running = False
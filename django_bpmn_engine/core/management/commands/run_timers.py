@@ -0,0 +1,36 @@
+import logging
+
+from time import sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from django_bpmn_engine.core.workflow.service import fire_due_timers
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Fire the due workflow timers"
+    running = True
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.WORKFLOW_TIMER_BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=1, help="Seconds to wait when no timer is due")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        try:
+            while self.running:
+                try:
+                    fired = fire_due_timers(batch_size)
+                except Exception:
+                    logger.exception("Error firing the workflow timers")
+                    sleep(options["interval"])
+                    continue
+                if fired:
+                    logger.info(f"Fired {fired} timers")
+                if fired < batch_size:
+                    sleep(options["interval"])
+        except KeyboardInterrupt:
+            self.running = False
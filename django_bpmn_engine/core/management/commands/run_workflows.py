@@ -1,14 +1,28 @@
 import logging
+import multiprocessing
+import select
+import threading
 
 from time import sleep
+from typing import Any
+from typing import List
+from typing import Optional
+from typing import Tuple
 
 from django.core.management.base import BaseCommand
 from django.db import DatabaseError
+from django.db import connections
 from django.db import transaction
+from django.utils import timezone
+from SpiffWorkflow.exceptions import WorkflowException
 
+from django_bpmn_engine.core.exceptions import WorkflowSnapshotConflictError
+from django_bpmn_engine.core.models import WORKFLOW_WAKEUP_CHANNEL
 from django_bpmn_engine.core.models import WorkflowInstance
 from django_bpmn_engine.core.models import WorkflowState
+from django_bpmn_engine.core.models import WorkflowWakeup
 from django_bpmn_engine.core.workflow.service import WorkflowService
+from django_bpmn_engine.core.workflow.service import lock_workflow_instance
 
 logger = logging.getLogger(__name__)
 
@@ -18,65 +32,163 @@ class Command(BaseCommand):
     running = True
     count = 0
 
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Instances claimed by a loop per pass")
+        parser.add_argument("--processes", type=int, default=1, help="Processes running the claim loops")
+        parser.add_argument("--threads", type=int, default=1, help="Claim loops per process")
+        parser.add_argument(
+            "--scan",
+            action="store_true",
+            help="Run every RUNNING instance on each pass instead of only the ones with a pending wakeup",
+        )
+
     def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        self.scan = options["scan"]
+        self.threads = options["threads"]
         try:
-            self._execute_workflows()
+            if options["processes"] > 1:
+                self._start_processes(options["processes"])
+            else:
+                self._start_threads()
         except KeyboardInterrupt:
             self._exit()
 
+    def _exit(self):
+        self.running = False
+
     def _waiting(self, msg):
         self.stdout.write(f"{msg}{'.' * self.count}\nQuit with CONTROL-C")
         self.count += 1 if self.count < 3 else -3
-        sleep(1)
+        self._wait(1)
         # os.system("clear")
 
+    def _wait(self, timeout: float):
+        """
+        Sleep, or on Postgres wait up to `timeout` for a wakeup notification.
+        """
+        connection = connections[WorkflowWakeup.objects.db]
+        if self.scan or connection.vendor != "postgresql":
+            sleep(timeout)
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {WORKFLOW_WAKEUP_CHANNEL}")
+        pg_connection = connection.connection
+        if not pg_connection.notifies and select.select([pg_connection], [], [], timeout) != ([], [], []):
+            pg_connection.poll()
+        pg_connection.notifies.clear()
+
+    def _start_processes(self, processes: int):
+        # The forked processes must open their own database connections
+        connections.close_all()
+        workers = [multiprocessing.Process(target=self._run_process, daemon=True) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # The workers got the interrupt too, wait for them to finish the instance they are running
+            self._exit()
+            for worker in workers:
+                worker.join()
+
+    def _run_process(self):
+        try:
+            self._start_threads()
+        except KeyboardInterrupt:
+            self._exit()
+
+    def _start_threads(self):
+        if self.threads == 1:
+            self._execute_workflows()
+            return
+        workers = [threading.Thread(target=self._execute_workflows, daemon=True) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            self._exit()
+
     def _execute_workflows(self):
         service = WorkflowService()
-        while self.running:
-            workflow_instances: WorkflowInstance = (
+        try:
+            while self.running:
+                try:
+                    executed = self._execute_batch(service)
+                except DatabaseError:
+                    self._waiting("Starting publisher 🤔")
+                else:
+                    if executed < self.batch_size:
+                        self._waiting("Waiting for messages to be published 😋")
+        finally:
+            connections.close_all()
+
+    def _claim_instance(self, started_at, claimed: List[Any]) -> Tuple[bool, Optional[WorkflowInstance]]:
+        """
+        Lock the next instance to run. What is claimed is locked with SKIP LOCKED so other loops don't wait
+        for it, then the instance is locked for the run. Returns whether something was claimed, and the
+        instance if it is still running.
+        """
+        if self.scan:
+            workflow_instance = (
                 WorkflowInstance.objects.select_related("workflow")
-                .select_for_update()
-                .filter(state=WorkflowState.RUNNING, parent__isnull=True)
+                .defer("workflow__compiled_spec")
+                .select_for_update(skip_locked=True, of=("self",))
+                .filter(state=WorkflowState.RUNNING, parent__isnull=True, updated_at__lt=started_at)
+                .exclude(id__in=claimed)
+                .order_by("updated_at")
+                .first()
             )
+            return workflow_instance is not None, workflow_instance
+
+        wakeup = (
+            WorkflowWakeup.objects.claimable()
+            .select_for_update(skip_locked=True)
+            .only("id", "workflow_instance_id")
+            .order_by("created_at")
+            .first()
+        )
+        if wakeup is None:
+            return False, None
+        # Deleted in the same transaction as the run, so the wakeup is kept if the run fails
+        wakeup.delete()
+        # The wakeup is locked first, like `run_workflow` does, so the two can't wait on each other
+        workflow_instance = lock_workflow_instance(wakeup.workflow_instance_id)
+        if workflow_instance is None or workflow_instance.state != WorkflowState.RUNNING:
+            return True, None
+        return True, workflow_instance
+
+    def _execute_batch(self, service: WorkflowService) -> int:
+        """
+        Run up to `batch_size` instances, each one claimed and committed on its own, so a failure
+        only rolls back that instance. Returns how many instances were claimed.
+        """
+        started_at = timezone.now()
+        claimed: List[Any] = []
+        while self.running and len(claimed) < self.batch_size:
+            workflow_instance = None
             try:
                 with transaction.atomic():
-                    for workflow_instance in workflow_instances.iterator():
-                        # Build the workflow spec
-                        service.build_workflow(workflow_instance)
-                        workflow_spec = service.workflow_spec
-
-                        # Process the workflow
-
-                        # workflow_spec.do_engine_steps()
-                        # service.execute_ready_tasks(workflow_instance)
-                        # service.execute_message_tasks(workflow_instance)
-                        # workflow_spec.do_engine_steps()
-                        # workflow_spec.refresh_waiting_tasks()
-                        service.run_steps(workflow_instance)
-
-                        workflow_dct = service.serializer.workflow_to_dict(
-                            workflow_spec
-                        )
-                        service.create_workflow_instance_tasks(
-                            workflow_instance, workflow_dct
-                        )
-
-                        # Need to check if workflow is complete again because of
-                        # `do_engine_steps` and `refresh_waiting_tasks` can complete the workflow
-                        if workflow_spec.is_completed():
-                            workflow_instance.state = WorkflowState.COMPLETED
-                            WorkflowInstance.objects.filter(
-                                parent=workflow_instance
-                            ).update(state=WorkflowState.COMPLETED)
-
-                        # Update the last task executed
-                        workflow_instance.last_task = (
-                            workflow_spec.last_task.task_spec.name
-                            if workflow_spec.last_task
-                            else None
-                        )
-                        workflow_instance.save()
-            except DatabaseError:
-                self._waiting("Starting publisher 🤔")
-            else:
-                self._waiting("Waiting for messages to be published 😋")
+                    has_claimed, workflow_instance = self._claim_instance(started_at, claimed)
+                    if not has_claimed:
+                        break
+                    if workflow_instance is None:
+                        continue
+                    claimed.append(workflow_instance.id)
+                    service.execute_workflow(workflow_instance)
+            except WorkflowException as e:
+                service.create_incident(workflow_instance, e.sender.name, {"error": str(e)})
+                logger.error(f"Error on task {e.sender.name}: {str(e)}")
+            except WorkflowSnapshotConflictError as e:
+                logger.warning(str(e))
+            except Exception:
+                if workflow_instance is None:
+                    raise
+                logger.exception(f"Error running workflow instance {workflow_instance.id}")
+                if not self.scan:
+                    # The claim was rolled back with the run, the wakeup would be the next one claimed again
+                    WorkflowWakeup.objects.postpone(workflow_instance.id)
+        return len(claimed)
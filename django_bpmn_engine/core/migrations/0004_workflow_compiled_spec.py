@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-17 01:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_usertask_form_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflow',
+            name='compiled_spec',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_workflow_compiled_spec'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowinstance',
+            name='snapshot',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='workflowinstance',
+            name='snapshot_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0 on 2026-10-17 01:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+def wake_running_instances(apps, schema_editor):
+    # The runner only processes instances with a pending wakeup, give one to every running instance
+    WorkflowInstance = apps.get_model("core", "WorkflowInstance")
+    WorkflowWakeup = apps.get_model("core", "WorkflowWakeup")
+    running_instances = WorkflowInstance.objects.filter(state="RUNNING", parent__isnull=True).values_list(
+        "id", flat=True
+    )
+    WorkflowWakeup.objects.bulk_create(
+        [WorkflowWakeup(workflow_instance_id=instance_id, reason="migration") for instance_id in running_instances],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_workflowinstance_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowWakeup',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('reason', models.CharField(max_length=50)),
+                ('workflow_instance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='wakeup', to='core.workflowinstance')),
+            ],
+            options={
+                'verbose_name': 'WorkflowWakeup',
+                'verbose_name_plural': 'WorkflowWakeups',
+            },
+        ),
+        migrations.RunPython(wake_running_instances, migrations.RunPython.noop),
+    ]
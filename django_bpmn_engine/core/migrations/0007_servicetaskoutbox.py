@@ -0,0 +1,44 @@
+# Generated by Django 4.0 on 2026-10-17 01:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+def add_new_service_tasks_to_outbox(apps, schema_editor):
+    # NEW service tasks were published after commit before, now the relay publishes them from the outbox
+    ServiceTask = apps.get_model("core", "ServiceTask")
+    ServiceTaskOutbox = apps.get_model("core", "ServiceTaskOutbox")
+    new_service_tasks = ServiceTask.objects.filter(state="NEW").values_list("id", "queue_name")
+    ServiceTaskOutbox.objects.bulk_create(
+        [
+            ServiceTaskOutbox(service_task_id=service_task_id, queue_name=queue_name)
+            for service_task_id, queue_name in new_service_tasks
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_workflowwakeup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceTaskOutbox',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('queue_name', models.CharField(max_length=50)),
+                ('service_task', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='core.servicetask')),
+            ],
+            options={
+                'verbose_name': 'ServiceTaskOutbox',
+                'verbose_name_plural': 'ServiceTaskOutbox',
+            },
+        ),
+        migrations.RunPython(add_new_service_tasks_to_outbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-17 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_servicetaskoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicetask',
+            name='lock_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicetask',
+            name='worker_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-17 01:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_servicetask_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicetask',
+            name='next_retry_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicetask',
+            name='retries',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.0 on 2026-10-17 01:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+def count_task_states(apps, schema_editor):
+    WorkflowTaskInstance = apps.get_model("core", "WorkflowTaskInstance")
+    WorkflowTaskStateCounter = apps.get_model("core", "WorkflowTaskStateCounter")
+    totals = WorkflowTaskInstance.objects.values("workflow_instance__workflow_id", "task_spec", "state").annotate(
+        total=models.Count("id")
+    )
+    WorkflowTaskStateCounter.objects.bulk_create(
+        [
+            WorkflowTaskStateCounter(
+                workflow_id=total["workflow_instance__workflow_id"],
+                task_spec=total["task_spec"],
+                state=total["state"],
+                count=total["total"],
+            )
+            for total in totals.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_servicetask_retries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowTaskStateCounter',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('task_spec', models.CharField(max_length=50)),
+                ('state', models.PositiveSmallIntegerField(choices=[(4, 'FUTURE'), (8, 'WAITING'), (16, 'READY'), (64, 'CANCELLED'), (32, 'COMPLETED'), (2, 'LIKELY'), (1, 'MAYBE')])),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('count', models.BigIntegerField(default=0)),
+                ('workflow', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_state_counters', to='core.workflow')),
+            ],
+            options={
+                'verbose_name': 'WorkflowTaskStateCounter',
+                'verbose_name_plural': 'WorkflowTaskStateCounters',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='workflowtaskstatecounter',
+            constraint=models.UniqueConstraint(fields=('workflow', 'task_spec', 'state', 'shard'), name='unique_workflow_task_state_counter'),
+        ),
+        migrations.RunPython(count_task_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 4.0 on 2026-10-17 01:15
+
+from django.db import migrations, models
+
+
+# States of each task model from the least to the most advanced
+TASK_STATE_ORDER = {
+    "ServiceTask": ["NEW", "ACTIVATED", "FAILURE", "COMPLETED"],
+    "UserTask": ["NEW", "ASSIGNED", "COMPLETED"],
+    "MessageTaskEvent": ["WAITING", "RECEIVED"],
+}
+
+
+def delete_duplicated_tasks(apps, schema_editor):
+    # Keep the row of each task in the most advanced state, the last updated one among them, so no progress
+    # is lost. The engine could not load the duplicated ones anyway
+    for model_name, state_order in TASK_STATE_ORDER.items():
+        model = apps.get_model("core", model_name)
+        state_ranks = {state: rank for rank, state in enumerate(state_order)}
+        duplicates = (
+            model.objects.values("workflow_instance_id", "task_name")
+            .annotate(total=models.Count("id"))
+            .filter(total__gt=1)
+        )
+        for duplicate in duplicates:
+            rows = model.objects.filter(
+                workflow_instance_id=duplicate["workflow_instance_id"], task_name=duplicate["task_name"]
+            ).values_list("id", "state", "updated_at")
+            kept_id, _, _ = max(rows, key=lambda row: (state_ranks.get(row[1], -1), row[2]))
+            model.objects.filter(
+                workflow_instance_id=duplicate["workflow_instance_id"], task_name=duplicate["task_name"]
+            ).exclude(id=kept_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_workflowtaskstatecounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicated_tasks, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='servicetask',
+            name='lock_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='servicetask',
+            name='next_retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='servicetask',
+            index=models.Index(fields=['workflow_instance', 'state'], name='service_task_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicetask',
+            index=models.Index(condition=models.Q(('next_retry_at__isnull', True), ('state', 'NEW')), fields=['queue_name', 'created_at'], name='service_task_fetch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicetask',
+            index=models.Index(condition=models.Q(('state', 'ACTIVATED')), fields=['lock_expires_at'], name='service_task_deadline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicetask',
+            index=models.Index(condition=models.Q(('state', 'NEW')), fields=['next_retry_at'], name='service_task_retry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowinstance',
+            index=models.Index(condition=models.Q(('parent__isnull', True), ('state', 'RUNNING')), fields=['updated_at'], name='running_instance_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='messagetaskevent',
+            constraint=models.UniqueConstraint(fields=('workflow_instance', 'task_name'), name='unique_message_task_event'),
+        ),
+        migrations.AddConstraint(
+            model_name='servicetask',
+            constraint=models.UniqueConstraint(fields=('workflow_instance', 'task_name'), name='unique_service_task'),
+        ),
+        migrations.AddConstraint(
+            model_name='usertask',
+            constraint=models.UniqueConstraint(fields=('workflow_instance', 'task_name'), name='unique_user_task'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0 on 2026-10-17 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_engine_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagetaskevent',
+            name='correlation_key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='messagetaskevent',
+            index=models.Index(condition=models.Q(('state', 'WAITING')), fields=['message_name', 'correlation_key'], name='message_correlation_idx'),
+        ),
+    ]
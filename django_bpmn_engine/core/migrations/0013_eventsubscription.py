@@ -0,0 +1,40 @@
+# Generated by Django 4.0 on 2026-10-17 01:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_messagetaskevent_correlation_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSubscription',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('task_name', models.CharField(max_length=50)),
+                ('event_type', models.CharField(choices=[('SIGNAL', 'SIGNAL')], max_length=20)),
+                ('event_name', models.CharField(max_length=100)),
+                ('state', models.CharField(choices=[('WAITING', 'WAITING'), ('RECEIVED', 'RECEIVED')], default='WAITING', max_length=20)),
+                ('workflow_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='event_subscriptions', to='core.workflowinstance')),
+            ],
+            options={
+                'verbose_name': 'EventSubscription',
+                'verbose_name_plural': 'EventSubscriptions',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='eventsubscription',
+            index=models.Index(condition=models.Q(('state', 'WAITING')), fields=['event_type', 'event_name', 'created_at'], name='event_subscription_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='eventsubscription',
+            constraint=models.UniqueConstraint(fields=('workflow_instance', 'task_name'), name='unique_event_subscription'),
+        ),
+    ]
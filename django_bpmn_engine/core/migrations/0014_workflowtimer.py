@@ -0,0 +1,65 @@
+# Generated by Django 4.0 on 2026-10-17 01:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+import uuid
+
+from django.utils import timezone
+
+
+def move_periodic_tasks_to_timers(apps, schema_editor):
+    # The timers used to be one PeriodicTask each, they become timers due now and are scheduled again by the run
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    WorkflowInstance = apps.get_model("core", "WorkflowInstance")
+    WorkflowTimer = apps.get_model("core", "WorkflowTimer")
+    periodic_tasks = PeriodicTask.objects.filter(task="django_bpmn_engine.core.workflow.service.run_workflow")
+    timers = {}
+    for periodic_task in periodic_tasks:
+        workflow_instance_id = json.loads(periodic_task.args)[0]
+        timers[(workflow_instance_id, periodic_task.name)] = WorkflowTimer(
+            workflow_instance_id=workflow_instance_id, task_name=periodic_task.name, due_at=timezone.now()
+        )
+    running_instances = set(
+        str(instance_id)
+        for instance_id in WorkflowInstance.objects.filter(
+            id__in=[workflow_instance_id for workflow_instance_id, _ in timers], state="RUNNING"
+        ).values_list("id", flat=True)
+    )
+    WorkflowTimer.objects.bulk_create(
+        [timer for (workflow_instance_id, _), timer in timers.items() if workflow_instance_id in running_instances],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    periodic_tasks.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_eventsubscription'),
+        ('django_celery_beat', '0016_alter_crontabschedule_timezone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowTimer',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('task_name', models.CharField(max_length=50)),
+                ('due_at', models.DateTimeField(db_index=True)),
+                ('workflow_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timers', to='core.workflowinstance')),
+            ],
+            options={
+                'verbose_name': 'WorkflowTimer',
+                'verbose_name_plural': 'WorkflowTimers',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='workflowtimer',
+            constraint=models.UniqueConstraint(fields=('workflow_instance', 'task_name'), name='unique_workflow_timer'),
+        ),
+        migrations.RunPython(move_periodic_tasks_to_timers, migrations.RunPython.noop),
+    ]
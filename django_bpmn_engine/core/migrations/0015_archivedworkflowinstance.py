@@ -0,0 +1,34 @@
+# Generated by Django 4.0 on 2026-10-17 01:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_workflowtimer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedWorkflowInstance',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('state', models.CharField(choices=[('RUNNING', 'RUNNING'), ('COMPLETED', 'COMPLETED'), ('CANCELED', 'CANCELED'), ('FAILURE', 'FAILURE')], max_length=20)),
+                ('instance_created_at', models.DateTimeField()),
+                ('instance_updated_at', models.DateTimeField()),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('data', models.BinaryField(blank=True, null=True)),
+                ('path', models.CharField(blank=True, max_length=255, null=True)),
+                ('workflow', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_instances', to='core.workflow')),
+            ],
+            options={
+                'verbose_name': 'ArchivedWorkflowInstance',
+                'verbose_name_plural': 'ArchivedWorkflowInstances',
+            },
+        ),
+    ]
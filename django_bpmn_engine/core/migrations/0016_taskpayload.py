@@ -0,0 +1,34 @@
+# Generated by Django 4.0 on 2026-10-17 01:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_archivedworkflowinstance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskPayload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('data', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'TaskPayload',
+                'verbose_name_plural': 'TaskPayloads',
+            },
+        ),
+        migrations.AddField(
+            model_name='workflowtaskinstance',
+            name='payload',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.taskpayload', to_field='hash'),
+        ),
+    ]
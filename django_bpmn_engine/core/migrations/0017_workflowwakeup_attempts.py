@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-17 01:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_taskpayload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowwakeup',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='workflowwakeup',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
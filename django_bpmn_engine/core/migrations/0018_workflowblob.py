@@ -0,0 +1,46 @@
+# Generated by Django 4.0 on 2026-10-17 02:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_workflowwakeup_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowBlob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('key', models.CharField(max_length=64, unique=True)),
+            ],
+            options={
+                'verbose_name': 'WorkflowBlob',
+                'verbose_name_plural': 'WorkflowBlobs',
+            },
+        ),
+        migrations.CreateModel(
+            name='WorkflowBlobReference',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('workflow_instance_id', models.UUIDField(db_index=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='references', to='core.workflowblob', to_field='key')),
+            ],
+            options={
+                'verbose_name': 'WorkflowBlobReference',
+                'verbose_name_plural': 'WorkflowBlobReferences',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='workflowblobreference',
+            constraint=models.UniqueConstraint(fields=('blob', 'workflow_instance_id'), name='unique_workflow_blob_reference'),
+        ),
+    ]
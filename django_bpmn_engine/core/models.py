@@ -1,10 +1,30 @@
+import hashlib
+import json
 import uuid
 
+from datetime import timedelta
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+
+from django.conf import settings
+from django.db import connections
 from django.db import models
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import Exists
+from django.db.models import F
+from django.db.models import Max
+from django.db.models import OuterRef
+from django.db.models import Sum
+from django.utils import timezone
 from django_jsonform.models.fields import JSONField
 from SpiffWorkflow.task import TaskStateNames
 
 from django_bpmn_engine.core.utils import convert_form_dict_to_json_schema
+from django_bpmn_engine.core.workflow.cache import bump_spec_stamp
+from django_bpmn_engine.core.workflow.cache import workflow_spec_cache
 
 
 class WorkflowState(models.TextChoices):
@@ -32,8 +52,30 @@ class MessageTaskEventState(models.TextChoices):
     RECEIVED = "RECEIVED", "RECEIVED"
 
 
+class ArchiveBackend(models.TextChoices):
+    DATABASE = "DATABASE", "DATABASE"
+    FILE = "FILE", "FILE"
+
+
+class EventSubscriptionType(models.TextChoices):
+    SIGNAL = "SIGNAL", "SIGNAL"
+
+
+class EventSubscriptionState(models.TextChoices):
+    WAITING = "WAITING", "WAITING"
+    RECEIVED = "RECEIVED", "RECEIVED"
+
+
+class PersistenceMode(models.TextChoices):
+    TASKS = "TASKS", "TASKS"
+    SNAPSHOT = "SNAPSHOT", "SNAPSHOT"
+
+
 TaskStateChoices = [(key, value) for key, value in TaskStateNames.items()]
 
+# Postgres channel notified when a wakeup is recorded
+WORKFLOW_WAKEUP_CHANNEL = "workflow_wakeup"
+
 
 class BaseModelMixin(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -44,18 +86,66 @@ class BaseModelMixin(models.Model):
         abstract = True
 
 
+class WorkflowManager(models.Manager):
+    def get_deployed(self, workflow_process_id: str):
+        """
+        Row the process is loaded from when another workflow calls it: the highest version, and the
+        last updated one among the rows of that version.
+        """
+        return self.filter(workflow_process_id=workflow_process_id).order_by("-version", "-updated_at", "-id").first()
+
+    def get_spec_stamps(self, workflow_process_ids) -> Dict[str, str]:
+        """
+        Last updated_at of the rows of each process, which changes whenever the deployed row may have.
+        """
+        if not workflow_process_ids:
+            return {}
+        stamps = (
+            self.filter(workflow_process_id__in=workflow_process_ids)
+            .order_by()
+            .values("workflow_process_id")
+            .annotate(last_updated_at=Max("updated_at"))
+            .values_list("workflow_process_id", "last_updated_at")
+        )
+        return {workflow_process_id: last_updated_at.isoformat() for workflow_process_id, last_updated_at in stamps}
+
+
 class Workflow(BaseModelMixin):
     xml = models.TextField()
     workflow_process_id = models.CharField(max_length=100)
     version = models.PositiveSmallIntegerField(default=1)
     name = models.CharField(max_length=100)
+    compiled_spec = models.JSONField(null=True, blank=True, editable=False)
+
+    objects = WorkflowManager()
 
     class Meta:
         verbose_name = "Workflow"
         verbose_name_plural = "Workflows"
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, compile_spec=None, **kwargs):
+        """
+        :param compile_spec: parse the xml and store the serialized specs in `compiled_spec`,
+            so the workers don't need to parse it. Defaults to settings.WORKFLOW_COMPILE_SPEC.
+        """
+        if compile_spec is None:
+            compile_spec = settings.WORKFLOW_COMPILE_SPEC
+        if compile_spec:
+            # Imported here because the service depends on this module
+            from django_bpmn_engine.core.workflow.service import WorkflowService
+
+            WorkflowService().compile_workflow(self)
         super().save(*args, **kwargs)
+        workflow_spec_cache.invalidate(self)
+        # After the commit, or other processes could check their specs against the previous rows
+        transaction.on_commit(bump_spec_stamp)
+
+    def delete(self, *args, **kwargs):
+        # Before the delete, which clears the id the entries are keyed on
+        workflow_spec_cache.invalidate(self)
+        result = super().delete(*args, **kwargs)
+        transaction.on_commit(bump_spec_stamp)
+        return result
 
     def __str__(self):
         return f"{self.name} ({self.workflow_process_id})"
@@ -77,10 +167,255 @@ class WorkflowInstance(BaseModelMixin):
     root = models.UUIDField(null=True, blank=True)
     success = models.BooleanField(default=True)
     parent = models.ForeignKey("self", null=True, blank=True, on_delete=models.CASCADE)
+    # Compressed workflow state, used when WORKFLOW_PERSISTENCE_MODE is SNAPSHOT
+    snapshot = models.BinaryField(null=True, blank=True, editable=False)
+    snapshot_version = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name = "WorkflowInstance"
         verbose_name_plural = "WorkflowInstances"
+        indexes = [
+            # Scan of the run_workflows command
+            models.Index(
+                fields=["updated_at"],
+                name="running_instance_idx",
+                condition=models.Q(state=WorkflowState.RUNNING, parent__isnull=True),
+            ),
+        ]
+
+
+class WorkflowWakeupManager(models.Manager):
+    def wake(self, workflow_instance_ids, reason: str):
+        """
+        Record a pending wakeup for each root instance. An instance has at most one pending wakeup,
+        so a burst of events is handled by a single run.
+        """
+        wakeups = [
+            self.model(workflow_instance_id=workflow_instance_id, reason=reason)
+            for workflow_instance_id in workflow_instance_ids
+        ]
+        self.bulk_create(wakeups, ignore_conflicts=True)
+        connection = connections[self.db]
+        if connection.vendor == "postgresql":
+            # Delivered on commit, lets idle runners skip their polling interval
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, '')", [WORKFLOW_WAKEUP_CHANNEL])
+
+    def claim(self, workflow_instance_id) -> bool:
+        """
+        Delete the pending wakeup of the instance, before running it in the same transaction. A wakeup being
+        claimed by another run is waited for. Returns whether there was one, if not its events were handled.
+        """
+        deleted, _ = self.filter(workflow_instance_id=workflow_instance_id).delete()
+        return deleted > 0
+
+    def claimable(self):
+        return self.filter(models.Q(next_attempt_at__isnull=True) | models.Q(next_attempt_at__lte=timezone.now()))
+
+    def postpone(self, workflow_instance_id) -> bool:
+        """
+        Put off the wakeup of an instance whose run failed, so the runners go on with the other ones.
+        The delay doubles on each failed attempt, up to WORKFLOW_WAKEUP_MAX_BACKOFF seconds.
+        """
+        wakeup = self.filter(workflow_instance_id=workflow_instance_id).first()
+        if wakeup is None:
+            return False
+        delay = min(settings.WORKFLOW_WAKEUP_RETRY_BACKOFF * 2**wakeup.attempts, settings.WORKFLOW_WAKEUP_MAX_BACKOFF)
+        wakeup.attempts += 1
+        wakeup.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        wakeup.save(update_fields=["attempts", "next_attempt_at", "updated_at"])
+        return True
+
+
+class WorkflowWakeup(BaseModelMixin):
+    """
+    Pending run of a root workflow instance, consumed by the `run_workflows` command.
+    """
+
+    workflow_instance = models.OneToOneField(
+        WorkflowInstance, related_name="wakeup", on_delete=models.CASCADE
+    )
+    reason = models.CharField(max_length=50)
+    # Failed runs of the instance since the wakeup was recorded, and when it can be claimed again
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    objects = WorkflowWakeupManager()
+
+    class Meta:
+        verbose_name = "WorkflowWakeup"
+        verbose_name_plural = "WorkflowWakeups"
+
+
+class TaskPayloadManager(models.Manager):
+    @staticmethod
+    def make_hash(data) -> str:
+        canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def store(self, payloads: Dict[str, Any]):
+        """
+        Insert the {hash: data} payloads, the ones already stored are left as they are. On PostgreSQL they
+        are then all locked FOR KEY SHARE until the transaction ends, so `delete_unreferenced` can't delete
+        one before the tasks referencing it are committed. A payload deleted meanwhile is inserted again.
+        """
+        connection = connections[self.db]
+        while payloads:
+            self.bulk_create(
+                [TaskPayload(hash=key, data=data) for key, data in payloads.items()], ignore_conflicts=True
+            )
+            if connection.vendor != "postgresql":
+                return
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT hash FROM {connection.ops.quote_name(self.model._meta.db_table)} "
+                    f"WHERE hash = ANY(%s) FOR KEY SHARE",
+                    [list(payloads)],
+                )
+                locked = {key for key, in cursor.fetchall()}
+            payloads = {key: data for key, data in payloads.items() if key not in locked}
+
+    def resolve(self, hashes: Iterable[str]) -> Dict[str, Any]:
+        return dict(self.filter(hash__in=set(hashes)).values_list("hash", "data"))
+
+    def delete_unreferenced(self, hashes: Iterable[str]) -> int:
+        """
+        Delete the payloads among `hashes` that no task references anymore. Must run inside a transaction:
+        they are locked FOR UPDATE with SKIP LOCKED, so a payload a run is storing again, which `store`
+        holds FOR KEY SHARE, is skipped and left for a later cleanup.
+        """
+        referenced = WorkflowTaskInstance.objects.filter(payload_id=OuterRef("hash"))
+        unreferenced = list(
+            self.select_for_update(skip_locked=True)
+            .filter(hash__in=set(hashes))
+            .exclude(Exists(referenced))
+            .values_list("id", flat=True)
+        )
+        deleted, _ = self.filter(id__in=unreferenced).delete()
+        return deleted
+
+    def get_orphans(self, older_than, limit: int):
+        """
+        Hashes of the payloads created before `older_than` that no task references, left behind
+        when the data of a task changes.
+        """
+        referenced = WorkflowTaskInstance.objects.filter(payload_id=OuterRef("hash"))
+        return list(
+            self.filter(created_at__lt=older_than).exclude(Exists(referenced)).values_list("hash", flat=True)[:limit]
+        )
+
+
+class TaskPayload(BaseModelMixin):
+    """
+    Task data stored once per distinct content, keyed by the sha256 of its canonical JSON. Tasks
+    inherit the data of their parent, so most of the tasks of an instance share a few payloads.
+    """
+
+    hash = models.CharField(max_length=64, unique=True)
+    data = models.JSONField(default=dict)
+
+    objects = TaskPayloadManager()
+
+    class Meta:
+        verbose_name = "TaskPayload"
+        verbose_name_plural = "TaskPayloads"
+
+
+class WorkflowBlobManager(models.Manager):
+    def hold(self, keys: Iterable[str]):
+        """
+        Insert the rows of the blobs, the ones already there are left as they are. On PostgreSQL they are
+        then locked FOR KEY SHARE until the transaction ends, so `delete_unreferenced` can't delete one
+        before the instance using it records its reference. A blob deleted meanwhile is inserted again.
+        """
+        connection = connections[self.db]
+        keys = set(keys)
+        while keys:
+            self.bulk_create([WorkflowBlob(key=key) for key in keys], ignore_conflicts=True)
+            if connection.vendor != "postgresql":
+                return
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT key FROM {connection.ops.quote_name(self.model._meta.db_table)} "
+                    f"WHERE key = ANY(%s) FOR KEY SHARE",
+                    [list(keys)],
+                )
+                keys -= {key for key, in cursor.fetchall()}
+
+    def add_references(self, workflow_instance_id, keys: Iterable[str]):
+        """
+        Record that the root instance uses the blobs, they are kept while it exists or is archived.
+        """
+        WorkflowBlobReference.objects.bulk_create(
+            [WorkflowBlobReference(blob_id=key, workflow_instance_id=workflow_instance_id) for key in set(keys)],
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def _referenced():
+        instances = WorkflowInstance.objects.filter(id=OuterRef("workflow_instance_id"))
+        archived = ArchivedWorkflowInstance.objects.filter(id=OuterRef("workflow_instance_id"))
+        return WorkflowBlobReference.objects.filter(blob_id=OuterRef("key")).filter(
+            models.Q(Exists(instances)) | models.Q(Exists(archived))
+        )
+
+    def delete_unreferenced(self, keys: Iterable[str]) -> List[str]:
+        """
+        Delete the rows of the blobs among `keys` that no instance uses anymore and return their keys, so
+        the files can be deleted too. Must run inside a transaction: the rows are locked FOR UPDATE with
+        SKIP LOCKED, so a blob a run is offloading again, which `hold` locks, is left for a later cleanup.
+        """
+        unreferenced = list(
+            self.select_for_update(skip_locked=True)
+            .filter(key__in=set(keys))
+            .exclude(Exists(self._referenced()))
+            .values_list("key", flat=True)
+        )
+        self.filter(key__in=unreferenced).delete()
+        return unreferenced
+
+    def get_orphans(self, older_than, limit: int):
+        """
+        Keys of the blobs created before `older_than` that no instance uses, left behind when the
+        instances using them are deleted or when a variable changes.
+        """
+        return list(
+            self.filter(created_at__lt=older_than)
+            .exclude(Exists(self._referenced()))
+            .values_list("key", flat=True)[:limit]
+        )
+
+
+class WorkflowBlob(BaseModelMixin):
+    """
+    Blob of the blob store, see `BlobStore`. Its file is deleted with the row once no root instance,
+    running or archived, references it anymore.
+    """
+
+    key = models.CharField(max_length=64, unique=True)
+
+    objects = WorkflowBlobManager()
+
+    class Meta:
+        verbose_name = "WorkflowBlob"
+        verbose_name_plural = "WorkflowBlobs"
+
+
+class WorkflowBlobReference(BaseModelMixin):
+    """
+    Blob used by the data of a root instance or of its subprocesses. There is no foreign key to the
+    instance, the reference stays when the instance is archived.
+    """
+
+    blob = models.ForeignKey(WorkflowBlob, to_field="key", related_name="references", on_delete=models.CASCADE)
+    workflow_instance_id = models.UUIDField(db_index=True)
+
+    class Meta:
+        verbose_name = "WorkflowBlobReference"
+        verbose_name_plural = "WorkflowBlobReferences"
+        constraints = [
+            models.UniqueConstraint(fields=["blob", "workflow_instance_id"], name="unique_workflow_blob_reference")
+        ]
 
 
 class WorkflowTaskInstance(BaseModelMixin):
@@ -95,13 +430,103 @@ class WorkflowTaskInstance(BaseModelMixin):
     triggered = models.BooleanField()
     workflow_name = models.CharField(max_length=50)
     internal_data = models.JSONField(default=dict)
+    # Only used by the rows saved before the payloads, the others keep their data in `payload`
     data = models.JSONField(default=dict)
+    payload = models.ForeignKey(
+        TaskPayload, to_field="hash", related_name="+", on_delete=models.PROTECT, blank=True, null=True
+    )
+
+    def get_data(self):
+        return self.payload.data if self.payload_id else self.data
 
     class Meta:
         verbose_name = "WorkflowTaskInstance"
         verbose_name_plural = "WorkflowTaskInstances"
 
 
+class WorkflowTaskStateCounterManager(models.Manager):
+    def add(self, workflow_id, shard: int, deltas):
+        """
+        Apply the {(task_spec, state): delta} changes of one transaction to the counters of `shard`.
+        The rows are updated in key order, so concurrent transactions can't deadlock on them.
+        """
+        for task_spec, state in sorted(key for key, delta in deltas.items() if delta):
+            counter = self.filter(workflow_id=workflow_id, task_spec=task_spec, state=state, shard=shard)
+            delta = deltas[(task_spec, state)]
+            if not counter.update(count=F("count") + delta):
+                self.bulk_create(
+                    [self.model(workflow_id=workflow_id, task_spec=task_spec, state=state, shard=shard)],
+                    ignore_conflicts=True,
+                )
+                counter.update(count=F("count") + delta)
+
+    def get_counts(self, workflow_id, states):
+        """
+        Return the task count of each (task_spec, state) of the workflow, as {task_spec: {state: count}}.
+        """
+        counts = (
+            self.filter(workflow_id=workflow_id, state__in=states)
+            .values("task_spec", "state")
+            .annotate(total=Sum("count"))
+            .filter(total__gt=0)
+        )
+        stats = {}
+        for count in counts:
+            stats.setdefault(count["task_spec"], {})[count["state"]] = count["total"]
+        return stats
+
+    def rebuild(self, workflow_ids=None):
+        """
+        Recount the tasks of the workflows, or of all of them, from the WorkflowTaskInstance rows.
+        """
+        tasks = WorkflowTaskInstance.objects.all()
+        counters = self.all()
+        if workflow_ids is not None:
+            tasks = tasks.filter(workflow_instance__workflow_id__in=workflow_ids)
+            counters = counters.filter(workflow_id__in=workflow_ids)
+        totals = tasks.values("workflow_instance__workflow_id", "task_spec", "state").annotate(
+            total=Count("id")
+        )
+        with transaction.atomic():
+            counters.delete()
+            self.bulk_create(
+                [
+                    self.model(
+                        workflow_id=total["workflow_instance__workflow_id"],
+                        task_spec=total["task_spec"],
+                        state=total["state"],
+                        count=total["total"],
+                    )
+                    for total in totals.iterator()
+                ],
+                batch_size=1000,
+            )
+
+
+class WorkflowTaskStateCounter(BaseModelMixin):
+    """
+    Number of WorkflowTaskInstance rows of a workflow per task spec and state, kept up to date
+    by the engine. Each key is split in shards, so concurrent runs rarely wait on the same row.
+    """
+
+    workflow = models.ForeignKey(Workflow, related_name="task_state_counters", on_delete=models.CASCADE)
+    task_spec = models.CharField(max_length=50)
+    state = models.PositiveSmallIntegerField(choices=TaskStateChoices)
+    shard = models.PositiveSmallIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+
+    objects = WorkflowTaskStateCounterManager()
+
+    class Meta:
+        verbose_name = "WorkflowTaskStateCounter"
+        verbose_name_plural = "WorkflowTaskStateCounters"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["workflow", "task_spec", "state", "shard"], name="unique_workflow_task_state_counter"
+            )
+        ]
+
+
 class ServiceTask(BaseModelMixin):
     task_name = models.CharField(max_length=50)
     workflow_instance = models.ForeignKey(
@@ -116,10 +541,58 @@ class ServiceTask(BaseModelMixin):
         choices=ServiceTaskState.choices,
         default=ServiceTaskState.NEW,
     )
+    # Set when the task is claimed through fetch-and-lock
+    worker_id = models.CharField(max_length=100, null=True, blank=True)
+    # Deadline of the ACTIVATED task, once it passes the task is retried or fails
+    lock_expires_at = models.DateTimeField(null=True, blank=True)
+    retries = models.PositiveSmallIntegerField(default=0)
+    # Set while a retry waits for its backoff, the task goes back to its queue once it passes
+    next_retry_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         verbose_name = "ServiceTask"
         verbose_name_plural = "ServiceTasks"
+        constraints = [
+            models.UniqueConstraint(fields=["workflow_instance", "task_name"], name="unique_service_task"),
+        ]
+        indexes = [
+            models.Index(fields=["workflow_instance", "state"], name="service_task_state_idx"),
+            # NEW tasks waiting for a worker, read by fetch-and-lock
+            models.Index(
+                fields=["queue_name", "created_at"],
+                name="service_task_fetch_idx",
+                condition=models.Q(state=ServiceTaskState.NEW, next_retry_at__isnull=True),
+            ),
+            # Deadlines and retries scanned by the reaper
+            models.Index(
+                fields=["lock_expires_at"],
+                name="service_task_deadline_idx",
+                condition=models.Q(state=ServiceTaskState.ACTIVATED),
+            ),
+            models.Index(
+                fields=["next_retry_at"],
+                name="service_task_retry_idx",
+                condition=models.Q(state=ServiceTaskState.NEW),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.state in [ServiceTaskState.COMPLETED, ServiceTaskState.FAILURE]:
+            WorkflowWakeup.objects.wake([self.workflow_instance_id], reason=f"ServiceTask {self.state}")
+
+
+class ServiceTaskOutbox(BaseModelMixin):
+    """
+    Service task waiting to be published to its queue, written in the same transaction as the task.
+    """
+
+    service_task = models.OneToOneField(ServiceTask, related_name="outbox", on_delete=models.CASCADE)
+    queue_name = models.CharField(max_length=50)
+
+    class Meta:
+        verbose_name = "ServiceTaskOutbox"
+        verbose_name_plural = "ServiceTaskOutbox"
 
 
 class UserTask(BaseModelMixin):
@@ -140,6 +613,14 @@ class UserTask(BaseModelMixin):
     class Meta:
         verbose_name = "UserTask"
         verbose_name_plural = "UserTasks"
+        constraints = [
+            models.UniqueConstraint(fields=["workflow_instance", "task_name"], name="unique_user_task"),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.state == UserTaskState.COMPLETED:
+            WorkflowWakeup.objects.wake([self.workflow_instance_id], reason=f"UserTask {self.state}")
 
 
 class MessageTaskEvent(BaseModelMixin):
@@ -150,6 +631,8 @@ class MessageTaskEvent(BaseModelMixin):
     input_data = models.JSONField(default=dict, null=True, blank=True)
     output_data = models.JSONField(default=dict, null=True, blank=True)
     message_name = models.CharField(max_length=100)
+    # Value of the `correlationKey` expression of the catch event, evaluated when it starts waiting
+    correlation_key = models.CharField(max_length=255, null=True, blank=True)
     state = models.CharField(
         max_length=20,
         choices=MessageTaskEventState.choices,
@@ -159,6 +642,71 @@ class MessageTaskEvent(BaseModelMixin):
     class Meta:
         verbose_name = "MessageTaskEvent"
         verbose_name_plural = "MessageTaskEvents"
+        constraints = [
+            models.UniqueConstraint(fields=["workflow_instance", "task_name"], name="unique_message_task_event"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["message_name", "correlation_key"],
+                name="message_correlation_idx",
+                condition=models.Q(state=MessageTaskEventState.WAITING),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.state == MessageTaskEventState.RECEIVED:
+            WorkflowWakeup.objects.wake([self.workflow_instance_id], reason=f"MessageTaskEvent {self.state}")
+
+
+class WorkflowTimer(BaseModelMixin):
+    """
+    Waiting timer event of an instance, the `fire_due_timers` scheduler wakes the instance up once it is due.
+    """
+
+    workflow_instance = models.ForeignKey(WorkflowInstance, related_name="timers", on_delete=models.CASCADE)
+    task_name = models.CharField(max_length=50)
+    due_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "WorkflowTimer"
+        verbose_name_plural = "WorkflowTimers"
+        constraints = [
+            models.UniqueConstraint(fields=["workflow_instance", "task_name"], name="unique_workflow_timer"),
+        ]
+
+
+class EventSubscription(BaseModelMixin):
+    """
+    Catch event of an instance waiting for an event thrown from outside, so the instances listening
+    to an event are found without loading their workflows.
+    """
+
+    workflow_instance = models.ForeignKey(
+        WorkflowInstance, related_name="event_subscriptions", on_delete=models.CASCADE
+    )
+    task_name = models.CharField(max_length=50)
+    event_type = models.CharField(max_length=20, choices=EventSubscriptionType.choices)
+    event_name = models.CharField(max_length=100)
+    state = models.CharField(
+        max_length=20,
+        choices=EventSubscriptionState.choices,
+        default=EventSubscriptionState.WAITING,
+    )
+
+    class Meta:
+        verbose_name = "EventSubscription"
+        verbose_name_plural = "EventSubscriptions"
+        constraints = [
+            models.UniqueConstraint(fields=["workflow_instance", "task_name"], name="unique_event_subscription"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["event_type", "event_name", "created_at"],
+                name="event_subscription_idx",
+                condition=models.Q(state=EventSubscriptionState.WAITING),
+            ),
+        ]
 
 
 class Incident(BaseModelMixin):
@@ -173,3 +721,25 @@ class Incident(BaseModelMixin):
     class Meta:
         verbose_name = "Incident"
         verbose_name_plural = "Incidents"
+
+
+class ArchivedWorkflowInstance(BaseModelMixin):
+    """
+    Root workflow instance moved out of the engine tables, with the rows of its subprocesses and tasks
+    as gzipped JSON lines, stored in `data` or in the file at `path` depending on the archive backend.
+    The id is the one the instance had.
+    """
+
+    workflow = models.ForeignKey(
+        Workflow, related_name="archived_instances", null=True, blank=True, on_delete=models.SET_NULL
+    )
+    state = models.CharField(max_length=20, choices=WorkflowState.choices)
+    instance_created_at = models.DateTimeField()
+    instance_updated_at = models.DateTimeField()
+    rows = models.PositiveIntegerField(default=0)
+    data = models.BinaryField(null=True, blank=True, editable=False)
+    path = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        verbose_name = "ArchivedWorkflowInstance"
+        verbose_name_plural = "ArchivedWorkflowInstances"
@@ -0,0 +1,159 @@
+import base64
+import gzip
+import json
+
+from collections import Counter
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from django_bpmn_engine.core.models import ArchiveBackend
+from django_bpmn_engine.core.models import ArchivedWorkflowInstance
+from django_bpmn_engine.core.models import EventSubscription
+from django_bpmn_engine.core.models import Incident
+from django_bpmn_engine.core.models import MessageTaskEvent
+from django_bpmn_engine.core.models import ServiceTask
+from django_bpmn_engine.core.models import TaskPayload
+from django_bpmn_engine.core.models import UserTask
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowState
+from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.models import WorkflowTaskStateCounter
+
+ARCHIVED_STATES = [WorkflowState.COMPLETED, WorkflowState.CANCELED]
+
+# Rows archived with their workflow instance, the remaining relations are deleted by the cascade
+ARCHIVED_MODELS = [WorkflowTaskInstance, ServiceTask, UserTask, MessageTaskEvent, Incident, EventSubscription]
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        if isinstance(o, (bytes, memoryview)):
+            return base64.b64encode(bytes(o)).decode()
+        return super().default(o)
+
+
+def _archive_lines(workflow_instances: List[Dict[str, Any]], rows: Dict[str, List[Dict[str, Any]]]) -> Iterator[str]:
+    for workflow_instance in workflow_instances:
+        yield json.dumps({"model": "WorkflowInstance", "fields": workflow_instance}, cls=ArchiveEncoder)
+    for model_name, model_rows in rows.items():
+        for row in model_rows:
+            yield json.dumps({"model": model_name, "fields": row}, cls=ArchiveEncoder)
+
+
+def _archive_path(archived: ArchivedWorkflowInstance) -> Path:
+    created_at = archived.instance_created_at
+    return Path(settings.WORKFLOW_ARCHIVE_DIR) / f"{created_at:%Y}" / f"{created_at:%m}" / f"{archived.id}.jsonl.gz"
+
+
+def archive_workflow_instances(batch_size: int, older_than) -> int:
+    """
+    Move a batch of COMPLETED/CANCELED root instances last updated before `older_than` out of the engine
+    tables, with their subprocesses and tasks. Each one is kept as gzipped JSON lines in the archive table,
+    or in a file with WORKFLOW_ARCHIVE_BACKEND=FILE. Returns how many instances were archived.
+    """
+    with transaction.atomic():
+        roots = list(
+            WorkflowInstance.objects.select_for_update(skip_locked=True)
+            .filter(parent__isnull=True, state__in=ARCHIVED_STATES, updated_at__lt=older_than)
+            .order_by("updated_at")
+            .values()[:batch_size]
+        )
+        if not roots:
+            return 0
+        root_ids = [root["id"] for root in roots]
+        subprocesses = defaultdict(list)
+        root_of = {root["id"]: root["id"] for root in roots}
+        for instance in WorkflowInstance.objects.filter(parent_id__in=root_ids).values().iterator():
+            subprocesses[instance["parent_id"]].append(instance)
+            root_of[instance["id"]] = instance["parent_id"]
+
+        rows: Dict[Any, Dict[str, List[Dict[str, Any]]]] = defaultdict(lambda: defaultdict(list))
+        for model in ARCHIVED_MODELS:
+            for row in model.objects.filter(workflow_instance_id__in=root_of.keys()).values().iterator():
+                rows[root_of[row["workflow_instance_id"]]][model.__name__].append(row)
+
+        # The archive keeps the data of the tasks, the payloads may be deleted with them
+        payload_ids = {
+            task["payload_id"]
+            for root_rows in rows.values()
+            for task in root_rows["WorkflowTaskInstance"]
+            if task["payload_id"]
+        }
+        payloads = TaskPayload.objects.resolve(payload_ids)
+        for root_rows in rows.values():
+            for task in root_rows["WorkflowTaskInstance"]:
+                if task["payload_id"]:
+                    task["data"] = payloads[task["payload_id"]]
+
+        counts: Dict[Any, Counter] = defaultdict(Counter)
+        archived_instances = []
+        for root in roots:
+            root_rows = rows[root["id"]]
+            for task in root_rows["WorkflowTaskInstance"]:
+                counts[root["workflow_id"]][(task["task_spec"], task["state"])] -= 1
+            archived = ArchivedWorkflowInstance(
+                id=root["id"],
+                workflow_id=root["workflow_id"],
+                state=root["state"],
+                instance_created_at=root["created_at"],
+                instance_updated_at=root["updated_at"],
+                rows=1 + len(subprocesses[root["id"]]) + sum(len(model_rows) for model_rows in root_rows.values()),
+            )
+            content = gzip.compress("\n".join(_archive_lines([root, *subprocesses[root["id"]]], root_rows)).encode("utf-8"))
+            if settings.WORKFLOW_ARCHIVE_BACKEND == ArchiveBackend.FILE:
+                # Written before the rows are deleted, a failed batch leaves a file that is overwritten later
+                path = _archive_path(archived)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(content)
+                archived.path = str(path)
+            else:
+                archived.data = content
+            archived_instances.append(archived)
+
+        ArchivedWorkflowInstance.objects.bulk_create(archived_instances)
+        for workflow_id, workflow_counts in counts.items():
+            WorkflowTaskStateCounter.objects.add(workflow_id, 0, workflow_counts)
+        WorkflowInstance.objects.filter(Q(id__in=root_ids) | Q(parent_id__in=root_ids)).delete()
+    delete_unreferenced_payloads(payload_ids)
+    return len(roots)
+
+
+def delete_unreferenced_payloads(payload_ids) -> int:
+    """
+    Delete the payloads among `payload_ids` left without tasks, in its own transaction. The ones being
+    stored again by a run are kept, see `TaskPayloadManager.delete_unreferenced`.
+    """
+    if not payload_ids:
+        return 0
+    with transaction.atomic():
+        return TaskPayload.objects.delete_unreferenced(payload_ids)
+
+
+def read_archived_workflow_instance(archived: ArchivedWorkflowInstance) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Load the rows of an archived instance, as {model name: [fields]}.
+    """
+    if archived.path:
+        content = Path(archived.path).read_bytes()
+    else:
+        content = bytes(archived.data)
+    rows: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for line in gzip.decompress(content).decode("utf-8").splitlines():
+        row = json.loads(line)
+        rows[row["model"]].append(row["fields"])
+    return rows
+
+
+def archive_cutoff():
+    return timezone.now() - timedelta(days=settings.WORKFLOW_ARCHIVE_AFTER_DAYS)
@@ -0,0 +1,279 @@
+import gzip
+import hashlib
+import json
+import re
+import threading
+
+from collections import OrderedDict
+from copy import deepcopy
+from functools import lru_cache
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.db import transaction
+from django.utils.module_loading import import_string
+from SpiffWorkflow.bpmn.PythonScriptEngine import Box
+from SpiffWorkflow.bpmn.serializer.bpmn_converters import BpmnDataConverter
+
+from django_bpmn_engine.core.models import WorkflowBlob
+
+BLOB_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Decompressed blobs kept in memory by each process, the tasks of an instance usually share the same ones
+BLOB_CACHE_SIZE = 32
+
+
+class BlobStore:
+    """
+    Variables offloaded from the instance data, stored gzipped under the sha256 of their JSON.
+
+    Any Django storage can hold them, the local filesystem by default, see WORKFLOW_BLOB_STORAGE.
+    Being addressed by their content, a value offloaded again is not written twice. Each blob has a
+    WorkflowBlob row, its file is deleted by the `delete_orphan_blobs` task once no instance uses it.
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return f"{key[:2]}/{key}.json.gz"
+
+    def exists(self, key: str) -> bool:
+        return bool(BLOB_KEY_RE.match(key)) and self.storage.exists(self._name(key))
+
+    def put(self, content: bytes) -> str:
+        key = hashlib.sha256(content).hexdigest()
+        # Held before looking for the file, so a cleanup can't delete it once it is found
+        WorkflowBlob.objects.hold([key])
+        name = self._name(key)
+        if not self.storage.exists(name):
+            self.storage.save(name, ContentFile(gzip.compress(content)))
+        return key
+
+    def delete(self, key: str):
+        with self._cache_lock:
+            self._cache.pop(key, None)
+        self.storage.delete(self._name(key))
+
+    def get_content(self, key: str) -> bytes:
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        with self.storage.open(self._name(key), "rb") as blob:
+            content = gzip.decompress(blob.read())
+        with self._cache_lock:
+            self._cache[key] = content
+            if len(self._cache) > BLOB_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return content
+
+    def get(self, key: str) -> Any:
+        # Parsed on each call, so the value can be changed without changing the cached one
+        return json.loads(self.get_content(key))
+
+
+def _box(value: Any) -> Any:
+    # Same as PythonScriptEngine.convert_to_box, which boxes the task data before scripts run
+    if isinstance(value, dict):
+        return Box({key: _box(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_box(item) for item in value]
+    return value
+
+
+@lru_cache(maxsize=None)
+def get_blob_store() -> BlobStore:
+    storage_class = import_string(settings.WORKFLOW_BLOB_STORAGE)
+    return BlobStore(storage_class(**settings.WORKFLOW_BLOB_STORAGE_OPTIONS))
+
+
+def delete_unreferenced_blobs(keys) -> int:
+    """
+    Delete the blobs among `keys` that no instance uses anymore, their rows and then their files, in its own
+    transaction. The ones being offloaded again by a run are kept, see `WorkflowBlobManager.delete_unreferenced`.
+    """
+    if not keys:
+        return 0
+    store = get_blob_store()
+    with transaction.atomic():
+        deleted = WorkflowBlob.objects.delete_unreferenced(keys)
+        for key in deleted:
+            store.delete(key)
+    return len(deleted)
+
+
+class BlobReference:
+    """
+    Variable whose value is in the blob store, it is loaded the first time it is used.
+
+    Scripts and expressions read it like the value itself: items, attributes of a dict,
+    iteration, `len`, `in`, comparisons and `str`.
+    """
+
+    __slots__ = ("key", "size", "_value", "_loaded")
+
+    def __init__(self, key: str, size: int, value: Any = None, loaded: bool = False):
+        self.key = key
+        self.size = size
+        self._value = value
+        self._loaded = loaded
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def value(self) -> Any:
+        if not self._loaded:
+            self._value = _box(get_blob_store().get(self.key))
+            self._loaded = True
+        return self._value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"key": self.key, "size": self.size}
+
+    @classmethod
+    def from_dict(cls, dct: Dict[str, Any]) -> "BlobReference":
+        return cls(dct["key"], dct["size"])
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        value = self.value
+        if isinstance(value, dict) and name in value:
+            return value[name]
+        return getattr(value, name)
+
+    def __getitem__(self, item):
+        return self.value[item]
+
+    def __setitem__(self, item, value):
+        self.value[item] = value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __contains__(self, item):
+        return item in self.value
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, BlobReference):
+            if not (self._loaded or other._loaded):
+                return self.key == other.key
+            other = other.value
+        return self.value == other
+
+    __hash__ = None
+
+    def __str__(self):
+        return str(self.value)
+
+    def __repr__(self):
+        return f"BlobReference(key={self.key!r}, size={self.size})"
+
+    def __copy__(self):
+        return BlobReference(self.key, self.size, self._value, self._loaded)
+
+    def __deepcopy__(self, memo):
+        return BlobReference(self.key, self.size, deepcopy(self._value, memo), self._loaded)
+
+
+class BlobDataConverter(BpmnDataConverter):
+    """
+    Data converter that moves the variables bigger than WORKFLOW_BLOB_THRESHOLD bytes of JSON
+    to the blob store, the data keeps a BlobReference in their place.
+
+    The references are restored without reading the store, a value is only read when a task uses it.
+    """
+
+    def __init__(self, threshold: int = None):
+        super().__init__()
+        self.threshold = settings.WORKFLOW_BLOB_THRESHOLD if threshold is None else threshold
+        # Values measured since the last `clear_offloaded`, by id, with the reference of the offloaded ones.
+        # The tasks share the objects of their parent's data, so each value is measured and written once
+        self._offloaded: Dict[int, Tuple[Any, BlobReference]] = {}
+        self._kept: Dict[int, Any] = {}
+        # Keys of the references converted since the last `pop_referenced_keys`
+        self._referenced_keys: Set[str] = set()
+        self.register(BlobReference, self._reference_to_dict, BlobReference.from_dict)
+
+    def clear_offloaded(self):
+        """
+        Forget the values measured, to be called once the data is saved since scripts may change them.
+        """
+        self._offloaded = {}
+        self._kept = {}
+
+    def pop_referenced_keys(self) -> Set[str]:
+        """
+        Keys of the blobs the data converted since the last call references, to be recorded for its instance.
+        """
+        keys, self._referenced_keys = self._referenced_keys, set()
+        return keys
+
+    def _reference_to_dict(self, reference: BlobReference) -> Dict[str, Any]:
+        if reference.loaded:
+            # The value may have been changed by a script, it is stored under its new key if so
+            reference = self._offload_value(reference.value, 0)
+        self._referenced_keys.add(reference.key)
+        return reference.to_dict()
+
+    def _offload_value(self, value: Any, threshold: int) -> Optional[BlobReference]:
+        """
+        Reference to `value` once stored, or None if its JSON is not bigger than `threshold` bytes.
+        """
+        if id(value) in self._offloaded:
+            return self._offloaded[id(value)][1]
+        if id(value) in self._kept:
+            return None
+        content = json.dumps(self.convert(value), sort_keys=True, separators=(",", ":")).encode("utf-8")
+        if len(content) <= threshold:
+            self._kept[id(value)] = value
+            return None
+        reference = BlobReference(get_blob_store().put(content), len(content), value, loaded=True)
+        self._offloaded[id(value)] = (value, reference)
+        return reference
+
+    def offload(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Replace, in place, the variables of `data` bigger than the threshold by references.
+        """
+        if not self.threshold:
+            return data
+        references = {}
+        for name, value in data.items():
+            if value is None or isinstance(value, (bool, int, float, BlobReference)):
+                continue
+            if isinstance(value, str) and len(value) <= self.threshold // 6:
+                # Short enough whatever the encoding of its characters
+                continue
+            reference = self._offload_value(value, self.threshold)
+            if reference is not None:
+                references[name] = reference
+        data.update(references)
+        return data
+
+    def convert_offloaded(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        JSON of `data`, which is stored on its own, like the input of a task, with the big variables offloaded.
+        """
+        try:
+            return self.convert(self.offload(data))
+        finally:
+            self.clear_offloaded()
@@ -0,0 +1,98 @@
+import hashlib
+import threading
+import uuid
+
+from collections import OrderedDict
+from typing import Any
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+SpecCacheKey = Tuple[str, int, str]
+
+# Shared by all the processes, changed once a Workflow change commits, see `get_spec_stamp`
+SPEC_STAMP_KEY = "workflow_spec_stamp"
+
+
+def get_spec_stamp() -> str:
+    """
+    Token changed whenever a Workflow is saved or deleted. The cached specs checked against the
+    database under the current token are up to date without querying it again.
+    """
+    stamp = cache.get(SPEC_STAMP_KEY)
+    if stamp is None:
+        # Lost or evicted, a new token only makes the entries be checked again
+        cache.add(SPEC_STAMP_KEY, uuid.uuid4().hex, timeout=None)
+        stamp = cache.get(SPEC_STAMP_KEY)
+    return stamp
+
+
+def bump_spec_stamp():
+    cache.set(SPEC_STAMP_KEY, uuid.uuid4().hex, timeout=None)
+
+
+class CachedSpec(NamedTuple):
+    spec: Any
+    subprocess_specs: Dict[str, Any]
+    # workflow_process_id -> last updated_at of the Workflow rows of the called processes
+    dependencies: Dict[str, Any]
+
+
+class WorkflowSpecCache:
+    """
+    Process-wide LRU cache of parsed workflow specs.
+
+    Entries are keyed by (workflow id, version, xml hash), so a changed
+    definition never matches a stale entry, even in other processes. Each
+    entry keeps the spec stamp its dependencies were last checked under.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[SpecCacheKey, Tuple[CachedSpec, Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(workflow) -> SpecCacheKey:
+        xml_hash = hashlib.sha1(workflow.xml.encode()).hexdigest()
+        return (str(workflow.id), workflow.version, xml_hash)
+
+    def get(self, key: SpecCacheKey) -> Tuple[Optional[CachedSpec], Optional[str]]:
+        """
+        Return the entry and the stamp it was checked under, (None, None) if there is none.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: SpecCacheKey, entry: CachedSpec, stamp: Optional[str] = None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (entry, stamp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, workflow):
+        """
+        Drop the entries of the workflow and of every workflow calling it as a subprocess.
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if key[0] == str(workflow.id) or workflow.workflow_process_id in self._entries[key][0].dependencies:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+workflow_spec_cache = WorkflowSpecCache(maxsize=settings.WORKFLOW_SPEC_CACHE_SIZE)
@@ -21,9 +21,7 @@ class CustomParser(BpmnParser):
         elif process_id_or_name in self.process_parsers:
             return self.process_parsers[process_id_or_name]
 
-        workflow = Workflow.objects.filter(
-            workflow_process_id=process_id_or_name
-        ).first()
+        workflow = Workflow.objects.get_deployed(process_id_or_name)
         if workflow:
             self.add_bpmn_from_str(workflow.xml)
             return self.get_process_parser(process_id_or_name)
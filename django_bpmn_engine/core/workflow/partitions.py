@@ -0,0 +1,197 @@
+import logging
+
+from collections import Counter
+from collections import defaultdict
+from datetime import date
+from datetime import datetime
+from datetime import timezone
+from typing import List
+
+from django.db import connection
+from django.db import transaction
+
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.models import WorkflowTaskStateCounter
+from django_bpmn_engine.core.workflow.archive import ARCHIVED_STATES
+from django_bpmn_engine.core.workflow.archive import delete_unreferenced_payloads
+
+logger = logging.getLogger(__name__)
+
+# Only the task table is partitioned, the other engine tables have unique constraints or foreign keys
+# pointing at them, which would have to include created_at once partitioned
+PARTITIONED_MODEL = WorkflowTaskInstance
+
+
+def _table() -> str:
+    return PARTITIONED_MODEL._meta.db_table
+
+
+def _add_months(month: date, months: int) -> date:
+    month_index = month.year * 12 + month.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"{_table()}_{month:%Y_%m}"
+
+
+def _bound(month: date) -> str:
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc).isoformat()
+
+
+def is_partitioned() -> bool:
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [connection.ops.quote_name(_table())]
+        )
+        return cursor.fetchone() is not None
+
+
+def get_partitions() -> List[date]:
+    """
+    Months of the existing monthly partitions, the default partition is left out.
+    """
+    prefix = f"{_table()}_"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s",
+            [_table()],
+        )
+        names = [name for name, in cursor.fetchall()]
+    months = []
+    for name in names:
+        suffix = name[len(prefix):] if name.startswith(prefix) else ""
+        try:
+            months.append(datetime.strptime(suffix, "%Y_%m").date())
+        except ValueError:
+            continue
+    return sorted(months)
+
+
+def create_partitions(months_ahead: int, first_month: date = None) -> List[str]:
+    """
+    Create the missing monthly partitions from `first_month`, the current month by default, up to
+    `months_ahead` months from now. Returns the names of the created partitions.
+    """
+    if not is_partitioned():
+        return []
+    current_month = date.today().replace(day=1)
+    month = (first_month or current_month).replace(day=1)
+    last_month = _add_months(current_month, months_ahead)
+    existing = set(get_partitions())
+    created = []
+    with connection.cursor() as cursor:
+        while month <= last_month:
+            if month not in existing:
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(_partition_name(month))} "
+                    f"PARTITION OF {connection.ops.quote_name(_table())} "
+                    f"FOR VALUES FROM (%s) TO (%s)",
+                    [_bound(month), _bound(_add_months(month, 1))],
+                )
+                created.append(_partition_name(month))
+            month = _add_months(month, 1)
+    return created
+
+
+def convert_to_partitioned(months_ahead: int):
+    """
+    Rebuild the task table as a table partitioned by month of created_at, copying its rows. The table is
+    locked for the whole copy, it must run in a maintenance window.
+    """
+    if connection.vendor != "postgresql":
+        raise NotImplementedError("Partitioning is only supported on PostgreSQL")
+    if is_partitioned():
+        return
+    table = _table()
+    quoted_table = connection.ops.quote_name(table)
+    old_table = connection.ops.quote_name(f"{table}_unpartitioned")
+    with transaction.atomic(), connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+        cursor.execute(f"LOCK TABLE {quoted_table} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"SELECT min(created_at) FROM {quoted_table}")
+        (first_created_at,) = cursor.fetchone()
+        cursor.execute(f"ALTER TABLE {quoted_table} RENAME TO {old_table}")
+        primary_key = next(name for name, constraint in constraints.items() if constraint["primary_key"])
+        # The index of the old primary key keeps its name when the table is renamed, the new one must use it
+        cursor.execute(
+            f"ALTER TABLE {old_table} RENAME CONSTRAINT {connection.ops.quote_name(primary_key)} "
+            f"TO {connection.ops.quote_name(f'{table}_unpartitioned_pkey')}"
+        )
+        cursor.execute(
+            f"CREATE TABLE {quoted_table} (LIKE {old_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE (created_at)"
+        )
+        # The primary key of a partitioned table must contain the partition key
+        cursor.execute(
+            f"ALTER TABLE {quoted_table} ADD CONSTRAINT {connection.ops.quote_name(primary_key)} "
+            f"PRIMARY KEY (id, created_at)"
+        )
+        default_partition = connection.ops.quote_name(f"{table}_default")
+        cursor.execute(f"CREATE TABLE {default_partition} PARTITION OF {quoted_table} DEFAULT")
+        create_partitions(months_ahead, first_month=first_created_at.date() if first_created_at else None)
+        cursor.execute(f"INSERT INTO {quoted_table} SELECT * FROM {old_table}")
+        cursor.execute(f"DROP TABLE {old_table}")
+        # Created after the copy and once the old ones are dropped, so they keep the names Django gave them
+        for name, constraint in constraints.items():
+            columns = ", ".join(connection.ops.quote_name(column) for column in constraint["columns"])
+            if constraint["foreign_key"]:
+                to_table, to_column = constraint["foreign_key"]
+                cursor.execute(
+                    f"ALTER TABLE {quoted_table} ADD CONSTRAINT {connection.ops.quote_name(name)} "
+                    f"FOREIGN KEY ({columns}) REFERENCES {connection.ops.quote_name(to_table)} "
+                    f"({connection.ops.quote_name(to_column)}) DEFERRABLE INITIALLY DEFERRED"
+                )
+            elif constraint["index"] and not constraint["primary_key"] and not constraint["unique"]:
+                cursor.execute(f"CREATE INDEX {connection.ops.quote_name(name)} ON {quoted_table} ({columns})")
+
+
+def drop_partitions(before: date, force: bool = False) -> List[str]:
+    """
+    Drop the monthly partitions ending before `before`, which is the retention of a partitioned table.
+    The task state counters are decreased by the dropped rows. A partition still holding tasks of an
+    instance that is not completed or canceled is kept, unless `force` is set, as a failed instance can
+    still be resumed. Returns the names of the dropped partitions.
+    """
+    if not is_partitioned():
+        return []
+    instance_table = connection.ops.quote_name(WorkflowInstance._meta.db_table)
+    dropped = []
+    for month in get_partitions():
+        if _add_months(month, 1) > before:
+            continue
+        partition = connection.ops.quote_name(_partition_name(month))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {partition} IN ACCESS EXCLUSIVE MODE")
+            if not force:
+                cursor.execute(
+                    f"SELECT 1 FROM {partition} task JOIN {instance_table} instance "
+                    f"ON instance.id = task.workflow_instance_id WHERE instance.state NOT IN %s LIMIT 1",
+                    [tuple(ARCHIVED_STATES)],
+                )
+                if cursor.fetchone() is not None:
+                    logger.warning(f"Partition {partition} has tasks of unfinished instances, it was kept")
+                    continue
+            cursor.execute(
+                f"SELECT instance.workflow_id, task.task_spec, task.state, count(*) FROM {partition} task "
+                f"JOIN {instance_table} instance ON instance.id = task.workflow_instance_id "
+                f"GROUP BY instance.workflow_id, task.task_spec, task.state"
+            )
+            counts = defaultdict(Counter)
+            for workflow_id, task_spec, state, total in cursor.fetchall():
+                counts[workflow_id][(task_spec, state)] -= total
+            for workflow_id, workflow_counts in counts.items():
+                WorkflowTaskStateCounter.objects.add(workflow_id, 0, workflow_counts)
+            cursor.execute(f"SELECT DISTINCT payload_id FROM {partition} WHERE payload_id IS NOT NULL")
+            payload_ids = [payload_id for payload_id, in cursor.fetchall()]
+            cursor.execute(f"ALTER TABLE {connection.ops.quote_name(_table())} DETACH PARTITION {partition}")
+            cursor.execute(f"DROP TABLE {partition}")
+        delete_unreferenced_payloads(payload_ids)
+        dropped.append(_partition_name(month))
+    return dropped
@@ -1,13 +1,57 @@
+import gzip
+import json
+
 from datetime import datetime
+from datetime import timezone
 
-from django.utils.timezone import make_aware
 from SpiffWorkflow.bpmn.serializer.workflow import BpmnWorkflowSerializer
 
+from django_bpmn_engine.core.workflow.blobs import BlobDataConverter
+
 
 class CustomSerializer(BpmnWorkflowSerializer):
+    def __init__(self, spec_converter=None, data_converter=None, **kwargs):
+        super().__init__(spec_converter, data_converter or BlobDataConverter(), **kwargs)
+
+    @staticmethod
+    def timestamp_to_datetime(timestamp: float) -> datetime:
+        return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
     def task_to_dict(self, task):
-        last_state_change = datetime.fromtimestamp(
-            task.last_state_change
-        )  # .strftime("%Y-%m-%d %H:%M:%S")
-        task.last_state_change = make_aware(last_state_change)
+        task.last_state_change = self.timestamp_to_datetime(task.last_state_change)
+        self.data_converter.offload(task.data)
         return super().task_to_dict(task)
+
+    def process_to_dict(self, process):
+        self.data_converter.offload(process.data)
+        return super().process_to_dict(process)
+
+    def workflow_state_to_dict(self, workflow):
+        """
+        Same as `workflow_to_dict` without the specs, which are loaded from the Workflow instead.
+        The variables bigger than WORKFLOW_BLOB_THRESHOLD are replaced by references to the blob store.
+        """
+        self.data_converter.clear_offloaded()
+        try:
+            dct = self.process_to_dict(workflow)
+            dct["subprocesses"] = dict(
+                (str(task_id), self.process_to_dict(sp)) for task_id, sp in workflow.subprocesses.items()
+            )
+        finally:
+            self.data_converter.clear_offloaded()
+        return dct
+
+    @staticmethod
+    def _encode_snapshot_value(value):
+        if isinstance(value, datetime):
+            return value.timestamp()
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    def dict_to_snapshot(self, workflow_dct) -> bytes:
+        """
+        Compress the workflow state dict into a snapshot, the timestamps are kept as in the task tree.
+        """
+        return gzip.compress(json.dumps(workflow_dct, default=self._encode_snapshot_value).encode("utf-8"))
+
+    def snapshot_to_dict(self, snapshot) -> dict:
+        return json.loads(gzip.decompress(bytes(snapshot)))
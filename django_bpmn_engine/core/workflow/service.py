@@ -1,21 +1,31 @@
-import json
 import logging
-import re
-import time
+import uuid
 
+from collections import Counter
 from collections import defaultdict
+from copy import deepcopy
+from datetime import date
+from datetime import datetime
+from datetime import time
+from datetime import timedelta
 from functools import partial
+from time import monotonic
+from time import sleep
 from typing import Any
 from typing import Dict
+from typing import Iterable
 from typing import List
+from typing import Optional
+from typing import Set
 
 from celery import shared_task
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Count
-from django_celery_beat.models import IntervalSchedule
-from django_celery_beat.models import PeriodicTask
+from django.db.models import Q
+from django.utils import timezone
 from SpiffWorkflow.bpmn.specs.events.event_definitions import CycleTimerEventDefinition
 from SpiffWorkflow.bpmn.specs.events.event_definitions import MessageEventDefinition
+from SpiffWorkflow.bpmn.specs.events.event_definitions import SignalEventDefinition
 from SpiffWorkflow.bpmn.specs.events.event_definitions import TimerEventDefinition
 from SpiffWorkflow.bpmn.specs.events.event_types import CatchingEvent
 from SpiffWorkflow.camunda.serializer.task_spec_converters import UserTaskConverter
@@ -26,25 +36,48 @@ from SpiffWorkflow.task import Task
 from SpiffWorkflow.task import TaskState
 from SpiffWorkflow.util.deep_merge import DeepMerge
 
+from django_bpmn_engine.core.exceptions import WorkflowSnapshotConflictError
+from django_bpmn_engine.core.models import EventSubscription
+from django_bpmn_engine.core.models import EventSubscriptionState
+from django_bpmn_engine.core.models import EventSubscriptionType
 from django_bpmn_engine.core.models import Incident
 from django_bpmn_engine.core.models import MessageTaskEvent
 from django_bpmn_engine.core.models import MessageTaskEventState
+from django_bpmn_engine.core.models import PersistenceMode
 from django_bpmn_engine.core.models import ServiceTask as ServiceTaskModel
+from django_bpmn_engine.core.models import ServiceTaskOutbox
 from django_bpmn_engine.core.models import ServiceTaskState
+from django_bpmn_engine.core.models import TaskPayload
 from django_bpmn_engine.core.models import UserTask as UserTaskModel
 from django_bpmn_engine.core.models import UserTaskState
 from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowBlob
 from django_bpmn_engine.core.models import WorkflowInstance
 from django_bpmn_engine.core.models import WorkflowState
 from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.models import WorkflowTaskStateCounter
+from django_bpmn_engine.core.models import WorkflowTimer
+from django_bpmn_engine.core.models import WorkflowWakeup
+from django_bpmn_engine.core.workflow.archive import archive_cutoff
+from django_bpmn_engine.core.workflow.archive import archive_workflow_instances
+from django_bpmn_engine.core.workflow.archive import delete_unreferenced_payloads
+from django_bpmn_engine.core.workflow.blobs import delete_unreferenced_blobs
+from django_bpmn_engine.core.workflow.cache import CachedSpec
+from django_bpmn_engine.core.workflow.cache import get_spec_stamp
+from django_bpmn_engine.core.workflow.cache import workflow_spec_cache
 from django_bpmn_engine.core.workflow.parser import CustomParser
+from django_bpmn_engine.core.workflow.partitions import create_partitions
 from django_bpmn_engine.core.workflow.serializer import CustomSerializer
 from django_bpmn_engine.core.workflow.task_spec_converters import ServiceTaskConverter
 from django_bpmn_engine.core.workflow.task_specs import ServiceTask
 from django_bpmn_engine.core.workflow.workflow import CustomWorkflow
+from django_bpmn_engine.core.workflow.worklist import TaskWorklist
 
 logger = logging.getLogger(__name__)
 
+# Task specs SpiffWorkflow adds to every process, with the "<process id>.EndJoin" ones, not elements of the diagram
+INTERNAL_TASK_SPECS = {"Root", "Start", "End"}
+
 
 class WorkflowService:
 
@@ -54,180 +87,500 @@ class WorkflowService:
             BusinessRuleTaskConverter,
             ServiceTaskConverter
         ])
-        self.serializer = CustomSerializer(wf_spec_converter)
+        self.serializer = CustomSerializer(wf_spec_converter, wf_class=CustomWorkflow)
         self.workflow_spec = None
+        # Data given to the current run, kept out of the workflow data so a snapshot doesn't carry it to later runs
+        self.extra_data: Dict[str, Any] = {}
 
     @staticmethod
     def get_workflow_stats(workflow: Workflow):
-        queryset = WorkflowTaskInstance.objects.filter(workflow_instance__workflow=workflow).filter(
-            state__in=[TaskState.COMPLETED, TaskState.READY, TaskState.WAITING]
+        stats = WorkflowTaskStateCounter.objects.get_counts(
+            workflow.id, [TaskState.COMPLETED, TaskState.READY, TaskState.WAITING]
         )
-        instance_tasks = queryset.values("task_spec", "state").annotate(count_state=Count("state"))
-        stats: Dict[str, Any] = defaultdict(dict)
-        for stat in instance_tasks:
-            stats[stat["task_spec"]][stat["state"]] = stat["count_state"]
+        stats = {
+            task_spec: counts
+            for task_spec, counts in stats.items()
+            if task_spec not in INTERNAL_TASK_SPECS and not task_spec.endswith(".EndJoin")
+        }
         return {"workflow_name": workflow.name, "stats": stats}
 
-    def parse_workflow(self, bpmn_xml: str, workflow_process_id: str):
+    @staticmethod
+    def _counter_shard(workflow_instance_id) -> int:
+        return uuid.UUID(str(workflow_instance_id)).int % settings.WORKFLOW_STATS_COUNTER_SHARDS
+
+    def _parse_specs(self, bpmn_xml: str, workflow_process_id: str):
         parser = CustomParser()
         parser.add_bpmn_from_str(bpmn_xml)
-        try:
-            self.workflow_spec = CustomWorkflow(
-                parser.get_spec(workflow_process_id),
-                subprocess_specs=parser.get_subprocess_specs(workflow_process_id)
+        return parser.get_spec(workflow_process_id), parser.get_subprocess_specs(workflow_process_id)
+
+    def parse_workflow(self, bpmn_xml: str, workflow_process_id: str):
+        spec, subprocess_specs = self._parse_specs(bpmn_xml, workflow_process_id)
+        self.workflow_spec = CustomWorkflow(spec, subprocess_specs=subprocess_specs)
+
+    @staticmethod
+    def _get_spec_dependencies(workflow_process_ids) -> Dict[str, str]:
+        return Workflow.objects.get_spec_stamps(workflow_process_ids)
+
+    def compile_workflow(self, workflow_obj: Workflow):
+        """
+        Parse the workflow xml and store the serialized specs in `workflow_obj.compiled_spec`.
+        """
+        spec, subprocess_specs = self._parse_specs(workflow_obj.xml, workflow_obj.workflow_process_id)
+        spec_converter = self.serializer.spec_converter
+        workflow_obj.compiled_spec = {
+            "spec": spec_converter.convert(spec),
+            "subprocess_specs": {name: spec_converter.convert(sp) for name, sp in subprocess_specs.items()},
+            "dependencies": self._get_spec_dependencies(subprocess_specs.keys()),
+        }
+
+    def _restore_compiled_specs(self, workflow_obj: Workflow):
+        compiled_spec = workflow_obj.compiled_spec
+        if not compiled_spec:
+            return None
+        dependencies = compiled_spec["dependencies"]
+        if dependencies != self._get_spec_dependencies(dependencies.keys()):
+            # A called workflow was deployed after this one was compiled
+            return None
+        spec_converter = self.serializer.spec_converter
+        return CachedSpec(
+            spec_converter.restore(compiled_spec["spec"]),
+            {name: spec_converter.restore(sp) for name, sp in compiled_spec["subprocess_specs"].items()},
+            dependencies,
+        )
+
+    def _get_cached_spec(self, workflow_obj: Workflow) -> CachedSpec:
+        """
+        Get the specs from the cache. On a cache miss the specs are restored from `compiled_spec`,
+        and the xml is only parsed when there is no up to date compiled spec.
+        """
+        # Read before the dependencies are checked, so a change committed meanwhile gets them checked again
+        stamp = get_spec_stamp()
+        key = workflow_spec_cache.make_key(workflow_obj)
+        cached, checked_stamp = workflow_spec_cache.get(key)
+        if cached is not None and checked_stamp != stamp:
+            # A workflow changed since the entry was checked, the called ones may have been deployed again
+            if cached.dependencies == self._get_spec_dependencies(cached.dependencies.keys()):
+                workflow_spec_cache.set(key, cached, stamp)
+            else:
+                cached = None
+        if cached is None:
+            cached = self._restore_compiled_specs(workflow_obj)
+            if cached is None:
+                spec, subprocess_specs = self._parse_specs(workflow_obj.xml, workflow_obj.workflow_process_id)
+                cached = CachedSpec(spec, subprocess_specs, self._get_spec_dependencies(subprocess_specs.keys()))
+            workflow_spec_cache.set(key, cached, stamp)
+        return cached
+
+    def load_workflow(self, workflow_obj: Workflow):
+        """
+        Build a fresh CustomWorkflow from the cached specs.
+        """
+        cached = self._get_cached_spec(workflow_obj)
+        self.workflow_spec = CustomWorkflow(cached.spec, subprocess_specs=cached.subprocess_specs)
+
+    # WorkflowTaskInstance fields written from the serialized task dict, besides `id`
+    TASK_INSTANCE_FIELDS = [
+        "parent",
+        "children",
+        "last_state_change",
+        "state",
+        "task_spec",
+        "triggered",
+        "workflow_name",
+        "internal_data",
+        "data",
+    ]
+
+    def _get_tasks_created_after(self, workflow_instance: WorkflowInstance) -> datetime:
+        """
+        Lower bound of the creation time of the tasks of the instance, which lets a partitioned table skip
+        the older months. Tasks are never older than their root instance, but they may be created by a server
+        whose clock is behind, so the bound is moved back by WORKFLOW_TASK_CLOCK_SKEW.
+        """
+        return workflow_instance.created_at - timedelta(seconds=settings.WORKFLOW_TASK_CLOCK_SKEW)
+
+    def _get_saved_tasks(
+        self, workflow_instance: WorkflowInstance, for_update: bool = False
+    ) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Load the task rows of the instance and of all its subprocesses in one query, as
+        {workflow instance id: {task id: values}}. Subprocesses are always children of the root instance.
+        """
+        queryset = WorkflowTaskInstance.objects.filter(
+            Q(workflow_instance=workflow_instance) | Q(workflow_instance__parent=workflow_instance),
+            created_at__gte=self._get_tasks_created_after(workflow_instance),
+        )
+        if for_update:
+            queryset = queryset.select_for_update(of=("self",))
+        saved_tasks: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+        payload_tasks = []
+        for task in queryset.values("workflow_instance_id", "id", "payload_id", *self.TASK_INSTANCE_FIELDS).iterator():
+            saved_tasks[str(task.pop("workflow_instance_id"))][str(task["id"])] = task
+            if task["payload_id"]:
+                payload_tasks.append(task)
+        # All the payloads in one query, the tasks sharing one get their own copy as Spiff restores data in place
+        payloads = TaskPayload.objects.resolve(task["payload_id"] for task in payload_tasks)
+        resolved = set()
+        for task in payload_tasks:
+            payload_id = task.pop("payload_id")
+            task["data"] = deepcopy(payloads[payload_id]) if payload_id in resolved else payloads[payload_id]
+            resolved.add(payload_id)
+        return saved_tasks
+
+    def _task_instance_changed(self, saved_task: Dict[str, Any], task_dict: Dict[str, Any]) -> bool:
+        for field in self.TASK_INSTANCE_FIELDS:
+            value = saved_task[field]
+            if field == "parent" and value is not None:
+                value = str(value)
+            if value != task_dict[field]:
+                return True
+        return False
+
+    def _diff_task_instances(
+        self,
+        workflow_instance_id: str,
+        saved_tasks: Dict[str, Dict[str, Any]],
+        tasks: Dict[str, Dict[str, Any]],
+        changes: Dict[str, Any],
+    ):
+        """
+        Compare the saved tasks of a process with its serialized tasks and collect the rows to write in `changes`.
+        """
+        now = timezone.now()
+        counts = changes["counts"]
+        for task_id, task in tasks.items():
+            saved_task = saved_tasks.get(task_id)
+            if saved_task is None:
+                changes["create"].append(WorkflowTaskInstance(workflow_instance_id=workflow_instance_id, **task))
+                counts[(task["task_spec"], task["state"])] += 1
+            elif self._task_instance_changed(saved_task, task):
+                changes["update"].append(
+                    WorkflowTaskInstance(workflow_instance_id=workflow_instance_id, updated_at=now, **task)
+                )
+                counts[(saved_task["task_spec"], saved_task["state"])] -= 1
+                counts[(task["task_spec"], task["state"])] += 1
+        for task_id, saved_task in saved_tasks.items():
+            if task_id not in tasks:
+                changes["delete"].append(task_id)
+                counts[(saved_task["task_spec"], saved_task["state"])] -= 1
+
+    def _save_subprocess_instances(self, workflow_instance: WorkflowInstance, subprocesses: Dict[str, Dict[str, Any]]):
+        saved_instances = {
+            str(subprocess_instance.id): subprocess_instance
+            for subprocess_instance in WorkflowInstance.objects.filter(parent=workflow_instance).only(
+                "id", "root", "last_task", "success"
             )
-        except Exception as e:
-            raise e
-
-    def _update_task_instance(self, task_instance: WorkflowTaskInstance, task_dict: Dict[str, Any]):
-        task_instance.last_state_change = task_dict["last_state_change"]
-        task_instance.children = task_dict["children"]
-        task_instance.state = task_dict["state"]
-        task_instance.triggered = task_dict["triggered"]
-        task_instance.internal_data = task_dict["internal_data"]
-        task_instance.data = task_dict["data"]
-        task_instance.last_state_change = task_dict["last_state_change"]
-        task_instance.save()
-
-    def create_workflow_instance_tasks(self, workflow_instance: WorkflowInstance, workflow_dct: Dict[str, Any]):
+        }
         create_instances: List[WorkflowInstance] = []
+        update_instances: List[WorkflowInstance] = []
+        now = timezone.now()
+        for key, subprocess in subprocesses.items():
+            subprocess_instance = saved_instances.get(key)
+            if subprocess_instance is None:
+                create_instances.append(
+                    WorkflowInstance(
+                        id=key,
+                        workflow_id=workflow_instance.workflow_id,
+                        parent=workflow_instance,
+                        root=subprocess["root"],
+                        last_task=subprocess["last_task"],
+                        success=subprocess["success"],
+                    )
+                )
+            elif (str(subprocess_instance.root), subprocess_instance.last_task, subprocess_instance.success) != (
+                subprocess["root"], subprocess["last_task"], subprocess["success"]
+            ):
+                subprocess_instance.root = subprocess["root"]
+                subprocess_instance.last_task = subprocess["last_task"]
+                subprocess_instance.success = subprocess["success"]
+                subprocess_instance.updated_at = now
+                update_instances.append(subprocess_instance)
 
-        # Get all task instances saved in database for update
-        task_instances = WorkflowTaskInstance.objects.select_for_update().filter(
-            workflow_instance=workflow_instance
+        if create_instances:
+            WorkflowInstance.objects.bulk_create(create_instances)
+        if update_instances:
+            WorkflowInstance.objects.bulk_update(update_instances, ["root", "last_task", "success", "updated_at"])
+
+    def create_workflow_instance_tasks(
+        self, workflow_instance: WorkflowInstance, workflow_dct: Dict[str, Any]
+    ) -> Dict[str, int]:
+        """
+        Write the difference between the saved tasks and `workflow_dct`, returning the created/updated/deleted counts.
+        """
+        changes: Dict[str, Any] = {"create": [], "update": [], "delete": [], "counts": Counter()}
+
+        # Get all task instances of the workflow and its subprocesses saved in database for update
+        saved_tasks = self._get_saved_tasks(workflow_instance, for_update=True)
+        self._diff_task_instances(
+            str(workflow_instance.id), saved_tasks[str(workflow_instance.id)], workflow_dct["tasks"], changes
         )
-        map_task_instance_ids = {str(task_instance.id): task_instance for task_instance in task_instances}
-
-        # Cria ou atualiza uma task no banco de dados
-        for task in workflow_dct["tasks"].values():
-            if task["id"] not in map_task_instance_ids.keys():
-                create_instances.append(WorkflowTaskInstance(workflow_instance=workflow_instance, **task))
-            elif map_task_instance_ids[task["id"]].state != task["state"]:
-                self._update_task_instance(map_task_instance_ids[task["id"]], task)
-    
-        # Verifica se alguma task foi removida do workflow_dct e deleta também do banco de dados
-        if diff_tasks:=list(set(map_task_instance_ids.keys()) - set(workflow_dct["tasks"].keys())):
-            WorkflowTaskInstance.objects.filter(id__in=diff_tasks).delete()
 
         # Verifica se o workflow tem subprocessos, cria uma nova instancia e cria/atualiza as tasks
+        if workflow_dct["subprocesses"]:
+            self._save_subprocess_instances(workflow_instance, workflow_dct["subprocesses"])
         for key, subprocess in workflow_dct["subprocesses"].items():
-            task_instances = WorkflowTaskInstance.objects.select_for_update().filter(
-                workflow_instance=key
-            )
-            map_task_instance_ids = {str(task_instance.id): task_instance for task_instance in task_instances}
-            suboprocess_instance, _ = WorkflowInstance.objects.update_or_create(
-                id=key,
-                workflow_id=workflow_instance.workflow_id,
-                parent=workflow_instance,
-                defaults={
-                    "root": subprocess["root"],
-                    "last_task": subprocess["last_task"],
-                    "success": subprocess["success"],
-                }
+            self._diff_task_instances(key, saved_tasks[key], subprocess["tasks"], changes)
+
+        self._set_payloads(changes["update"] + changes["create"])
+        if changes["delete"]:
+            WorkflowTaskInstance.objects.filter(
+                id__in=changes["delete"], created_at__gte=self._get_tasks_created_after(workflow_instance)
+            ).delete()
+        if changes["update"]:
+            WorkflowTaskInstance.objects.bulk_update(
+                changes["update"], self.TASK_INSTANCE_FIELDS + ["payload", "updated_at"]
             )
-            for task in subprocess["tasks"].values():
-                if task["id"] not in map_task_instance_ids.keys():
-                    create_instances.append(WorkflowTaskInstance(workflow_instance=suboprocess_instance, **task))
-                elif map_task_instance_ids[task["id"]].state != task["state"]:
-                    self._update_task_instance(map_task_instance_ids[task["id"]], task)
+        if changes["create"]:
+            WorkflowTaskInstance.objects.bulk_create(changes["create"])
+        WorkflowTaskStateCounter.objects.add(
+            workflow_instance.workflow_id, self._counter_shard(workflow_instance.id), changes["counts"]
+        )
 
-            if diff_tasks:=list(set(map_task_instance_ids.keys()) - set(subprocess["tasks"].keys())):
-                WorkflowTaskInstance.objects.filter(id__in=diff_tasks).delete()
+        return {
+            "created": len(changes["create"]),
+            "updated": len(changes["update"]),
+            "deleted": len(changes["delete"]),
+        }
 
-        if create_instances:
-            WorkflowTaskInstance.objects.bulk_create(create_instances)
+    @staticmethod
+    def _set_payloads(task_instances: List[WorkflowTaskInstance]):
+        """
+        Move the data of the task rows about to be written to their payloads, storing the missing ones.
+        """
+        payloads = {}
+        for task_instance in task_instances:
+            task_instance.payload_id = TaskPayload.objects.make_hash(task_instance.data)
+            payloads[task_instance.payload_id] = task_instance.data
+            task_instance.data = {}
+        if payloads:
+            TaskPayload.objects.store(payloads)
+
+    def _set_snapshot(self, workflow_instance: WorkflowInstance, workflow_dct: Dict[str, Any]):
+        snapshot_version = workflow_instance.snapshot_version
+        if not workflow_instance._state.adding:
+            # Compare and set the version, so a concurrent run of the same instance can't overwrite this one
+            updated = WorkflowInstance.objects.filter(
+                id=workflow_instance.id, snapshot_version=snapshot_version
+            ).update(snapshot_version=snapshot_version + 1)
+            if not updated:
+                raise WorkflowSnapshotConflictError(str(workflow_instance.id), snapshot_version)
+        workflow_instance.snapshot = self.serializer.dict_to_snapshot(workflow_dct)
+        workflow_instance.snapshot_version = snapshot_version + 1
+
+    def save_workflow_instance(self, workflow_instance: WorkflowInstance, workflow_dct: Dict[str, Any]):
+        """
+        Save the instance and its state, as task rows or as a snapshot depending on WORKFLOW_PERSISTENCE_MODE.
+        """
+        if settings.WORKFLOW_PERSISTENCE_MODE == PersistenceMode.SNAPSHOT:
+            self._set_snapshot(workflow_instance, workflow_dct)
+            workflow_instance.save()
+            if settings.WORKFLOW_SNAPSHOT_PROJECTION:
+                transaction.on_commit(
+                    partial(
+                        project_workflow_snapshot.apply_async, args=[str(workflow_instance.id)], queue="run_workflow"
+                    )
+                )
+        else:
+            workflow_instance.save()
+            summary = self.create_workflow_instance_tasks(workflow_instance, workflow_dct)
+            logger.debug(f"Saved tasks of workflow instance {workflow_instance.id}: {summary}")
+        WorkflowBlob.objects.add_references(
+            workflow_instance.parent_id or workflow_instance.id, self.serializer.data_converter.pop_referenced_keys()
+        )
+
+    def save_workflow(self, workflow_instance: WorkflowInstance):
+        workflow_spec = self.workflow_spec
+        workflow_dct = self.serializer.workflow_state_to_dict(workflow_spec)
+
+        if workflow_spec.is_completed():
+            workflow_instance.state = WorkflowState.COMPLETED
+            WorkflowInstance.objects.filter(parent=workflow_instance).update(state=WorkflowState.COMPLETED)
+
+        # Update the last task executed
+        workflow_instance.last_task = workflow_spec.last_task.task_spec.name if workflow_spec.last_task else None
+        self.save_workflow_instance(workflow_instance, workflow_dct)
+
+    def execute_workflow(self, workflow_instance: WorkflowInstance, extra_data: Dict[str, Any] = None):
+        """
+        Build the instance, run its steps and save it. Must be called inside a transaction, with the
+        instance locked by `lock_workflow_instance`.
+        """
+        self.build_workflow(workflow_instance)
+        self.extra_data = extra_data or {}
+        try:
+            budget_exhausted = self.run_steps(workflow_instance)
+        finally:
+            self.extra_data = {}
+        self.save_workflow(workflow_instance)
+        transaction.on_commit(partial(self.send_service_tasks, workflow_instance))
+        if budget_exhausted:
+            # The next steps are run by another run, after the other instances waiting for the workers. It is
+            # never run inline, so the worker is handed back for real
+            dispatch_workflow_runs([str(workflow_instance.id)], reason="Step budget exhausted", inline=False)
 
     def start_workflow(self, wf_instance_obj) -> Workflow:
         #Carrega do workflow
         workflow_obj = wf_instance_obj.workflow
         
         # Faz o parse do workflow
-        self.parse_workflow(bpmn_xml=workflow_obj.xml, workflow_process_id=workflow_obj.workflow_process_id)
+        self.load_workflow(workflow_obj)
 
         # Setando o payload inicial no node Start
-        self.workflow_spec.task_tree.children[0].set_data(
-            **self.serializer.data_converter.restore(wf_instance_obj.initial_data)
-        )
+        initial_data = self.serializer.data_converter.restore(wf_instance_obj.initial_data)
+        self.workflow_spec.task_tree.children[0].set_data(**initial_data)
+        # The instance keeps references to the offloaded variables too
+        wf_instance_obj.initial_data = self.serializer.data_converter.convert_offloaded(initial_data)
 
         # Convertendo para dict
-        workflow_dct = self.serializer.workflow_to_dict(self.workflow_spec)
+        workflow_dct = self.serializer.workflow_state_to_dict(self.workflow_spec)
         wf_instance_obj.root = workflow_dct["root"]
         wf_instance_obj.success = workflow_dct["success"]
 
         # Salva a instancia e as tasks
         with transaction.atomic():
-            wf_instance_obj.save()
-            self.create_workflow_instance_tasks(wf_instance_obj, workflow_dct)
+            self.save_workflow_instance(wf_instance_obj, workflow_dct)
         
         # Joga para a fila de execução
-        # run_workflow.apply_async(args=[str(wf_instance_obj.id)], queue="run_workflow")
-        run_workflow(str(wf_instance_obj.id))
+        dispatch_workflow_runs([str(wf_instance_obj.id)], reason="Workflow started")
 
         return wf_instance_obj
 
+    def start_workflows(self, workflow_obj: Workflow, initial_data_list: List[Dict[str, Any]]) -> List[WorkflowInstance]:
+        """
+        Start one instance per initial data. The specs are loaded once, the instances and their tasks are
+        created with bulk inserts in a single transaction, and the runs are enqueued once it commits.
+        """
+        cached = self._get_cached_spec(workflow_obj)
+        snapshot_mode = settings.WORKFLOW_PERSISTENCE_MODE == PersistenceMode.SNAPSHOT
+        workflow_instances: List[WorkflowInstance] = []
+        task_instances: List[WorkflowTaskInstance] = []
+        counts: Dict[int, Counter] = defaultdict(Counter)
+        blob_keys: Dict[uuid.UUID, Set[str]] = {}
+        for initial_data in initial_data_list:
+            workflow_spec = CustomWorkflow(cached.spec, subprocess_specs=cached.subprocess_specs)
+            restored_data = self.serializer.data_converter.restore(initial_data)
+            workflow_spec.task_tree.children[0].set_data(**restored_data)
+            workflow_dct = self.serializer.workflow_state_to_dict(workflow_spec)
+            workflow_instance = WorkflowInstance(
+                workflow=workflow_obj,
+                initial_data=self.serializer.data_converter.convert_offloaded(restored_data),
+                root=workflow_dct["root"],
+                success=workflow_dct["success"],
+            )
+            if snapshot_mode:
+                self._set_snapshot(workflow_instance, workflow_dct)
+            # A new workflow has no subprocesses yet, and its task rows are what the projection would write
+            if not snapshot_mode or settings.WORKFLOW_SNAPSHOT_PROJECTION:
+                shard_counts = counts[self._counter_shard(workflow_instance.id)]
+                for task in workflow_dct["tasks"].values():
+                    task_instances.append(WorkflowTaskInstance(workflow_instance_id=workflow_instance.id, **task))
+                    shard_counts[(task["task_spec"], task["state"])] += 1
+            workflow_instances.append(workflow_instance)
+            blob_keys[workflow_instance.id] = self.serializer.data_converter.pop_referenced_keys()
+
+        with transaction.atomic():
+            WorkflowInstance.objects.bulk_create(workflow_instances)
+            for workflow_instance_id, keys in blob_keys.items():
+                WorkflowBlob.objects.add_references(workflow_instance_id, keys)
+            self._set_payloads(task_instances)
+            WorkflowTaskInstance.objects.bulk_create(task_instances)
+            for shard, shard_counts in sorted(counts.items()):
+                WorkflowTaskStateCounter.objects.add(workflow_obj.id, shard, shard_counts)
+            dispatch_workflow_runs(
+                [str(workflow_instance.id) for workflow_instance in workflow_instances],
+                reason="Workflow started",
+                queue=True,
+            )
+        return workflow_instances
+
     def _get_tasks(self) -> List[Task]:
-        ready_tasks = self.workflow_spec.get_tasks(TaskState.READY)
-        waiting_tasks = self.workflow_spec.get_tasks(TaskState.WAITING)
-        return ready_tasks + waiting_tasks
-
-    def run_steps(self, workflow_instance: WorkflowInstance):
-        # pega todas as tasks READY e WAITING
-        tasks = self._get_tasks()
-        while tasks:
-            # Lista usada para saber se devemos continuar no while para executar tasks
-            task_states = []
-            for task in tasks:
-                # execute engine steps
-                if task._has_state(TaskState.READY) and self.workflow_spec._is_engine_task(task.task_spec):
-                    task.complete()
-                    task_states.append(True)
-                elif task._has_state(TaskState.READY) and not self.workflow_spec._is_engine_task(task.task_spec):
-                    self._execute_task(workflow_instance, task)
-                    task_states.append(task.state == TaskState.COMPLETED) 
-                        
-                elif task._has_state(TaskState.WAITING):
-                    task.task_spec._update(task)
-                    self._execute_catching_event_task(workflow_instance, task)
-                    task_states.append(task.state in [TaskState.COMPLETED, TaskState.READY])
-  
-            if any(task_states):
-                tasks = self._get_tasks()
-            else:
-                tasks = []
+        tasks = self.workflow_spec.get_tasks(TaskState.READY | TaskState.WAITING)
+        # READY tasks first, as they are the ones most likely to make progress
+        return sorted(tasks, key=lambda task: not task._has_state(TaskState.READY))
 
-    def _get_tasks_from_workflow_instance(self, workflow_instance: WorkflowInstance):
-        return {
-            str(task.id): {
-                "id": str(task.id),
-                "parent": task.parent,
-                "children": task.children,
-                "last_state_change": time.mktime(task.last_state_change.timetuple()),
-                "state": task.state,
-                "task_spec": task.task_spec,
-                "triggered": task.triggered,
-                "workflow_name": task.workflow_name,
-                "internal_data": task.internal_data,
-                "data": task.data
-            }
-            for task in WorkflowTaskInstance.objects.filter(workflow_instance=workflow_instance).iterator()
-        }
+    def _run_step(self, workflow_instance: WorkflowInstance, task: Task) -> bool:
+        """
+        Run a READY or WAITING task, returns whether it made progress.
+        """
+        # execute engine steps
+        if task._has_state(TaskState.READY) and self.workflow_spec._is_engine_task(task.task_spec):
+            task.complete()
+            return True
+        elif task._has_state(TaskState.READY) and not self.workflow_spec._is_engine_task(task.task_spec):
+            self._execute_task(workflow_instance, task)
+            return task.state == TaskState.COMPLETED
+        elif task._has_state(TaskState.WAITING):
+            task.task_spec._update(task)
+            self._execute_catching_event_task(workflow_instance, task)
+            return task.state in [TaskState.COMPLETED, TaskState.READY]
+        return False
+
+    def run_steps(self, workflow_instance: WorkflowInstance) -> bool:
+        """
+        Run the READY and WAITING tasks from a worklist. The tasks a step makes runnable are queued from
+        the state changes the workflow notifies, the task tree is only scanned again once the worklist
+        runs dry, to stop when a whole scan makes no progress. Returns True when it stopped after
+        WORKFLOW_RUN_STEP_BUDGET steps, so a single instance doesn't hold the worker. Only the steps that
+        made progress count, the tasks parked on a worker or an event are visited without using the budget.
+        """
+        steps = 0
+        self.workflow_spec.pop_changed_tasks()
+        while True:
+            worklist = TaskWorklist(self._get_tasks())
+            progressed = False
+            while worklist:
+                task = worklist.pop()
+                if self._run_step(workflow_instance, task):
+                    progressed = True
+                    steps += 1
+                    if steps >= settings.WORKFLOW_RUN_STEP_BUDGET:
+                        return True
+                    worklist.push_changed([task, *self.workflow_spec.pop_changed_tasks()])
+            if not progressed:
+                return False
+
+    def _saved_tasks_to_dict(self, saved_tasks: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        for task in saved_tasks.values():
+            task["id"] = str(task["id"])
+            task["last_state_change"] = task["last_state_change"].timestamp()
+        return saved_tasks
+
+    def _use_snapshot(self, workflow_instance: WorkflowInstance) -> bool:
+        return (
+            settings.WORKFLOW_PERSISTENCE_MODE == PersistenceMode.SNAPSHOT and workflow_instance.snapshot is not None
+        )
 
     def _build_workflow_tree(self, workflow_instance: WorkflowInstance):
+        if self._use_snapshot(workflow_instance):
+            process_dct = self.serializer.snapshot_to_dict(workflow_instance.snapshot)
+            self.workflow_spec.data = self.serializer.data_converter.restore(process_dct["data"])
+            self.workflow_spec.task_tree = self.serializer.task_tree_from_dict(
+                process_dct=process_dct,
+                task_id=process_dct["root"],
+                parent_task=None,
+                process=self.workflow_spec,
+            )
+            return
+
+        saved_tasks = self._get_saved_tasks(workflow_instance)
         process_dct = {
             "last_task": workflow_instance.last_task,
             "success": workflow_instance.success,
-            "tasks": self._get_tasks_from_workflow_instance(workflow_instance),
+            "tasks": self._saved_tasks_to_dict(saved_tasks[str(workflow_instance.id)]),
             "subprocesses": {},
         }
 
-        for subprocess in WorkflowInstance.objects.filter(parent=workflow_instance):
+        subprocesses = WorkflowInstance.objects.filter(parent=workflow_instance).values_list(
+            "id", "last_task", "success", "root"
+        )
+        for subprocess_id, last_task, success, root in subprocesses:
             process_dct["subprocesses"].update({
-                str(subprocess.id): {
+                str(subprocess_id): {
                     "data": {},
-                    "last_task": subprocess.last_task,
-                    "success": subprocess.success,
-                    "tasks": self._get_tasks_from_workflow_instance(subprocess),
-                    "root": str(subprocess.root),
+                    "last_task": last_task,
+                    "success": success,
+                    "tasks": self._saved_tasks_to_dict(saved_tasks[str(subprocess_id)]),
+                    "root": str(root),
                 }
             })
         self.workflow_spec.task_tree = self.serializer.task_tree_from_dict(
@@ -238,20 +591,35 @@ class WorkflowService:
         )
 
     def build_workflow(self, workflow_instance: WorkflowInstance):
-        workflow_obj = workflow_instance.workflow
-        self.parse_workflow(
-            bpmn_xml=workflow_obj.xml, workflow_process_id=workflow_obj.workflow_process_id
-        )
+        self.load_workflow(workflow_instance.workflow)
         # Build the tasks states from last execution
         self._build_workflow_tree(workflow_instance)
 
+    def _merge_workflow_data(self, task: Task):
+        # Only the data given to the run, like the input of a resolved incident, is merged into the task
+        if self.extra_data:
+            DeepMerge.merge(task.data, self.extra_data)
+
+    def _get_input_data(self, task: Task) -> Dict[str, Any]:
+        """
+        Input stored with the task: the variables named by its `inputVariables` property, comma separated,
+        or all of its data when it declares none. The big variables are sent as references to the blob store.
+        """
+        input_variables = getattr(task.task_spec, "extensions", {}).get("inputVariables")
+        if not input_variables:
+            return self.serializer.data_converter.convert_offloaded(task.data)
+        names = [name.strip() for name in input_variables.split(",")]
+        return self.serializer.data_converter.convert_offloaded(
+            {name: task.data[name] for name in names if name in task.data}
+        )
+
     def _execute_task(self, workflow_instance: WorkflowInstance, task: Task):
-        input_data = DeepMerge.merge(task.data, self.workflow_spec.data)
+        self._merge_workflow_data(task)
         if isinstance(task.task_spec, ServiceTask):
 
             # Ativa o service task (cria evento no model=ServiceTask)
             # Caso o evento já tenha sido criado, verifica se foi processado
-            service_task = self._get_or_create_service_task(workflow_instance, task, input_data)
+            service_task = self._get_or_create_service_task(workflow_instance, task)
 
             if service_task.state == ServiceTaskState.COMPLETED:
                 task.update_data(service_task.output_data)
@@ -262,7 +630,7 @@ class WorkflowService:
                     self.create_incident(workflow_instance, task, service_task.output_data)
 
         elif isinstance(task.task_spec, UserTask):
-            user_task = self._get_or_create_user_task(workflow_instance, task, input_data)
+            user_task = self._get_or_create_user_task(workflow_instance, task)
 
             if user_task.state == UserTaskState.COMPLETED:
                 for field in task.task_spec.form.fields:
@@ -273,10 +641,11 @@ class WorkflowService:
     def _execute_catching_event_task(self, workflow_instance: WorkflowInstance, task: Task):
         if isinstance(task.task_spec, CatchingEvent) and not task._has_state(TaskState.READY):
             if isinstance(task.task_spec.event_definition, MessageEventDefinition):
-                input_data = DeepMerge.merge(task.data, self.workflow_spec.data)
+                self._merge_workflow_data(task)
                 defaults = {
-                    "input_data": input_data,
-                    "message_name": task.task_spec.event_definition.name
+                    "input_data": partial(self._get_input_data, task),
+                    "message_name": task.task_spec.event_definition.name,
+                    "correlation_key": partial(self._get_correlation_key, task),
                 }
                 message, _ = MessageTaskEvent.objects.get_or_create(
                     task_name=task.get_name(),
@@ -286,71 +655,112 @@ class WorkflowService:
                 if message.state == MessageTaskEventState.RECEIVED:
                     self.workflow_spec.catch_bpmn_message(message.message_name, message.output_data)
                 
-            elif isinstance(task.task_spec.event_definition, TimerEventDefinition):
-                duration = task.task_spec.event_definition.dateTime
-                match = re.match("timedelta\((.*)=(\d+)\)", duration)
-                period, every = match.groups()  # type: ignore
-                self._get_or_create_periodic_task(
-                    workflow_instance_id=workflow_instance.id,
-                    name=self._get_task_identification(task),
-                    period=period,
-                    every=every,
+            elif isinstance(task.task_spec.event_definition, SignalEventDefinition):
+                subscription, _ = EventSubscription.objects.get_or_create(
+                    task_name=task.get_name(),
+                    workflow_instance=workflow_instance,
+                    defaults={
+                        "event_type": EventSubscriptionType.SIGNAL,
+                        "event_name": task.task_spec.event_definition.name,
+                    },
                 )
+                if subscription.state == EventSubscriptionState.RECEIVED:
+                    self.workflow_spec.catch(SignalEventDefinition(subscription.event_name))
+                    # Consumed, a catch event reached again in a loop must wait for the next signal
+                    subscription.delete()
+
+            elif isinstance(task.task_spec.event_definition, (TimerEventDefinition, CycleTimerEventDefinition)):
+                self._schedule_timer(workflow_instance, task)
+
+    def _get_timer_due_at(self, task: Task) -> Optional[datetime]:
+        """
+        When the waiting timer of the task fires, following the start time Spiff keeps in the task,
+        which is a naive datetime in the local time of the server.
+        """
+        event_definition = task.task_spec.event_definition
+        start_time = task._get_internal_data("start_time")
+        start_time = datetime.strptime(start_time, event_definition.TIME_FORMAT).astimezone() if start_time else None
+        if isinstance(event_definition, CycleTimerEventDefinition):
+            repeat, delta = self.workflow_spec.script_engine.evaluate(task, event_definition.cycle_definition)
+            if start_time is None or (task.get_data("repeat_count") or 0) >= repeat:
+                return None
+            return start_time + delta
+
+        due_at = self.workflow_spec.script_engine.evaluate(task, event_definition.dateTime)
+        if isinstance(due_at, timedelta):
+            return start_time + due_at if start_time else None
+        if isinstance(due_at, datetime):
+            return due_at if due_at.tzinfo else due_at.astimezone()
+        if isinstance(due_at, date):
+            return datetime.combine(due_at, time.max).astimezone()
+        return None
+
+    def _schedule_timer(self, workflow_instance: WorkflowInstance, task: Task):
+        """
+        Make sure the waiting timer has a WorkflowTimer, which wakes the instance up once it is due.
+        """
+        task_name = self._get_task_identification(task)
+        if WorkflowTimer.objects.filter(workflow_instance=workflow_instance, task_name=task_name).exists():
+            return
+        due_at = self._get_timer_due_at(task)
+        if due_at is None:
+            return
+        # Spiff only fires strictly after the due time, a timer woken up too early is scheduled again
+        due_at = max(due_at, timezone.now()) + timedelta(milliseconds=1)
+        WorkflowTimer.objects.bulk_create(
+            [WorkflowTimer(workflow_instance=workflow_instance, task_name=task_name, due_at=due_at)],
+            ignore_conflicts=True,
+        )
 
-            elif isinstance(task.task_spec.event_definition, CycleTimerEventDefinition):
-                # TODO: criar o objeto Periodic Task with crontab
-                pass
+    def _get_correlation_key(self, task: Task):
+        """
+        Evaluate the `correlationKey` property of the catch event over the task data, if it has one. Only
+        called when the message row is created, an expression that can't be evaluated, like one over a
+        missing variable, raises a WorkflowTaskExecException which fails the run with an incident.
+        """
+        expression = getattr(task.task_spec, "extensions", {}).get("correlationKey")
+        if not expression:
+            return None
+        return str(self.workflow_spec.script_engine.evaluate(task, expression))
 
     def _get_task_identification(self, task: Task):
         return f"{task.workflow.spec.name}:{task.get_name()}"
 
-    def _get_or_create_user_task(self, workflow_instance: WorkflowInstance, task: Task, input_data: Dict[str, Any]):
-        task_identification = self._get_task_identification(task)
-        try:
-            return UserTaskModel.objects.get(
-                task_name=task_identification, workflow_instance=workflow_instance
-            )
-        except UserTaskModel.DoesNotExist:
-            return UserTaskModel.objects.create(
-                task_name=task_identification,
-                workflow_instance=workflow_instance,
-                input_data=input_data,
-                properties=task.task_spec.extensions,
-                form_fields=UserTaskConverter().form_to_dict(task.task_spec.form),
-            )
+    def _get_or_create_user_task(self, workflow_instance: WorkflowInstance, task: Task):
+        # The defaults are callables, so the input is only built when the row is created
+        user_task, _ = UserTaskModel.objects.get_or_create(
+            task_name=self._get_task_identification(task),
+            workflow_instance=workflow_instance,
+            defaults={
+                "input_data": partial(self._get_input_data, task),
+                "properties": task.task_spec.extensions,
+                "form_fields": UserTaskConverter().form_to_dict(task.task_spec.form),
+            },
+        )
+        return user_task
     
-    def _get_or_create_service_task(self, workflow_instance: WorkflowInstance, task: Task, input_data: Dict[str, Any]):
-        task_identification = self._get_task_identification(task)
-        try:
-            return ServiceTaskModel.objects.get(
-                task_name=task_identification, workflow_instance=workflow_instance
-            )
-        except ServiceTaskModel.DoesNotExist:
-            return ServiceTaskModel.objects.create(
-                task_name=task_identification,
-                workflow_instance=workflow_instance,
-                input_data=input_data,
-                properties=task.task_spec.extensions,
-                queue_name=task.task_spec.topic,
-            )
-
-    def _get_or_create_periodic_task(self, workflow_instance_id, name, period, every):
-        try:
-            PeriodicTask.objects.get(name=name)
-        except PeriodicTask.DoesNotExist:
-            interval, _ = IntervalSchedule.objects.get_or_create(period=period, every=every)
-            PeriodicTask.objects.create(
-                interval=interval,
-                name=name,
-                task="django_bpmn_engine.core.workflow.service.run_workflow",
-                queue="run_workflow",
-                args=json.dumps([str(workflow_instance_id)]),
-                one_off=True
-            )
+    def _get_or_create_service_task(self, workflow_instance: WorkflowInstance, task: Task):
+        service_task, created = ServiceTaskModel.objects.get_or_create(
+            task_name=self._get_task_identification(task),
+            workflow_instance=workflow_instance,
+            defaults={
+                "input_data": partial(self._get_input_data, task),
+                "properties": task.task_spec.extensions,
+                "queue_name": task.task_spec.topic,
+            },
+        )
+        # Tasks on pull queues wait for a worker to fetch them instead of being published
+        if created and service_task.queue_name not in settings.SERVICE_TASK_PULL_QUEUES:
+            ServiceTaskOutbox.objects.create(service_task=service_task, queue_name=service_task.queue_name)
+        return service_task
 
     def create_incident(self, workflow_instance: WorkflowInstance, task_name: str, error_data: Dict[str, Any]):
+        # Only the state is written, the object may be stale like the one of a failed run. It is set on the
+        # object too, for a run going on that saves it afterwards
         workflow_instance.state = WorkflowState.FAILURE
-        workflow_instance.save()
+        WorkflowInstance.objects.filter(id=workflow_instance.id).update(
+            state=WorkflowState.FAILURE, updated_at=timezone.now()
+        )
         Incident.objects.get_or_create(
             workflow_instance=workflow_instance,
             task_name=task_name,
@@ -358,60 +768,446 @@ class WorkflowService:
         )
 
     def send_service_tasks(self, workflow_instance: WorkflowInstance):
-        service_tasks = ServiceTaskModel.objects.filter(
-            workflow_instance=workflow_instance,
-            state=ServiceTaskState.NEW
+        # Publish right away the tasks created by this run, the relay picks up whatever is left
+        relay_service_tasks(settings.SERVICE_TASK_RELAY_BATCH_SIZE, workflow_instance_id=workflow_instance.id)
+
+
+def relay_service_tasks(batch_size: int, workflow_instance_id=None) -> int:
+    """
+    Publish a batch of service tasks from the outbox and mark them ACTIVATED. All the messages are sent
+    through one broker connection, and the rows are only removed from the outbox once they were published,
+    so a crash can publish a task twice but never loses it. Returns how many tasks were published.
+    """
+    with transaction.atomic():
+        outbox = ServiceTaskOutbox.objects.select_for_update(skip_locked=True, of=("self",))
+        if workflow_instance_id is not None:
+            outbox = outbox.filter(service_task__workflow_instance_id=workflow_instance_id)
+        entries = list(
+            outbox.order_by("created_at").values_list(
+                "id",
+                "queue_name",
+                "service_task_id",
+                "service_task__workflow_instance_id",
+                "service_task__input_data",
+                "service_task__properties",
+            )[:batch_size]
+        )
+        if not entries:
+            return 0
+
+        entries_by_queue = defaultdict(list)
+        for _, queue_name, *args in entries:
+            entries_by_queue[queue_name].append(args)
+
+        with run_service_task.app.producer_or_acquire() as producer:
+            for queue_name, queue_entries in entries_by_queue.items():
+                for service_task_id, instance_id, input_data, properties in queue_entries:
+                    run_service_task.apply_async(
+                        args=[str(instance_id), str(service_task_id), input_data, properties],
+                        queue=queue_name,
+                        producer=producer,
+                    )
+
+        ServiceTaskOutbox.objects.filter(id__in=[entry[0] for entry in entries]).delete()
+        now = timezone.now()
+        ServiceTaskModel.objects.filter(id__in=[entry[2] for entry in entries], state=ServiceTaskState.NEW).update(
+            state=ServiceTaskState.ACTIVATED,
+            lock_expires_at=now + timedelta(seconds=settings.SERVICE_TASK_ACTIVATION_TIMEOUT),
+            updated_at=now,
+        )
+    return len(entries)
+
+
+def _retry_backoff(retries: int) -> timedelta:
+    return timedelta(seconds=settings.SERVICE_TASK_RETRY_BACKOFF * 2**retries)
+
+
+def reap_service_tasks(batch_size: int) -> int:
+    """
+    Handle a batch of ACTIVATED service tasks past their deadline. Each one is retried after an exponential
+    backoff until SERVICE_TASK_MAX_RETRIES, then failed with a timeout error, which the engine turns into an
+    incident unless an error boundary event catches it. Retries whose backoff is over go back to their
+    queue. Both lookups are range scans over an indexed deadline column. Returns how many tasks were handled.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        expired = list(
+            ServiceTaskModel.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(lock_expires_at__lt=now, state=ServiceTaskState.ACTIVATED)
+            .order_by("lock_expires_at")
+            .only("id", "workflow_instance_id", "retries")[:batch_size]
         )
-        for service_task in service_tasks.iterator():
-            run_service_task.apply_async(
-                args=[
-                    str(workflow_instance.id),
-                    str(service_task.id),
-                    service_task.input_data,
-                    service_task.properties
-                ],
-                queue=service_task.queue_name
+        failed = []
+        retried = []
+        for service_task in expired:
+            service_task.worker_id = None
+            service_task.lock_expires_at = None
+            service_task.updated_at = now
+            if service_task.retries >= settings.SERVICE_TASK_MAX_RETRIES:
+                service_task.state = ServiceTaskState.FAILURE
+                service_task.output_data = {
+                    "error_name": "ServiceTaskTimeout",
+                    "error_code": f"Service task timed out after {service_task.retries} retries",
+                }
+                failed.append(service_task)
+            else:
+                service_task.state = ServiceTaskState.NEW
+                service_task.next_retry_at = now + _retry_backoff(service_task.retries)
+                service_task.retries += 1
+                retried.append(service_task)
+        ServiceTaskModel.objects.bulk_update(
+            retried, ["state", "worker_id", "lock_expires_at", "retries", "next_retry_at", "updated_at"]
+        )
+        ServiceTaskModel.objects.bulk_update(
+            failed, ["state", "worker_id", "lock_expires_at", "output_data", "updated_at"]
+        )
+        if failed:
+            workflow_instance_ids = {str(service_task.workflow_instance_id) for service_task in failed}
+            dispatch_workflow_runs(sorted(workflow_instance_ids), reason="ServiceTask timeout")
+            logger.warning(f"{len(failed)} service tasks failed after {settings.SERVICE_TASK_MAX_RETRIES} retries")
+
+        due = list(
+            ServiceTaskModel.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(next_retry_at__lte=now, state=ServiceTaskState.NEW)
+            .order_by("next_retry_at")
+            .values_list("id", "queue_name")[:batch_size]
+        )
+        ServiceTaskModel.objects.filter(id__in=[service_task_id for service_task_id, _ in due]).update(
+            next_retry_at=None, updated_at=now
+        )
+        # Tasks on pull queues can be fetched again as soon as next_retry_at is cleared
+        ServiceTaskOutbox.objects.bulk_create(
+            [
+                ServiceTaskOutbox(service_task_id=service_task_id, queue_name=queue_name)
+                for service_task_id, queue_name in due
+                if queue_name not in settings.SERVICE_TASK_PULL_QUEUES
+            ],
+            ignore_conflicts=True,
+        )
+    return len(expired) + len(due)
+
+
+def lock_service_tasks(worker_id: str, topics: List[str], max_tasks: int, lock_duration: int) -> List[ServiceTaskModel]:
+    """
+    Claim up to `max_tasks` service tasks of the given topics for `worker_id`, for `lock_duration` seconds.
+    The NEW tasks waiting for a worker are claimed with SKIP LOCKED, so concurrent workers never get the
+    same task. Expired leases are handled by `reap_service_tasks`.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        service_task_ids = list(
+            ServiceTaskModel.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(
+                queue_name__in=topics,
+                state=ServiceTaskState.NEW,
+                outbox__isnull=True,
+                next_retry_at__isnull=True,
             )
-            service_task.state = ServiceTaskState.ACTIVATED
-            service_task.save()
+            .order_by("created_at")
+            .values_list("id", flat=True)[:max_tasks]
+        )
+        if not service_task_ids:
+            return []
+        ServiceTaskModel.objects.filter(id__in=service_task_ids).update(
+            state=ServiceTaskState.ACTIVATED,
+            worker_id=worker_id,
+            lock_expires_at=now + timedelta(seconds=lock_duration),
+            updated_at=now,
+        )
+    return list(ServiceTaskModel.objects.filter(id__in=service_task_ids).order_by("created_at"))
 
 
-@shared_task
-def run_workflow(workflow_instance_id: str, extra_data=None):
-    try:
-        service_instance = WorkflowService()
-        workflow_instance: WorkflowInstance = WorkflowInstance.objects.select_related("workflow").get(
-            id=workflow_instance_id
+def fetch_and_lock_service_tasks(
+    worker_id: str, topics: List[str], max_tasks: int, lock_duration: int, wait: float = 0
+) -> List[ServiceTaskModel]:
+    """
+    Same as `lock_service_tasks`, but when nothing is available keep looking for up to `wait` seconds,
+    capped by SERVICE_TASK_FETCH_MAX_WAIT as the request is held meanwhile.
+    """
+    deadline = monotonic() + min(wait, settings.SERVICE_TASK_FETCH_MAX_WAIT)
+    while True:
+        service_tasks = lock_service_tasks(worker_id, topics, max_tasks, lock_duration)
+        if service_tasks or monotonic() >= deadline:
+            return service_tasks
+        sleep(min(settings.SERVICE_TASK_FETCH_POLL_INTERVAL, max(deadline - monotonic(), 0)))
+
+
+def set_service_task_results(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Complete or fail many service tasks at once, each item has the task `id`, its new `state`, the
+    `output_data` and optionally the `worker_id` holding its lease. The tasks are updated with one
+    statement and each instance is run once, whatever the number of its tasks in the batch.
+    Returns one result per item, an item that can't be applied doesn't stop the others.
+    """
+    now = timezone.now()
+    results = []
+    with transaction.atomic():
+        # Locked in the order of their ids, so two batches sharing tasks can't deadlock
+        service_tasks = {
+            service_task.id: service_task
+            for service_task in ServiceTaskModel.objects.select_for_update(of=("self",))
+            .filter(id__in=[item["id"] for item in items])
+            .order_by("id")
+        }
+        updated = {}
+        for item in items:
+            service_task = service_tasks.get(item["id"])
+            error = None
+            if service_task is None:
+                error = "Service task not found"
+            elif service_task.id in updated:
+                error = "Service task is repeated in the batch"
+            elif service_task.state in [ServiceTaskState.COMPLETED, ServiceTaskState.FAILURE]:
+                error = f"Service task is already {service_task.state}"
+            elif item.get("worker_id") and service_task.worker_id and service_task.worker_id != item["worker_id"]:
+                error = "The task is locked by another worker"
+            if error:
+                results.append({"id": str(item["id"]), "success": False, "error": error})
+                continue
+            service_task.state = item["state"]
+            service_task.output_data = item.get("output_data", {})
+            service_task.lock_expires_at = None
+            service_task.updated_at = now
+            updated[service_task.id] = service_task
+            results.append({"id": str(service_task.id), "success": True, "state": service_task.state})
+
+        ServiceTaskModel.objects.bulk_update(
+            updated.values(), ["state", "output_data", "lock_expires_at", "updated_at"]
+        )
+        workflow_instance_ids = {str(service_task.workflow_instance_id) for service_task in updated.values()}
+        dispatch_workflow_runs(sorted(workflow_instance_ids), reason="ServiceTask bulk")
+    return results
+
+
+def correlate_message(message_name: str, correlation_key=None, payload=None) -> List[str]:
+    """
+    Deliver a message to the catch events waiting for it, only the ones with the same correlation key
+    when one is given. The instances of the matched events are woken up, and their ids are returned.
+    """
+    with transaction.atomic():
+        messages = MessageTaskEvent.objects.select_for_update().filter(
+            message_name=message_name, state=MessageTaskEventState.WAITING
+        )
+        if correlation_key is not None:
+            messages = messages.filter(correlation_key=correlation_key)
+        matches = list(messages.values_list("id", "workflow_instance_id"))
+        if not matches:
+            return []
+        MessageTaskEvent.objects.filter(id__in=[message_id for message_id, _ in matches]).update(
+            state=MessageTaskEventState.RECEIVED, output_data=payload or {}, updated_at=timezone.now()
         )
+        workflow_instance_ids = {str(workflow_instance_id) for _, workflow_instance_id in matches}
+        dispatch_workflow_runs(sorted(workflow_instance_ids), reason="MessageTaskEvent correlated")
+    return sorted(workflow_instance_ids)
+
+
+def broadcast_signal(signal_name: str, chunk_size: int) -> int:
+    """
+    Deliver a signal to every catch event waiting for it when the broadcast starts. The subscriptions are
+    marked RECEIVED and their instances woken up a chunk per transaction, so a large fan-out never holds its
+    locks for long. The runs are enqueued when WORKFLOW_RUN_ASYNC is on, and left to the `run_workflows`
+    command otherwise. Returns how many subscriptions received the signal.
+
+    Locked rows are waited for rather than skipped, a subscription being consumed by a run would otherwise
+    miss the signal.
+    """
+    started_at = timezone.now()
+    delivered = 0
+    while True:
         with transaction.atomic():
-            # Build the workflow spec
-            service_instance.build_workflow(workflow_instance)
-            workflow_spec = service_instance.workflow_spec
-
-            if extra_data:
-                workflow_spec.set_data(**extra_data)
-
-            service_instance.run_steps(workflow_instance)
-
-            workflow_dct = service_instance.serializer.workflow_to_dict(workflow_spec)
-            service_instance.create_workflow_instance_tasks(workflow_instance, workflow_dct)
-            
-            if workflow_spec.is_completed():
-                workflow_instance.state = WorkflowState.COMPLETED
-                WorkflowInstance.objects.filter(parent=workflow_instance).update(
-                    state=WorkflowState.COMPLETED
+            subscriptions = list(
+                EventSubscription.objects.select_for_update()
+                .filter(
+                    event_type=EventSubscriptionType.SIGNAL,
+                    event_name=signal_name,
+                    state=EventSubscriptionState.WAITING,
+                    created_at__lte=started_at,
                 )
-            
-            # Update the last task executed
-            workflow_instance.last_task = (
-                workflow_spec.last_task.task_spec.name if workflow_spec.last_task else None
+                .order_by("created_at")
+                .values_list("id", "workflow_instance_id")[:chunk_size]
             )
-            workflow_instance.save()
-            transaction.on_commit(partial(service_instance.send_service_tasks, workflow_instance))
+            if not subscriptions:
+                return delivered
+            EventSubscription.objects.filter(id__in=[subscription_id for subscription_id, _ in subscriptions]).update(
+                state=EventSubscriptionState.RECEIVED, updated_at=timezone.now()
+            )
+            workflow_instance_ids = {str(workflow_instance_id) for _, workflow_instance_id in subscriptions}
+            dispatch_workflow_runs(sorted(workflow_instance_ids), reason="Signal received", inline=False)
+        delivered += len(subscriptions)
+        if len(subscriptions) < chunk_size:
+            return delivered
+
+
+def fire_due_timers(batch_size: int) -> int:
+    """
+    Claim a batch of due timers with SKIP LOCKED, delete them and wake their instances up. Their runs are
+    enqueued once the transaction commits when WORKFLOW_RUN_ASYNC is on, and left to the `run_workflows`
+    command otherwise. Returns how many timers fired.
+    """
+    with transaction.atomic():
+        timers = list(
+            WorkflowTimer.objects.select_for_update(skip_locked=True)
+            .filter(due_at__lte=timezone.now())
+            .order_by("due_at")
+            .values_list("id", "workflow_instance_id")[:batch_size]
+        )
+        if not timers:
+            return 0
+        WorkflowTimer.objects.filter(id__in=[timer_id for timer_id, _ in timers]).delete()
+        workflow_instance_ids = {str(workflow_instance_id) for _, workflow_instance_id in timers}
+        dispatch_workflow_runs(sorted(workflow_instance_ids), reason="Timer fired", inline=False)
+    return len(timers)
+
+
+def dispatch_workflow_runs(
+    workflow_instance_ids: Iterable[str], reason: str, extra_data=None, queue: bool = False, inline: bool = True
+):
+    """
+    Request a run of each instance. Its wakeup is recorded and, once the transaction commits, the run is
+    enqueued on the `run_workflow` queue after WORKFLOW_RUN_DEBOUNCE seconds when WORKFLOW_RUN_ASYNC is on
+    or `queue` is set, or run right away in this process otherwise. Without `inline` nothing is run in this
+    process, the wakeup is left to the `run_workflows` command when WORKFLOW_RUN_ASYNC is off.
+
+    Every run claims the wakeup of its instance before building it, so the events recorded until a run
+    starts are all handled by that run, and a run whose wakeup was already claimed does nothing.
+    """
+    workflow_instance_ids = list(workflow_instance_ids)
+    WorkflowWakeup.objects.wake(workflow_instance_ids, reason=reason)
+    if settings.WORKFLOW_RUN_ASYNC or queue:
+        transaction.on_commit(partial(_enqueue_workflow_runs, workflow_instance_ids, extra_data))
+        return
+    if not inline:
+        return
+    for workflow_instance_id in workflow_instance_ids:
+        transaction.on_commit(partial(run_workflow, workflow_instance_id, extra_data))
+
+
+def _enqueue_workflow_runs(workflow_instance_ids: List[str], extra_data=None):
+    # All through one broker connection
+    with run_workflow.app.producer_or_acquire() as producer:
+        for workflow_instance_id in workflow_instance_ids:
+            run_workflow.apply_async(
+                args=[workflow_instance_id, extra_data],
+                queue="run_workflow",
+                countdown=settings.WORKFLOW_RUN_DEBOUNCE,
+                producer=producer,
+            )
+
+
+def lock_workflow_instance(workflow_instance_id) -> Optional[WorkflowInstance]:
+    """
+    Load an instance to run and lock its row until the transaction ends, so two runs of the same instance,
+    like one of the `run_workflows` command and one started from the API, never build it from the same tasks.
+    """
+    return (
+        WorkflowInstance.objects.select_related("workflow")
+        .defer("workflow__compiled_spec")
+        .select_for_update(of=("self",))
+        .filter(id=workflow_instance_id)
+        .first()
+    )
+
+
+@shared_task
+def run_workflow(workflow_instance_id: str, extra_data=None):
+    service_instance = WorkflowService()
+    workflow_instance = None
+    try:
+        with transaction.atomic():
+            # A run given data must reach the engine even when the events were already handled
+            if not WorkflowWakeup.objects.claim(workflow_instance_id) and not extra_data:
+                return
+            workflow_instance = lock_workflow_instance(workflow_instance_id)
+            if workflow_instance is None or workflow_instance.state != WorkflowState.RUNNING:
+                return
+            service_instance.execute_workflow(workflow_instance, extra_data)
 
     except WorkflowException as e:
         service_instance.create_incident(workflow_instance, e.sender.name, {"error": str(e)})
         logger.error(f"Error on task {e.sender.name}: {str(e)}")
+    except WorkflowSnapshotConflictError as e:
+        # Another run saved the instance first, run again over its state
+        logger.warning(str(e))
+        dispatch_workflow_runs([workflow_instance_id], reason="Snapshot conflict", extra_data=extra_data, queue=True)
+
+
+@shared_task
+def project_workflow_snapshot(workflow_instance_id: str):
+    """
+    Update the WorkflowTaskInstance rows of an instance from its snapshot.
+    """
+    service_instance = WorkflowService()
+    with transaction.atomic():
+        # Lock the instance, so an older snapshot can't be projected over a newer one
+        workflow_instance = WorkflowInstance.objects.select_for_update().get(id=workflow_instance_id)
+        if workflow_instance.snapshot is None:
+            return
+        workflow_dct = service_instance.serializer.snapshot_to_dict(workflow_instance.snapshot)
+        for process_dct in [workflow_dct, *workflow_dct["subprocesses"].values()]:
+            for task in process_dct["tasks"].values():
+                task["last_state_change"] = service_instance.serializer.timestamp_to_datetime(
+                    task["last_state_change"]
+                )
+        summary = service_instance.create_workflow_instance_tasks(workflow_instance, workflow_dct)
+        logger.debug(f"Projected snapshot of workflow instance {workflow_instance.id}: {summary}")
+        if workflow_instance.state == WorkflowState.COMPLETED:
+            WorkflowInstance.objects.filter(parent=workflow_instance).update(state=WorkflowState.COMPLETED)
+
+
+@shared_task
+def archive_old_workflow_instances():
+    batch_size = settings.WORKFLOW_ARCHIVE_BATCH_SIZE
+    older_than = archive_cutoff()
+    for _ in range(settings.WORKFLOW_ARCHIVE_MAX_BATCHES):
+        if archive_workflow_instances(batch_size, older_than) < batch_size:
+            return
+        # Let the replicas catch up before the next batch
+        sleep(settings.WORKFLOW_ARCHIVE_THROTTLE)
+
+
+@shared_task
+def delete_orphan_task_payloads():
+    # Only old payloads, a recent one is more likely to be stored again by a running instance
+    older_than = timezone.now() - timedelta(days=1)
+    batch_size = settings.WORKFLOW_PAYLOAD_GC_BATCH_SIZE
+    while True:
+        orphans = TaskPayload.objects.get_orphans(older_than, batch_size)
+        delete_unreferenced_payloads(orphans)
+        if len(orphans) < batch_size:
+            return
+
+
+@shared_task
+def delete_orphan_blobs():
+    # Only old blobs, a recent one may be offloaded by a run that has not recorded its references yet
+    older_than = timezone.now() - timedelta(days=1)
+    batch_size = settings.WORKFLOW_PAYLOAD_GC_BATCH_SIZE
+    while True:
+        orphans = WorkflowBlob.objects.get_orphans(older_than, batch_size)
+        delete_unreferenced_blobs(orphans)
+        if len(orphans) < batch_size:
+            return
+
+
+@shared_task
+def create_task_partitions():
+    create_partitions(settings.WORKFLOW_TASK_PARTITIONS_AHEAD)
+
+
+@shared_task
+def fire_workflow_timers():
+    batch_size = settings.WORKFLOW_TIMER_BATCH_SIZE
+    while fire_due_timers(batch_size) == batch_size:
+        pass
+
+
+@shared_task
+def reap_expired_service_tasks():
+    batch_size = settings.SERVICE_TASK_REAPER_BATCH_SIZE
+    # Keep going while the batches are full, the next run of the schedule picks up the rest otherwise
+    while reap_service_tasks(batch_size) == batch_size:
+        pass
+
 
 @shared_task(name="run_service_task")
 def run_service_task(*args, **kwargs):
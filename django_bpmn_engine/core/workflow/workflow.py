@@ -1,8 +1,69 @@
+from typing import List
+
 from SpiffWorkflow.bpmn.specs.events.event_definitions import ErrorEventDefinition
+from SpiffWorkflow.bpmn.specs.ParallelGateway import ParallelGateway
 from SpiffWorkflow.bpmn.workflow import BpmnWorkflow
+from SpiffWorkflow.task import Task
+from SpiffWorkflow.task import TaskState
 
 
 class CustomWorkflow(BpmnWorkflow):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Tasks completed, or released from WAITING, since the last `pop_changed_tasks`. Only the outermost
+        # workflow keeps them, the ones of its subprocesses are reported to it
+        self.changed_tasks: List[Task] = []
+
     def catch_error(self, error_name: str, error_code: str):
         event_definition = ErrorEventDefinition(error_name, error_code)
         self.catch(event_definition)
+
+    def create_subprocess(self, my_task, spec_name, name):
+        # Same as BpmnWorkflow, except the subprocess is a CustomWorkflow too
+        workflow = self._get_outermost_workflow(my_task)
+        subprocess = CustomWorkflow(
+            workflow.subprocess_specs[spec_name],
+            name=name,
+            read_only=self.read_only,
+            script_engine=self.script_engine,
+            parent=my_task.workflow,
+        )
+        workflow.subprocesses[my_task.id] = subprocess
+        return subprocess
+
+    def pop_changed_tasks(self) -> List[Task]:
+        changed_tasks, self.changed_tasks = self.changed_tasks, []
+        return changed_tasks
+
+    def _task_completed_notify(self, task):
+        """
+        Same as Workflow._task_completed_notify, which updates every WAITING task, except that the
+        tasks of a parallel join are checked once per gateway and thread while none of them fires.
+        They all count the same completed inputs, and each check walks the whole task tree, which
+        made a completion cost O(branches x tree size) on parallel multi instance tasks.
+        """
+        assert (not self.read_only) or self._is_busy_with_restore()
+        if task.get_name() == "End":
+            self.data.update(task.data)
+        changed_tasks = [task]
+        blocked_joins = set()
+        for waiting_task in self._get_waiting_tasks():
+            join_key = None
+            if isinstance(waiting_task.task_spec, ParallelGateway):
+                join_key = (waiting_task.task_spec, waiting_task.thread_id)
+                if join_key in blocked_joins:
+                    continue
+            waiting_task.task_spec._update(waiting_task)
+            if waiting_task._has_state(TaskState.WAITING):
+                if join_key is not None:
+                    blocked_joins.add(join_key)
+            else:
+                # The tree changed, so the joins must be checked again
+                blocked_joins.clear()
+                changed_tasks.append(waiting_task)
+        self._get_outermost_workflow().changed_tasks.extend(changed_tasks)
+
+        if self.completed_event.n_subscribers() == 0:
+            return
+        if self.is_completed():
+            self.completed_event(self)
@@ -0,0 +1,75 @@
+from collections import deque
+from typing import Deque
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Set
+
+from SpiffWorkflow.task import Task
+from SpiffWorkflow.task import TaskState
+
+RUNNABLE_STATES = TaskState.READY | TaskState.WAITING
+
+
+def get_frontier(task: Task) -> List[Task]:
+    """
+    READY and WAITING tasks below `task`, only descending through the finished ones.
+    """
+    frontier = []
+    stack = list(reversed(task.children))
+    while stack:
+        child = stack.pop()
+        if child._has_state(RUNNABLE_STATES):
+            frontier.append(child)
+        elif child._is_finished():
+            stack.extend(reversed(child.children))
+    return frontier
+
+
+class TaskWorklist:
+    """
+    FIFO of the READY and WAITING tasks left to run, each task queued at most once.
+
+    The WAITING tasks seen are remembered, so a state change made to them
+    outside of their branch, like a subprocess completing its call activity,
+    is picked up without scanning the task tree again.
+    """
+
+    def __init__(self, tasks: Iterable[Task]):
+        self._queue: Deque[Task] = deque()
+        self._queued: Set = set()
+        self._waiting: Dict = {}
+        for task in tasks:
+            self.push(task)
+
+    def __bool__(self):
+        return bool(self._queue)
+
+    def push(self, task: Task):
+        if task._has_state(TaskState.WAITING):
+            self._waiting[task.id] = task
+        if task.id not in self._queued and task._has_state(RUNNABLE_STATES):
+            self._queue.append(task)
+            self._queued.add(task.id)
+
+    def pop(self) -> Task:
+        task = self._queue.popleft()
+        self._queued.discard(task.id)
+        return task
+
+    def push_changed(self, tasks: Iterable[Task]):
+        """
+        Queue what the state changes of `tasks` made runnable: the tasks themselves when they are
+        READY or WAITING, and the tasks below them when they finished.
+        """
+        for task in tasks:
+            if task._has_state(RUNNABLE_STATES):
+                self.push(task)
+            elif task._is_finished():
+                for child in get_frontier(task):
+                    self.push(child)
+        changed = [task for task in self._waiting.values() if not task._has_state(TaskState.WAITING)]
+        for task in changed:
+            del self._waiting[task.id]
+        if changed:
+            self.push_changed(changed)
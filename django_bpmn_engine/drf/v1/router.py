@@ -1,7 +1,10 @@
 from rest_framework.routers import DefaultRouter
 
+from django_bpmn_engine.drf.v1.viewsets import ArchivedWorkflowInstanceViewSet
+from django_bpmn_engine.drf.v1.viewsets import BlobViewSet
 from django_bpmn_engine.drf.v1.viewsets import MessageTaskEventViewSet
 from django_bpmn_engine.drf.v1.viewsets import ServiceTaskViewSet
+from django_bpmn_engine.drf.v1.viewsets import SignalViewSet
 from django_bpmn_engine.drf.v1.viewsets import WorkflowInstanceViewSet
 from django_bpmn_engine.drf.v1.viewsets import WorkflowTaskInstanceViewSet
 from django_bpmn_engine.drf.v1.viewsets import WorkflowViewSet
@@ -14,3 +17,6 @@ router.register(
 )
 router.register("service_task", ServiceTaskViewSet, "service-task-v1")
 router.register("message_task", MessageTaskEventViewSet, "message-task-v1")
+router.register("signal", SignalViewSet, "signal-v1")
+router.register("archived_workflowinstance", ArchivedWorkflowInstanceViewSet, "archived-workflowinstance-v1")
+router.register("blob", BlobViewSet, "blob-v1")
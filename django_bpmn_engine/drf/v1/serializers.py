@@ -1,42 +1,155 @@
+from typing import Iterable
+from typing import List
+
+from django.conf import settings
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
 
+from django_bpmn_engine.core.models import ArchivedWorkflowInstance
 from django_bpmn_engine.core.models import MessageTaskEvent
 from django_bpmn_engine.core.models import ServiceTask
+from django_bpmn_engine.core.models import ServiceTaskState
 from django_bpmn_engine.core.models import Workflow
 from django_bpmn_engine.core.models import WorkflowInstance
 from django_bpmn_engine.core.models import WorkflowTaskInstance
 
 
+def get_omitted_fields(request, field_names: Iterable[str]) -> List[str]:
+    """
+    Fields left out of the response by the comma separated `fields` and `omit` query parameters.
+    """
+    field_names = list(field_names)
+    selected = {}
+    for param in ("fields", "omit"):
+        value = request.query_params.get(param)
+        if not value:
+            continue
+        selected[param] = {name.strip() for name in value.split(",") if name.strip()}
+        unknown = selected[param].difference(field_names)
+        if unknown:
+            raise ValidationError({param: f"Unknown fields: {', '.join(sorted(unknown))}"})
+    kept = selected.get("fields", set(field_names)).difference(selected.get("omit", set()))
+    return [name for name in field_names if name not in kept]
+
+
+class SparseFieldsMixin:
+    """
+    Drop the fields left out by the `fields`/`omit` query parameters of a GET request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is None or request.method != "GET":
+            return
+        for name in get_omitted_fields(request, self.fields.keys()):
+            self.fields.pop(name)
+
+
 class WorkflowSerializer(serializers.ModelSerializer):
     class Meta:
         model = Workflow
-        exclude = ["id"]
+        exclude = ["id", "compiled_spec"]
 
 
 class WorkflowInstanceSerializer(serializers.ModelSerializer):
     class Meta:
         model = WorkflowInstance
-        exclude = ["id"]
+        exclude = ["id", "snapshot"]
+
 
+class StartBatchSerializer(serializers.Serializer):
+    initial_data = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False, max_length=settings.WORKFLOW_START_BATCH_MAX_SIZE
+    )
 
-class WorkflowTaskInstanceSerializer(serializers.ModelSerializer):
+
+class WorkflowTaskInstanceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = WorkflowTaskInstance
-        exclude = ["id"]
+        exclude = ["id", "payload"]
 
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        if "data" in representation:
+            representation["data"] = instance.get_data()
+        return representation
 
-class ServiceTaskSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        if "data" in validated_data:
+            # The data written through the API replaces the payload
+            instance.payload = None
+        return super().update(instance, validated_data)
+
+
+class ServiceTaskSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ServiceTask
         exclude = ["id"]
 
 
-class MessageTaskEventSerializer(serializers.ModelSerializer):
+class FetchAndLockSerializer(serializers.Serializer):
+    worker_id = serializers.CharField(max_length=100)
+    topics = serializers.ListField(child=serializers.CharField(max_length=50), allow_empty=False)
+    max_tasks = serializers.IntegerField(min_value=1, max_value=settings.SERVICE_TASK_FETCH_MAX_TASKS, default=1)
+    lock_duration = serializers.IntegerField(min_value=1, help_text="Lease duration in seconds")
+    async_response_timeout = serializers.IntegerField(
+        min_value=0,
+        max_value=settings.SERVICE_TASK_FETCH_MAX_WAIT,
+        default=0,
+        help_text="Seconds to wait for tasks when none is available",
+    )
+
+
+class LockedServiceTaskSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ServiceTask
+        fields = [
+            "id",
+            "task_name",
+            "workflow_instance",
+            "queue_name",
+            "input_data",
+            "properties",
+            "worker_id",
+            "lock_expires_at",
+        ]
+
+
+class ServiceTaskResultSerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    state = serializers.ChoiceField(choices=[ServiceTaskState.COMPLETED, ServiceTaskState.FAILURE])
+    output_data = serializers.DictField(default=dict)
+    worker_id = serializers.CharField(max_length=100, required=False)
+
+
+class BulkServiceTaskResultSerializer(serializers.Serializer):
+    # Each item is validated on its own, so an invalid one doesn't reject the batch
+    tasks = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False, max_length=settings.SERVICE_TASK_BULK_MAX_SIZE
+    )
+
+
+class MessageTaskEventSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = MessageTaskEvent
         exclude = ["id"]
 
 
+class CorrelateMessageSerializer(serializers.Serializer):
+    message_name = serializers.CharField(max_length=100)
+    correlation_key = serializers.CharField(
+        max_length=255, required=False, help_text="Deliver to every waiting event of the message when omitted"
+    )
+    payload = serializers.DictField(default=dict)
+
+
+class ArchivedWorkflowInstanceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedWorkflowInstance
+        exclude = ["data"]
+
+
 class WorkflowStatsSerializer(serializers.Serializer):
     workflow_name = serializers.CharField()
     stats = serializers.DictField()
@@ -1,25 +1,47 @@
 import logging
+import uuid
 
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from rest_framework import mixins
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import Cursor
+from rest_framework.pagination import CursorPagination
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
+from django_bpmn_engine.core.models import ArchivedWorkflowInstance
 from django_bpmn_engine.core.models import MessageTaskEvent
 from django_bpmn_engine.core.models import ServiceTask
 from django_bpmn_engine.core.models import ServiceTaskState
 from django_bpmn_engine.core.models import Workflow
 from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.workflow.archive import read_archived_workflow_instance
+from django_bpmn_engine.core.workflow.blobs import get_blob_store
 from django_bpmn_engine.core.workflow.service import WorkflowService
-from django_bpmn_engine.core.workflow.service import run_workflow
+from django_bpmn_engine.core.workflow.service import broadcast_signal
+from django_bpmn_engine.core.workflow.service import correlate_message
+from django_bpmn_engine.core.workflow.service import dispatch_workflow_runs
+from django_bpmn_engine.core.workflow.service import fetch_and_lock_service_tasks
+from django_bpmn_engine.core.workflow.service import set_service_task_results
+from django_bpmn_engine.drf.v1.serializers import ArchivedWorkflowInstanceSerializer
+from django_bpmn_engine.drf.v1.serializers import BulkServiceTaskResultSerializer
+from django_bpmn_engine.drf.v1.serializers import CorrelateMessageSerializer
+from django_bpmn_engine.drf.v1.serializers import FetchAndLockSerializer
+from django_bpmn_engine.drf.v1.serializers import LockedServiceTaskSerializer
 from django_bpmn_engine.drf.v1.serializers import MessageTaskEventSerializer
+from django_bpmn_engine.drf.v1.serializers import ServiceTaskResultSerializer
 from django_bpmn_engine.drf.v1.serializers import ServiceTaskSerializer
+from django_bpmn_engine.drf.v1.serializers import StartBatchSerializer
 from django_bpmn_engine.drf.v1.serializers import WorkflowInstanceSerializer
 from django_bpmn_engine.drf.v1.serializers import WorkflowSerializer
 from django_bpmn_engine.drf.v1.serializers import WorkflowStatsSerializer
 from django_bpmn_engine.drf.v1.serializers import WorkflowTaskInstanceSerializer
+from django_bpmn_engine.drf.v1.serializers import get_omitted_fields
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +52,90 @@ class BaseSetPagination(PageNumberPagination):
     max_page_size = 50
 
 
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination on (created_at, id), newest first and without a total count, so a deep page
+    costs the same as the first one. The cursor holds the created_at and id of the row it starts after.
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        if self.cursor is not None and self.cursor.position is not None:
+            created_at, pk = self._parse_position(self.cursor.position)
+            # Written as a range on created_at so the created_at index is used, ties are broken on the id
+            if reverse:
+                queryset = queryset.filter(Q(created_at__gte=created_at) & ~Q(created_at=created_at, id__lte=pk))
+            else:
+                queryset = queryset.filter(Q(created_at__lte=created_at) & ~Q(created_at=created_at, id__gte=pk))
+        queryset = queryset.order_by(*(("created_at", "id") if reverse else self.ordering))
+
+        results = list(queryset[: self.page_size + 1])
+        self.page = results[: self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        if not self.page:
+            self.has_next = self.has_previous = False
+        return self.page
+
+    def _parse_position(self, position):
+        created_at, _, pk = position.partition("|")
+        try:
+            created_at = parse_datetime(created_at)
+            pk = uuid.UUID(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    @staticmethod
+    def _get_position(instance) -> str:
+        return f"{instance.created_at.isoformat()}|{instance.id}"
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self._get_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self._get_position(self.page[0])))
+
+
+class SparseFieldsViewSetMixin:
+    """
+    Leave the columns of the fields dropped by `fields`/`omit` out of the SELECT of the GET requests.
+    """
+
+    # Read by the cursor pagination, so never deferred
+    required_fields = ("id", "created_at")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method != "GET":
+            return queryset
+        fields = self.get_serializer_class()().fields
+        concrete_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        deferred = [
+            fields[name].source
+            for name in get_omitted_fields(self.request, fields.keys())
+            if fields[name].source in concrete_fields and fields[name].source not in self.required_fields
+        ]
+        return queryset.defer(*deferred) if deferred else queryset
+
+
 class WorkflowViewSet(viewsets.ModelViewSet):
     queryset = Workflow.objects.all().order_by("-created_at")
     serializer_class = WorkflowSerializer
@@ -55,6 +161,15 @@ class WorkflowViewSet(viewsets.ModelViewSet):
         service.start_workflow(serializer.instance)
         return Response(serializer.data)
 
+    @action(detail=True, methods=["post"], url_path="start-batch")
+    def start_batch(self, request, pk):
+        workflow = self.get_object()
+        serializer = StartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        service = WorkflowService()
+        workflow_instances = service.start_workflows(workflow, serializer.validated_data["initial_data"])
+        return Response(WorkflowInstanceSerializer(workflow_instances, many=True).data)
+
 
 class WorkflowInstanceViewSet(viewsets.ModelViewSet):
     queryset = WorkflowTaskInstance.objects.all().order_by("-created_at")
@@ -66,31 +181,74 @@ class WorkflowInstanceViewSet(viewsets.ModelViewSet):
         service.start_workflow(serializer.instance)
 
 
-class WorkflowTaskInstanceViewSet(viewsets.ModelViewSet):
+class WorkflowTaskInstanceViewSet(SparseFieldsViewSetMixin, viewsets.ModelViewSet):
     queryset = WorkflowTaskInstance.objects.all().order_by("-created_at")
     serializer_class = WorkflowTaskInstanceSerializer
+    pagination_class = CreatedAtCursorPagination
     filterset_fields = ["state", "workflow_name", "task_spec", "workflow_instance_id"]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method != "GET":
+            return queryset
+        # The data of the rows is in their payloads, loaded with one query per page
+        fields = self.get_serializer_class()().fields
+        if "data" not in get_omitted_fields(self.request, fields.keys()):
+            queryset = queryset.prefetch_related("payload")
+        return queryset
+
 
 class ServiceTaskViewSet(
-    viewsets.GenericViewSet, mixins.UpdateModelMixin, mixins.ListModelMixin
+    SparseFieldsViewSetMixin, viewsets.GenericViewSet, mixins.UpdateModelMixin, mixins.ListModelMixin
 ):
     queryset = ServiceTask.objects.all().order_by("-created_at")
     serializer_class = ServiceTaskSerializer
+    pagination_class = CreatedAtCursorPagination
 
     def update_state(self, state, data):
         service_task = self.get_object()
         if service_task.state == state:
             return ValidationError({"error": "error"})
+        worker_id = data.get("worker_id")
+        if worker_id and service_task.worker_id and service_task.worker_id != worker_id:
+            raise ValidationError({"worker_id": "The task is locked by another worker"})
         service_task.state = state
         service_task.output_data = data.get("output_data", {})
+        service_task.lock_expires_at = None
         service_task.save()
-        # run_workflow.apply_async(
-        #     args=[str(service_task.workflow_instance.id)], queue="run_workflow"
-        # )
-        run_workflow(str(service_task.workflow_instance.id))
+        dispatch_workflow_runs([str(service_task.workflow_instance_id)], reason=f"ServiceTask {state}")
         return service_task
 
+    @action(detail=False, methods=["post"], url_path="fetch-and-lock")
+    def fetch_and_lock(self, request, *args, **kwargs):
+        serializer = FetchAndLockSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        service_tasks = fetch_and_lock_service_tasks(
+            data["worker_id"],
+            data["topics"],
+            data["max_tasks"],
+            data["lock_duration"],
+            wait=data["async_response_timeout"],
+        )
+        return Response(LockedServiceTaskSerializer(service_tasks, many=True).data)
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request, *args, **kwargs):
+        serializer = BulkServiceTaskResultSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = []
+        valid_items = []
+        for item in serializer.validated_data["tasks"]:
+            item_serializer = ServiceTaskResultSerializer(data=item)
+            if item_serializer.is_valid():
+                valid_items.append(item_serializer.validated_data)
+                results.append(None)
+            else:
+                results.append({"id": item.get("id"), "success": False, "error": item_serializer.errors})
+        valid_results = iter(set_service_task_results(valid_items))
+        return Response([result or next(valid_results) for result in results])
+
     @action(detail=True, methods=["patch"])
     def complete(self, request, *args, **kwargs):
         service_task = self.update_state(ServiceTaskState.COMPLETED, request.data)
@@ -103,7 +261,46 @@ class ServiceTaskViewSet(
 
 
 class MessageTaskEventViewSet(
-    viewsets.GenericViewSet, mixins.UpdateModelMixin, mixins.ListModelMixin
+    SparseFieldsViewSetMixin, viewsets.GenericViewSet, mixins.UpdateModelMixin, mixins.ListModelMixin
 ):
     queryset = MessageTaskEvent.objects.all().order_by("-created_at")
     serializer_class = MessageTaskEventSerializer
+    pagination_class = CreatedAtCursorPagination
+
+    @action(detail=False, methods=["post"])
+    def correlate(self, request, *args, **kwargs):
+        serializer = CorrelateMessageSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        workflow_instance_ids = correlate_message(data["message_name"], data.get("correlation_key"), data["payload"])
+        return Response({"correlated": len(workflow_instance_ids), "workflow_instances": workflow_instance_ids})
+
+
+class SignalViewSet(viewsets.ViewSet):
+    @action(detail=False, methods=["post"], url_path=r"(?P<name>[^/]+)")
+    def broadcast(self, request, name):
+        delivered = broadcast_signal(name, settings.SIGNAL_BROADCAST_CHUNK_SIZE)
+        return Response({"signal": name, "delivered": delivered})
+
+
+class BlobViewSet(viewsets.ViewSet):
+    """
+    Values of the variables offloaded to the blob store, by the key of their BlobReference.
+    """
+
+    def retrieve(self, request, pk):
+        blob_store = get_blob_store()
+        if not blob_store.exists(pk):
+            raise NotFound()
+        return Response(blob_store.get(pk))
+
+
+class ArchivedWorkflowInstanceViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = ArchivedWorkflowInstance.objects.all().defer("data").order_by("-created_at")
+    serializer_class = ArchivedWorkflowInstanceSerializer
+    filterset_fields = ["workflow", "state"]
+
+    @action(detail=True, methods=["get"])
+    def rehydrate(self, request, pk):
+        archived = ArchivedWorkflowInstance.objects.get(pk=self.get_object().pk)
+        return Response(read_archived_workflow_instance(archived))
@@ -259,3 +259,103 @@ CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
 CELERY_CACHE_BACKEND = "default"
 CELERY_RESULT_BACKEND = "django-db"
+
+# Workflow engine
+WORKFLOW_SPEC_CACHE_SIZE = int(os.getenv("WORKFLOW_SPEC_CACHE_SIZE", 128))
+WORKFLOW_COMPILE_SPEC = strtobool(os.getenv("WORKFLOW_COMPILE_SPEC", "False"))
+# TASKS stores one WorkflowTaskInstance row per task, SNAPSHOT stores one compressed document per instance
+WORKFLOW_PERSISTENCE_MODE = os.getenv("WORKFLOW_PERSISTENCE_MODE", "TASKS")
+# Keep the WorkflowTaskInstance rows up to date in SNAPSHOT mode, they are used by the stats and list APIs
+WORKFLOW_SNAPSHOT_PROJECTION = strtobool(os.getenv("WORKFLOW_SNAPSHOT_PROJECTION", "True"))
+# Rows each task state counter of the stats is split in, more shards means less waiting between concurrent runs
+WORKFLOW_STATS_COUNTER_SHARDS = int(os.getenv("WORKFLOW_STATS_COUNTER_SHARDS", 8))
+# Due timers fired per transaction, and how often the beat schedule looks for them
+WORKFLOW_TIMER_BATCH_SIZE = int(os.getenv("WORKFLOW_TIMER_BATCH_SIZE", 1000))
+WORKFLOW_TIMER_INTERVAL = int(os.getenv("WORKFLOW_TIMER_INTERVAL", 5))
+# COMPLETED/CANCELED instances are archived this many days after their last update
+WORKFLOW_ARCHIVE_AFTER_DAYS = int(os.getenv("WORKFLOW_ARCHIVE_AFTER_DAYS", 30))
+# DATABASE keeps the archives in the ArchivedWorkflowInstance table, FILE in gzipped JSON lines files
+WORKFLOW_ARCHIVE_BACKEND = os.getenv("WORKFLOW_ARCHIVE_BACKEND", "DATABASE")
+WORKFLOW_ARCHIVE_DIR = os.getenv("WORKFLOW_ARCHIVE_DIR", str(BASE_DIR / "archive"))
+WORKFLOW_ARCHIVE_BATCH_SIZE = int(os.getenv("WORKFLOW_ARCHIVE_BATCH_SIZE", 100))
+# Seconds to sleep between batches, so the replicas keep up, and batches done by each run of the beat schedule
+WORKFLOW_ARCHIVE_THROTTLE = float(os.getenv("WORKFLOW_ARCHIVE_THROTTLE", 0.5))
+WORKFLOW_ARCHIVE_MAX_BATCHES = int(os.getenv("WORKFLOW_ARCHIVE_MAX_BATCHES", 100))
+# Unreferenced task payloads, and blobs, deleted per transaction by the daily cleanups
+WORKFLOW_PAYLOAD_GC_BATCH_SIZE = int(os.getenv("WORKFLOW_PAYLOAD_GC_BATCH_SIZE", 1000))
+# Variables whose JSON is bigger than this many bytes are moved to the blob store, 0 keeps them in the data
+WORKFLOW_BLOB_THRESHOLD = int(os.getenv("WORKFLOW_BLOB_THRESHOLD", 64 * 1024))
+# Django storage class holding the blobs, and the arguments it is built with
+WORKFLOW_BLOB_STORAGE = os.getenv("WORKFLOW_BLOB_STORAGE", "django.core.files.storage.FileSystemStorage")
+WORKFLOW_BLOB_STORAGE_OPTIONS = {"location": os.getenv("WORKFLOW_BLOB_DIR", str(BASE_DIR / "blobs"))}
+# Monthly partitions of the task table created in advance, once it is partitioned with partition_task_table
+WORKFLOW_TASK_PARTITIONS_AHEAD = int(os.getenv("WORKFLOW_TASK_PARTITIONS_AHEAD", 3))
+# Seconds the clocks of the servers may be apart, the tasks of an instance are looked up from its creation
+# time moved back by this margin
+WORKFLOW_TASK_CLOCK_SKEW = int(os.getenv("WORKFLOW_TASK_CLOCK_SKEW", 24 * 60 * 60))
+# Subscriptions delivered per transaction when a signal is broadcast
+SIGNAL_BROADCAST_CHUNK_SIZE = int(os.getenv("SIGNAL_BROADCAST_CHUNK_SIZE", 1000))
+# Instances started by one call of the start-batch endpoint
+WORKFLOW_START_BATCH_MAX_SIZE = int(os.getenv("WORKFLOW_START_BATCH_MAX_SIZE", 1000))
+# Enqueue the engine runs triggered by the API instead of running them in the request, the admin always does.
+# When off, the runs woken by the timers, the signals and an exhausted step budget are left to the run_workflows command
+WORKFLOW_RUN_ASYNC = strtobool(os.getenv("WORKFLOW_RUN_ASYNC", "False"))
+# Task steps making progress run by one engine run, an instance with more steps left is woken up again for the rest
+WORKFLOW_RUN_STEP_BUDGET = int(os.getenv("WORKFLOW_RUN_STEP_BUDGET", 1000))
+# Seconds before a wakeup whose run failed is claimed again, doubled on each failure up to the max
+WORKFLOW_WAKEUP_RETRY_BACKOFF = int(os.getenv("WORKFLOW_WAKEUP_RETRY_BACKOFF", 10))
+WORKFLOW_WAKEUP_MAX_BACKOFF = int(os.getenv("WORKFLOW_WAKEUP_MAX_BACKOFF", 60 * 60))
+# Seconds an enqueued run waits, so the events of a burst are handled by the same run
+WORKFLOW_RUN_DEBOUNCE = float(os.getenv("WORKFLOW_RUN_DEBOUNCE", 0.5))
+# Service tasks published from the outbox per transaction
+SERVICE_TASK_RELAY_BATCH_SIZE = int(os.getenv("SERVICE_TASK_RELAY_BATCH_SIZE", 500))
+# Queues whose service tasks are fetched by the workers through fetch-and-lock instead of published to the broker
+SERVICE_TASK_PULL_QUEUES = [queue for queue in os.getenv("SERVICE_TASK_PULL_QUEUES", "").split(",") if queue]
+SERVICE_TASK_FETCH_MAX_TASKS = int(os.getenv("SERVICE_TASK_FETCH_MAX_TASKS", 100))
+# Results accepted by one call of the bulk endpoint
+SERVICE_TASK_BULK_MAX_SIZE = int(os.getenv("SERVICE_TASK_BULK_MAX_SIZE", 1000))
+# Longest a fetch-and-lock request may wait for tasks, and how often it looks for them meanwhile. A waiting request
+# holds a gunicorn worker connection and a database connection, so GUNICORN_WORKERS x GUNICORN_WORKER_CONNECTIONS
+# and the database max_connections must leave room for one per polling worker on top of the API traffic
+SERVICE_TASK_FETCH_MAX_WAIT = int(os.getenv("SERVICE_TASK_FETCH_MAX_WAIT", 5))
+SERVICE_TASK_FETCH_POLL_INTERVAL = float(os.getenv("SERVICE_TASK_FETCH_POLL_INTERVAL", 0.5))
+# Seconds a published service task may stay ACTIVATED before it is retried
+SERVICE_TASK_ACTIVATION_TIMEOUT = int(os.getenv("SERVICE_TASK_ACTIVATION_TIMEOUT", 60 * 60))
+SERVICE_TASK_MAX_RETRIES = int(os.getenv("SERVICE_TASK_MAX_RETRIES", 3))
+# Seconds before the first retry, doubled on each following one
+SERVICE_TASK_RETRY_BACKOFF = int(os.getenv("SERVICE_TASK_RETRY_BACKOFF", 60))
+SERVICE_TASK_REAPER_BATCH_SIZE = int(os.getenv("SERVICE_TASK_REAPER_BATCH_SIZE", 500))
+SERVICE_TASK_REAPER_INTERVAL = int(os.getenv("SERVICE_TASK_REAPER_INTERVAL", 30))
+
+CELERY_BEAT_SCHEDULE = {
+    "archive-workflow-instances": {
+        "task": "django_bpmn_engine.core.workflow.service.archive_old_workflow_instances",
+        "schedule": 60 * 60,
+        "options": {"queue": "run_workflow"},
+    },
+    "delete-orphan-task-payloads": {
+        "task": "django_bpmn_engine.core.workflow.service.delete_orphan_task_payloads",
+        "schedule": 24 * 60 * 60,
+        "options": {"queue": "run_workflow"},
+    },
+    "delete-orphan-blobs": {
+        "task": "django_bpmn_engine.core.workflow.service.delete_orphan_blobs",
+        "schedule": 24 * 60 * 60,
+        "options": {"queue": "run_workflow"},
+    },
+    "create-task-partitions": {
+        "task": "django_bpmn_engine.core.workflow.service.create_task_partitions",
+        "schedule": 24 * 60 * 60,
+        "options": {"queue": "run_workflow"},
+    },
+    "fire-workflow-timers": {
+        "task": "django_bpmn_engine.core.workflow.service.fire_workflow_timers",
+        "schedule": WORKFLOW_TIMER_INTERVAL,
+        "options": {"queue": "run_workflow"},
+    },
+    "reap-expired-service-tasks": {
+        "task": "django_bpmn_engine.core.workflow.service.reap_expired_service_tasks",
+        "schedule": SERVICE_TASK_REAPER_INTERVAL,
+        "options": {"queue": "run_workflow"},
+    },
+}
@@ -0,0 +1,38 @@
+from unittest import mock
+
+from django.contrib import admin
+from django.test import RequestFactory
+from django.test import TestCase
+from django.test import override_settings
+
+from django_bpmn_engine.core.admin import ServiceTaskAdmin
+from django_bpmn_engine.core.models import ServiceTask
+from django_bpmn_engine.core.models import ServiceTaskState
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+
+
+@override_settings(WORKFLOW_RUN_ASYNC=False)
+class AdminRunTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(xml="", workflow_process_id="process", name="process")
+        workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+        self.service_task = ServiceTask.objects.create(
+            workflow_instance=workflow_instance, task_name="process:task", queue_name="queue"
+        )
+
+    @mock.patch("django_bpmn_engine.core.workflow.service.run_workflow")
+    def test_completed_service_task_queues_the_run(self, run_workflow):
+        self.service_task.state = ServiceTaskState.COMPLETED
+        model_admin = ServiceTaskAdmin(ServiceTask, admin.site)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            model_admin.save_model(RequestFactory().post("/"), self.service_task, None, True)
+
+        run_workflow.assert_not_called()
+        run_workflow.apply_async.assert_called_once_with(
+            args=[str(self.service_task.workflow_instance_id), None],
+            queue="run_workflow",
+            countdown=mock.ANY,
+            producer=mock.ANY,
+        )
@@ -0,0 +1,96 @@
+import shutil
+import tempfile
+
+from datetime import timedelta
+
+from django.test import TestCase
+from django.test import override_settings
+from django.utils import timezone
+from SpiffWorkflow.task import TaskStateNames
+
+from django_bpmn_engine.core.models import ArchivedWorkflowInstance
+from django_bpmn_engine.core.models import TaskPayload
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowState
+from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.models import WorkflowTaskStateCounter
+from django_bpmn_engine.core.workflow.archive import archive_workflow_instances
+from django_bpmn_engine.core.workflow.archive import read_archived_workflow_instance
+from django_bpmn_engine.core.workflow.service import WorkflowService
+
+SCRIPT_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="script"
+  targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="script" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_script</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:scriptTask id="set_x" scriptFormat="python">
+      <bpmn:incoming>to_script</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+      <bpmn:script>x = i + 1</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_script" sourceRef="start" targetRef="set_x"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="set_x" targetRef="end"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+
+
+@override_settings(WORKFLOW_RUN_ASYNC=False)
+class ArchiveWorkflowInstancesTestCase(TestCase):
+    def setUp(self):
+        self.workflow = Workflow.objects.create(xml=SCRIPT_XML, workflow_process_id="script", name="script")
+        self.completed = [self._start({"i": i}) for i in range(3)]
+        self.running = WorkflowInstance.objects.create(workflow=self.workflow)
+        self.older_than = timezone.now() + timedelta(seconds=1)
+
+    def _start(self, initial_data) -> WorkflowInstance:
+        workflow_instance = WorkflowInstance.objects.create(workflow=self.workflow, initial_data=initial_data)
+        with self.captureOnCommitCallbacks(execute=True):
+            WorkflowService().start_workflow(workflow_instance)
+        workflow_instance.refresh_from_db()
+        self.assertEqual(workflow_instance.state, WorkflowState.COMPLETED)
+        return workflow_instance
+
+    def _assert_archived(self, archived: ArchivedWorkflowInstance, workflow_instance: WorkflowInstance):
+        self.assertEqual(archived.state, WorkflowState.COMPLETED)
+        self.assertEqual(archived.workflow_id, self.workflow.id)
+        rows = read_archived_workflow_instance(archived)
+        self.assertEqual([row["id"] for row in rows["WorkflowInstance"]], [str(workflow_instance.id)])
+        self.assertEqual(archived.rows, sum(len(model_rows) for model_rows in rows.values()))
+        end = next(task for task in rows["WorkflowTaskInstance"] if task["task_spec"] == "end")
+        self.assertEqual(end["data"]["x"], workflow_instance.initial_data["i"] + 1)
+
+    def test_finished_instances_are_moved_to_the_archive(self):
+        self.assertEqual(archive_workflow_instances(10, self.older_than), 3)
+
+        self.assertEqual(list(WorkflowInstance.objects.values_list("id", flat=True)), [self.running.id])
+        self.assertFalse(WorkflowTaskInstance.objects.exists())
+        self.assertFalse(TaskPayload.objects.exists())
+        self.assertEqual(WorkflowTaskStateCounter.objects.get_counts(self.workflow.id, list(TaskStateNames)), {})
+        for workflow_instance in self.completed:
+            archived = ArchivedWorkflowInstance.objects.get(id=workflow_instance.id)
+            self.assertIsNone(archived.path)
+            self._assert_archived(archived, workflow_instance)
+
+    def test_batch_size_and_age_are_respected(self):
+        self.assertEqual(archive_workflow_instances(10, timezone.now() - timedelta(hours=1)), 0)
+
+        self.assertEqual(archive_workflow_instances(2, self.older_than), 2)
+        self.assertEqual(archive_workflow_instances(2, self.older_than), 1)
+        self.assertEqual(archive_workflow_instances(2, self.older_than), 0)
+        self.assertEqual(ArchivedWorkflowInstance.objects.count(), 3)
+
+    def test_file_backend(self):
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+
+        with override_settings(WORKFLOW_ARCHIVE_BACKEND="FILE", WORKFLOW_ARCHIVE_DIR=archive_dir):
+            self.assertEqual(archive_workflow_instances(10, self.older_than), 3)
+
+        for workflow_instance in self.completed:
+            archived = ArchivedWorkflowInstance.objects.get(id=workflow_instance.id)
+            self.assertIsNone(archived.data)
+            self.assertTrue(archived.path.startswith(archive_dir))
+            self._assert_archived(archived, workflow_instance)
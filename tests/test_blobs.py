@@ -0,0 +1,100 @@
+import shutil
+import tempfile
+import uuid
+
+from datetime import timedelta
+
+from django.test import TestCase
+from django.test import override_settings
+from django.utils import timezone
+
+from django_bpmn_engine.core.models import ArchivedWorkflowInstance
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowBlob
+from django_bpmn_engine.core.models import WorkflowBlobReference
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.workflow.blobs import get_blob_store
+from django_bpmn_engine.core.workflow.service import WorkflowService
+from django_bpmn_engine.core.workflow.service import delete_orphan_blobs
+
+SCRIPT_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="script"
+  targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="script" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_script</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:scriptTask id="count" scriptFormat="python">
+      <bpmn:incoming>to_script</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+      <bpmn:script>total = len(items)</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_script" sourceRef="start" targetRef="count"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="count" targetRef="end"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+
+
+class BlobTestCase(TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        settings_override = override_settings(
+            WORKFLOW_BLOB_STORAGE_OPTIONS={"location": location}, WORKFLOW_BLOB_THRESHOLD=100
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_blob_store.cache_clear()
+        self.addCleanup(get_blob_store.cache_clear)
+        self.store = get_blob_store()
+        self.workflow = Workflow.objects.create(xml=SCRIPT_XML, workflow_process_id="script", name="script")
+
+
+class BlobReferenceTestCase(BlobTestCase):
+    def test_started_instance_references_its_blobs(self):
+        workflow_instance = WorkflowInstance.objects.create(workflow=self.workflow, initial_data={"items": [0] * 100})
+        with self.captureOnCommitCallbacks(execute=True):
+            WorkflowService().start_workflow(workflow_instance)
+
+        key = workflow_instance.initial_data["items"]["key"]
+        self.assertTrue(self.store.exists(key))
+        self.assertEqual(
+            list(WorkflowBlobReference.objects.values_list("blob_id", "workflow_instance_id")),
+            [(key, workflow_instance.id)],
+        )
+
+
+class DeleteOrphanBlobsTestCase(BlobTestCase):
+    def _put(self, content: bytes, workflow_instance_id) -> str:
+        key = self.store.put(content)
+        WorkflowBlob.objects.add_references(workflow_instance_id, [key])
+        return key
+
+    def test_only_the_blobs_of_deleted_instances_are_deleted(self):
+        workflow_instance = WorkflowInstance.objects.create(workflow=self.workflow)
+        archived_instance = ArchivedWorkflowInstance.objects.create(
+            id=uuid.uuid4(), state="COMPLETED", instance_created_at=timezone.now(), instance_updated_at=timezone.now()
+        )
+        running = self._put(b"[1]", workflow_instance.id)
+        archived = self._put(b"[2]", archived_instance.id)
+        deleted = self._put(b"[3]", uuid.uuid4())
+        recent = self._put(b"[4]", uuid.uuid4())
+        WorkflowBlob.objects.exclude(key=recent).update(created_at=timezone.now() - timedelta(days=2))
+
+        delete_orphan_blobs()
+
+        self.assertEqual(set(WorkflowBlob.objects.values_list("key", flat=True)), {running, archived, recent})
+        self.assertEqual(WorkflowBlobReference.objects.filter(blob_id=deleted).count(), 0)
+        for key in [running, archived, recent]:
+            self.assertTrue(self.store.exists(key))
+        self.assertFalse(self.store.exists(deleted))
+
+    def test_blob_offloaded_again_is_written_again(self):
+        key = self._put(b"[1]", uuid.uuid4())
+        WorkflowBlob.objects.update(created_at=timezone.now() - timedelta(days=2))
+        delete_orphan_blobs()
+
+        self.assertEqual(self.store.put(b"[1]"), key)
+
+        self.assertTrue(self.store.exists(key))
+        self.assertTrue(WorkflowBlob.objects.filter(key=key).exists())
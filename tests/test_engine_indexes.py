@@ -0,0 +1,100 @@
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from django_bpmn_engine.core.models import ServiceTask
+from django_bpmn_engine.core.models import ServiceTaskState
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowState
+
+
+class DeleteDuplicatedTasksTestCase(TransactionTestCase):
+    migrate_from = [("core", "0010_workflowtaskstatecounter")]
+    migrate_to = [("core", "0011_engine_indexes")]
+
+    def _migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self._migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_keeps_the_most_advanced_row_then_the_last_updated(self):
+        apps = self._migrate(self.migrate_from)
+        Workflow = apps.get_model("core", "Workflow")
+        WorkflowInstance = apps.get_model("core", "WorkflowInstance")
+        ServiceTask = apps.get_model("core", "ServiceTask")
+        UserTask = apps.get_model("core", "UserTask")
+        workflow = Workflow.objects.create(xml="", workflow_process_id="process", name="process")
+        workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+        now = timezone.now()
+
+        def create(model, task_name, state, updated_at, **fields):
+            task = model.objects.create(workflow_instance=workflow_instance, task_name=task_name, state=state, **fields)
+            model.objects.filter(id=task.id).update(updated_at=updated_at)
+            return task.id
+
+        # The completed row is the oldest one, a NEW duplicate was created after it
+        completed = create(ServiceTask, "service", "COMPLETED", now - timedelta(hours=2), queue_name="queue")
+        create(ServiceTask, "service", "NEW", now - timedelta(hours=1), queue_name="queue")
+        create(UserTask, "user", "ASSIGNED", now - timedelta(hours=2))
+        assigned_last = create(UserTask, "user", "ASSIGNED", now - timedelta(hours=1))
+        create(UserTask, "user", "NEW", now)
+
+        apps = self._migrate(self.migrate_to)
+
+        ServiceTask = apps.get_model("core", "ServiceTask")
+        UserTask = apps.get_model("core", "UserTask")
+        self.assertEqual(list(ServiceTask.objects.values_list("id", flat=True)), [completed])
+        self.assertEqual(list(UserTask.objects.values_list("id", flat=True)), [assigned_last])
+
+
+@skipUnless(connection.vendor == "postgresql", "The query plans are checked on PostgreSQL")
+class EngineIndexesQueryPlanTestCase(TestCase):
+    """
+    The engine lookups must keep using their indexes. The tables of a test are too small for the planner
+    to prefer an index over a sequential scan, so sequential scans are disabled.
+    """
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_fetch_and_lock(self):
+        queryset = ServiceTask.objects.filter(
+            queue_name__in=["queue"], state=ServiceTaskState.NEW, next_retry_at__isnull=True
+        ).order_by("created_at")
+        self.assertUsesIndex(queryset, "service_task_fetch_idx")
+
+    def test_expired_leases(self):
+        queryset = ServiceTask.objects.filter(
+            lock_expires_at__lt=timezone.now(), state=ServiceTaskState.ACTIVATED
+        ).order_by("lock_expires_at")
+        self.assertUsesIndex(queryset, "service_task_deadline_idx")
+
+    def test_due_retries(self):
+        queryset = ServiceTask.objects.filter(next_retry_at__lte=timezone.now(), state=ServiceTaskState.NEW)
+        self.assertUsesIndex(queryset, "service_task_retry_idx")
+
+    def test_service_tasks_of_an_instance_by_state(self):
+        queryset = ServiceTask.objects.filter(
+            workflow_instance_id="00000000-0000-0000-0000-000000000000", state=ServiceTaskState.NEW
+        )
+        self.assertUsesIndex(queryset, "service_task_state_idx")
+
+    def test_running_root_instances(self):
+        queryset = WorkflowInstance.objects.filter(
+            state=WorkflowState.RUNNING, parent__isnull=True, updated_at__lt=timezone.now()
+        ).order_by("updated_at")
+        self.assertUsesIndex(queryset, "running_instance_idx")
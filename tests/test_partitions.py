@@ -0,0 +1,80 @@
+from datetime import date
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowState
+from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.workflow.partitions import _add_months
+from django_bpmn_engine.core.workflow.partitions import convert_to_partitioned
+from django_bpmn_engine.core.workflow.partitions import drop_partitions
+from django_bpmn_engine.core.workflow.partitions import get_partitions
+from django_bpmn_engine.core.workflow.partitions import is_partitioned
+
+
+@skipUnless(connection.vendor == "postgresql", "Partitioning is only supported on PostgreSQL")
+class ConvertToPartitionedTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(xml="", workflow_process_id="process", name="process")
+        self.workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+
+    def _create_task(self) -> WorkflowTaskInstance:
+        return WorkflowTaskInstance.objects.create(
+            workflow_instance=self.workflow_instance,
+            last_state_change=timezone.now(),
+            state=16,
+            task_spec="Start",
+            triggered=False,
+            workflow_name="process",
+        )
+
+    def test_convert_keeps_the_rows_and_partitions_new_ones(self):
+        task = self._create_task()
+
+        convert_to_partitioned(months_ahead=1)
+
+        self.assertTrue(is_partitioned())
+        self.assertIn(date.today().replace(day=1), get_partitions())
+        self.assertEqual(list(WorkflowTaskInstance.objects.values_list("id", flat=True)), [task.id])
+        new_task = self._create_task()
+        table = WorkflowTaskInstance._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT tableoid::regclass::text FROM {connection.ops.quote_name(table)} WHERE id = %s", [new_task.id]
+            )
+            (partition,) = cursor.fetchone()
+        self.assertEqual(partition, f"{table}_{date.today():%Y_%m}")
+
+    def test_convert_keeps_the_primary_key_name(self):
+        table = WorkflowTaskInstance._meta.db_table
+        with connection.cursor() as cursor:
+            before = connection.introspection.get_constraints(cursor, table)
+        primary_key = next(name for name, constraint in before.items() if constraint["primary_key"])
+
+        convert_to_partitioned(months_ahead=0)
+
+        with connection.cursor() as cursor:
+            after = connection.introspection.get_constraints(cursor, table)
+        self.assertEqual(after[primary_key]["columns"], ["id", "created_at"])
+
+    def test_drop_keeps_the_partitions_of_unfinished_instances(self):
+        current_month = date.today().replace(day=1)
+        last_month = _add_months(current_month, -1)
+        task = self._create_task()
+        WorkflowTaskInstance.objects.filter(id=task.id).update(
+            created_at=timezone.now().replace(year=last_month.year, month=last_month.month, day=15)
+        )
+        convert_to_partitioned(months_ahead=0)
+        self.assertIn(last_month, get_partitions())
+
+        WorkflowInstance.objects.filter(id=self.workflow_instance.id).update(state=WorkflowState.FAILURE)
+        self.assertEqual(drop_partitions(current_month), [])
+        self.assertIn(last_month, get_partitions())
+
+        WorkflowInstance.objects.filter(id=self.workflow_instance.id).update(state=WorkflowState.COMPLETED)
+        self.assertEqual(drop_partitions(current_month), [f"{WorkflowTaskInstance._meta.db_table}_{last_month:%Y_%m}"])
+        self.assertFalse(WorkflowTaskInstance.objects.exists())
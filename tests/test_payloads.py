@@ -0,0 +1,73 @@
+import threading
+
+from unittest import skipUnless
+
+from django.db import connection
+from django.db import transaction
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from django_bpmn_engine.core.models import TaskPayload
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.workflow.archive import delete_unreferenced_payloads
+
+
+def _create_payload(data) -> str:
+    payload_hash = TaskPayload.objects.make_hash(data)
+    TaskPayload.objects.store({payload_hash: data})
+    return payload_hash
+
+
+class DeleteUnreferencedPayloadsTestCase(TestCase):
+    def test_only_the_unreferenced_payloads_are_deleted(self):
+        workflow = Workflow.objects.create(xml="", workflow_process_id="process", name="process")
+        workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+        referenced = _create_payload({"x": 1})
+        unreferenced = _create_payload({"x": 2})
+        WorkflowTaskInstance.objects.create(
+            workflow_instance=workflow_instance,
+            last_state_change=timezone.now(),
+            state=16,
+            task_spec="Start",
+            triggered=False,
+            workflow_name="process",
+            payload_id=referenced,
+        )
+
+        self.assertEqual(delete_unreferenced_payloads([referenced, unreferenced]), 1)
+
+        self.assertEqual(list(TaskPayload.objects.values_list("hash", flat=True)), [referenced])
+
+
+@skipUnless(connection.vendor == "postgresql", "Rows are only locked on PostgreSQL")
+class StoredPayloadLockTestCase(TransactionTestCase):
+    def test_payload_stored_again_by_a_run_is_kept(self):
+        data = {"x": 1}
+        payload_hash = _create_payload(data)
+        stored = threading.Event()
+        done = threading.Event()
+
+        def run():
+            # A run storing the payload again, whose tasks are not committed yet
+            try:
+                with transaction.atomic():
+                    TaskPayload.objects.store({payload_hash: data})
+                    stored.set()
+                    done.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            self.assertTrue(stored.wait(10))
+            self.assertEqual(delete_unreferenced_payloads([payload_hash]), 0)
+        finally:
+            done.set()
+            thread.join()
+
+        self.assertTrue(TaskPayload.objects.filter(hash=payload_hash).exists())
+        self.assertEqual(delete_unreferenced_payloads([payload_hash]), 1)
@@ -0,0 +1,161 @@
+from unittest import mock
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from django_bpmn_engine.core.management.commands.run_workflows import Command
+from django_bpmn_engine.core.models import ServiceTask
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.models import WorkflowWakeup
+from django_bpmn_engine.core.workflow.service import WorkflowService
+from django_bpmn_engine.core.workflow.service import run_workflow
+
+PARALLEL_SERVICE_TASKS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL"
+  xmlns:camunda="http://camunda.org/schema/1.0/bpmn" id="services" targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="services" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_split</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:parallelGateway id="split">
+      <bpmn:incoming>to_split</bpmn:incoming>
+      <bpmn:outgoing>to_service1</bpmn:outgoing>
+      <bpmn:outgoing>to_service2</bpmn:outgoing>
+      <bpmn:outgoing>to_service3</bpmn:outgoing>
+    </bpmn:parallelGateway>
+    <bpmn:serviceTask id="service1" camunda:type="external" camunda:topic="queue">
+      <bpmn:incoming>to_service1</bpmn:incoming>
+      <bpmn:outgoing>to_join1</bpmn:outgoing>
+    </bpmn:serviceTask>
+    <bpmn:serviceTask id="service2" camunda:type="external" camunda:topic="queue">
+      <bpmn:incoming>to_service2</bpmn:incoming>
+      <bpmn:outgoing>to_join2</bpmn:outgoing>
+    </bpmn:serviceTask>
+    <bpmn:serviceTask id="service3" camunda:type="external" camunda:topic="queue">
+      <bpmn:incoming>to_service3</bpmn:incoming>
+      <bpmn:outgoing>to_join3</bpmn:outgoing>
+    </bpmn:serviceTask>
+    <bpmn:parallelGateway id="join">
+      <bpmn:incoming>to_join1</bpmn:incoming>
+      <bpmn:incoming>to_join2</bpmn:incoming>
+      <bpmn:incoming>to_join3</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+    </bpmn:parallelGateway>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_split" sourceRef="start" targetRef="split"/>
+    <bpmn:sequenceFlow id="to_service1" sourceRef="split" targetRef="service1"/>
+    <bpmn:sequenceFlow id="to_service2" sourceRef="split" targetRef="service2"/>
+    <bpmn:sequenceFlow id="to_service3" sourceRef="split" targetRef="service3"/>
+    <bpmn:sequenceFlow id="to_join1" sourceRef="service1" targetRef="join"/>
+    <bpmn:sequenceFlow id="to_join2" sourceRef="service2" targetRef="join"/>
+    <bpmn:sequenceFlow id="to_join3" sourceRef="service3" targetRef="join"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="join" targetRef="end"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+
+
+class RunWorkflowTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(
+            xml=PARALLEL_SERVICE_TASKS_XML, workflow_process_id="services", name="services"
+        )
+        self.workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+        with self.captureOnCommitCallbacks(execute=True):
+            WorkflowService().start_workflow(self.workflow_instance)
+        self.service_tasks = list(ServiceTask.objects.filter(workflow_instance=self.workflow_instance))
+        self.assertEqual(len(self.service_tasks), 3)
+
+        execute_workflow = WorkflowService.execute_workflow
+        patcher = mock.patch.object(WorkflowService, "execute_workflow", autospec=True, side_effect=execute_workflow)
+        self.execute_workflow = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def _complete(self, service_task):
+        response = self.client.patch(f"/api/v1/service_task/{service_task.id}/complete/", {"output_data": {}})
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def _run_command(self) -> int:
+        command = Command()
+        command.batch_size = 10
+        command.scan = False
+        return command._execute_batch(WorkflowService())
+
+    @override_settings(WORKFLOW_RUN_ASYNC=False)
+    def test_event_is_run_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._complete(self.service_tasks[0])
+
+        self.assertEqual(self.execute_workflow.call_count, 1)
+        self.assertFalse(WorkflowWakeup.objects.exists())
+        self.assertEqual(self._run_command(), 0)
+        self.assertEqual(self.execute_workflow.call_count, 1)
+
+    @override_settings(WORKFLOW_RUN_ASYNC=True)
+    def test_burst_of_events_is_run_once(self):
+        with mock.patch.object(run_workflow, "apply_async") as apply_async:
+            for service_task in self.service_tasks:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self._complete(service_task)
+        self.assertEqual(apply_async.call_count, 3)
+        self.assertEqual(WorkflowWakeup.objects.count(), 1)
+
+        for call in apply_async.call_args_list:
+            run_workflow(*call.kwargs["args"])
+
+        self.assertEqual(self.execute_workflow.call_count, 1)
+        self.workflow_instance.refresh_from_db()
+        self.assertEqual(self.workflow_instance.state, "COMPLETED")
+        self.assertEqual(self._run_command(), 0)
+
+    @override_settings(WORKFLOW_RUN_ASYNC=True)
+    def test_event_claimed_by_the_command_is_not_run_again(self):
+        with mock.patch.object(run_workflow, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self._complete(self.service_tasks[0])
+
+        self.assertEqual(self._run_command(), 1)
+        run_workflow(*apply_async.call_args.kwargs["args"])
+
+        self.assertEqual(self.execute_workflow.call_count, 1)
+
+    def test_run_with_data_is_not_skipped(self):
+        run_workflow(str(self.workflow_instance.id), {"x": 1})
+
+        self.assertEqual(self.execute_workflow.call_count, 1)
+
+
+@skipUnless(connection.vendor == "postgresql", "Rows are only locked on PostgreSQL")
+@override_settings(WORKFLOW_RUN_ASYNC=True)
+class InstanceLockTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(
+            xml=PARALLEL_SERVICE_TASKS_XML, workflow_process_id="services", name="services"
+        )
+        self.workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+        with mock.patch.object(run_workflow, "apply_async"), self.captureOnCommitCallbacks(execute=True):
+            WorkflowService().start_workflow(self.workflow_instance)
+
+    def _assert_instance_locked_before_build(self, run):
+        with CaptureQueriesContext(connection) as context:
+            run()
+        queries = [query["sql"] for query in context.captured_queries]
+        instance_table = connection.ops.quote_name(WorkflowInstance._meta.db_table)
+        task_table = connection.ops.quote_name(WorkflowTaskInstance._meta.db_table)
+        lock = next(i for i, sql in enumerate(queries) if f"FROM {instance_table}" in sql and "FOR UPDATE" in sql)
+        build = next(i for i, sql in enumerate(queries) if f"FROM {task_table}" in sql)
+        self.assertLess(lock, build)
+
+    def test_run_workflow_locks_the_instance(self):
+        self._assert_instance_locked_before_build(lambda: run_workflow(str(self.workflow_instance.id)))
+
+    def test_command_locks_the_instance(self):
+        command = Command()
+        command.batch_size = 1
+        command.scan = False
+        self._assert_instance_locked_before_build(lambda: command._execute_batch(WorkflowService()))
@@ -0,0 +1,54 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from django_bpmn_engine.core.management.commands.run_workflows import Command
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowWakeup
+
+
+class ExecuteBatchTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(xml="", workflow_process_id="process", name="process")
+        # The poisoned instance is woken up first, so it would be the oldest wakeup claimed again
+        self.poisoned = WorkflowInstance.objects.create(workflow=workflow)
+        WorkflowWakeup.objects.wake([self.poisoned.id], reason="test")
+        self.healthy = WorkflowInstance.objects.create(workflow=workflow)
+        WorkflowWakeup.objects.wake([self.healthy.id], reason="test")
+
+        self.command = Command()
+        self.command.batch_size = 5
+        self.command.scan = False
+        self.service = mock.Mock()
+        self.executed = []
+
+        def execute_workflow(workflow_instance):
+            self.executed.append(workflow_instance.id)
+            if workflow_instance.id == self.poisoned.id:
+                raise ValueError("poisoned")
+
+        self.service.execute_workflow.side_effect = execute_workflow
+
+    def test_failed_run_does_not_starve_the_other_wakeups(self):
+        claimed = self.command._execute_batch(self.service)
+
+        self.assertEqual(claimed, 2)
+        self.assertEqual(self.executed, [self.poisoned.id, self.healthy.id])
+        self.assertFalse(WorkflowWakeup.objects.filter(workflow_instance=self.healthy).exists())
+        wakeup = WorkflowWakeup.objects.get(workflow_instance=self.poisoned)
+        self.assertEqual(wakeup.attempts, 1)
+        self.assertGreater(wakeup.next_attempt_at, timezone.now())
+
+    def test_postponed_wakeup_is_not_claimed_before_its_next_attempt(self):
+        self.command._execute_batch(self.service)
+        self.executed.clear()
+
+        self.assertEqual(self.command._execute_batch(self.service), 0)
+        self.assertEqual(self.executed, [])
+
+        WorkflowWakeup.objects.update(next_attempt_at=timezone.now())
+        self.command._execute_batch(self.service)
+        self.assertEqual(self.executed, [self.poisoned.id])
+        self.assertEqual(WorkflowWakeup.objects.get(workflow_instance=self.poisoned).attempts, 2)
@@ -0,0 +1,211 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from django_bpmn_engine.core.models import ServiceTask
+from django_bpmn_engine.core.models import ServiceTaskOutbox
+from django_bpmn_engine.core.models import ServiceTaskState
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.workflow.service import dispatch_workflow_runs
+from django_bpmn_engine.core.workflow.service import fetch_and_lock_service_tasks
+from django_bpmn_engine.core.workflow.service import reap_service_tasks
+from django_bpmn_engine.core.workflow.service import relay_service_tasks
+from django_bpmn_engine.core.workflow.service import run_service_task
+from django_bpmn_engine.core.workflow.service import set_service_task_results
+
+
+def _create_workflow_instance() -> WorkflowInstance:
+    workflow = Workflow.objects.create(xml="", workflow_process_id="process", name="process")
+    return WorkflowInstance.objects.create(workflow=workflow)
+
+
+def _create_service_task(workflow_instance: WorkflowInstance, task_name: str, **fields) -> ServiceTask:
+    fields.setdefault("queue_name", "queue")
+    return ServiceTask.objects.create(workflow_instance=workflow_instance, task_name=task_name, **fields)
+
+
+class FetchAndLockTestCase(TestCase):
+    @override_settings(SERVICE_TASK_FETCH_MAX_WAIT=0)
+    @mock.patch("django_bpmn_engine.core.workflow.service.sleep")
+    def test_wait_is_capped(self, sleep):
+        self.assertEqual(fetch_and_lock_service_tasks("worker", ["queue"], 1, 60, wait=30), [])
+
+        sleep.assert_not_called()
+
+    def test_longer_wait_is_rejected(self):
+        response = APIClient().post(
+            "/api/v1/service_task/fetch-and-lock/",
+            {"worker_id": "worker", "topics": ["queue"], "lock_duration": 60, "async_response_timeout": 3600},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn("async_response_timeout", response.json())
+
+
+class SetServiceTaskResultsTestCase(TestCase):
+    def setUp(self):
+        workflow_instance = _create_workflow_instance()
+        self.service_tasks = [_create_service_task(workflow_instance, f"process:service{i}") for i in range(3)]
+
+    def test_tasks_are_locked_in_the_order_of_their_ids(self):
+        items = [
+            {"id": service_task.id, "state": ServiceTaskState.COMPLETED, "output_data": {"i": i}}
+            for i, service_task in enumerate(reversed(self.service_tasks))
+        ]
+        table = connection.ops.quote_name(ServiceTask._meta.db_table)
+
+        with CaptureQueriesContext(connection) as context:
+            results = set_service_task_results(items)
+
+        self.assertTrue(all(result["success"] for result in results), results)
+        lock = next(query["sql"] for query in context.captured_queries if query["sql"].startswith("SELECT"))
+        self.assertIn(f"FROM {table}", lock)
+        self.assertIn(f"ORDER BY {table}.{connection.ops.quote_name('id')} ASC", lock)
+        self.assertEqual(set(ServiceTask.objects.values_list("state", flat=True)), {ServiceTaskState.COMPLETED})
+
+
+@override_settings(SERVICE_TASK_MAX_RETRIES=1, SERVICE_TASK_RETRY_BACKOFF=60, SERVICE_TASK_PULL_QUEUES=["pull"])
+class ReapServiceTasksTestCase(TestCase):
+    def setUp(self):
+        self.workflow_instance = _create_workflow_instance()
+        self.expired_at = timezone.now() - timedelta(seconds=1)
+        patcher = mock.patch(
+            "django_bpmn_engine.core.workflow.service.dispatch_workflow_runs", autospec=dispatch_workflow_runs
+        )
+        self.dispatch_workflow_runs = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create_activated(self, task_name: str, **fields) -> ServiceTask:
+        return _create_service_task(
+            self.workflow_instance,
+            task_name,
+            state=ServiceTaskState.ACTIVATED,
+            worker_id="worker",
+            lock_expires_at=self.expired_at,
+            **fields,
+        )
+
+    def test_expired_task_is_retried_after_a_backoff(self):
+        service_task = self._create_activated("process:service")
+
+        self.assertEqual(reap_service_tasks(10), 1)
+
+        service_task.refresh_from_db()
+        self.assertEqual(service_task.state, ServiceTaskState.NEW)
+        self.assertEqual(service_task.retries, 1)
+        self.assertIsNone(service_task.worker_id)
+        self.assertIsNone(service_task.lock_expires_at)
+        self.assertGreater(service_task.next_retry_at, timezone.now() + timedelta(seconds=50))
+        self.assertFalse(ServiceTaskOutbox.objects.exists())
+        self.dispatch_workflow_runs.assert_not_called()
+
+    def test_task_out_of_retries_fails_and_wakes_the_instance(self):
+        service_task = self._create_activated("process:service", retries=1)
+
+        with self.assertLogs("django_bpmn_engine.core.workflow.service", "WARNING"):
+            self.assertEqual(reap_service_tasks(10), 1)
+
+        service_task.refresh_from_db()
+        self.assertEqual(service_task.state, ServiceTaskState.FAILURE)
+        self.assertEqual(service_task.output_data["error_name"], "ServiceTaskTimeout")
+        self.dispatch_workflow_runs.assert_called_once_with(
+            [str(self.workflow_instance.id)], reason="ServiceTask timeout"
+        )
+
+    def test_task_not_expired_is_left_alone(self):
+        service_task = self._create_activated("process:service")
+        ServiceTask.objects.filter(id=service_task.id).update(lock_expires_at=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual(reap_service_tasks(10), 0)
+
+        service_task.refresh_from_db()
+        self.assertEqual(service_task.state, ServiceTaskState.ACTIVATED)
+
+    def test_due_retries_go_back_to_their_queue(self):
+        due_at = timezone.now() - timedelta(seconds=1)
+        pushed = _create_service_task(self.workflow_instance, "process:pushed", retries=1, next_retry_at=due_at)
+        pulled = _create_service_task(
+            self.workflow_instance, "process:pulled", retries=1, next_retry_at=due_at, queue_name="pull"
+        )
+        waiting = _create_service_task(
+            self.workflow_instance, "process:waiting", retries=1, next_retry_at=timezone.now() + timedelta(hours=1)
+        )
+
+        self.assertEqual(reap_service_tasks(10), 2)
+
+        self.assertEqual(list(ServiceTaskOutbox.objects.values_list("service_task_id", flat=True)), [pushed.id])
+        self.assertEqual(
+            dict(ServiceTask.objects.filter(next_retry_at__isnull=True).values_list("id", "state")),
+            {pushed.id: ServiceTaskState.NEW, pulled.id: ServiceTaskState.NEW},
+        )
+        waiting.refresh_from_db()
+        self.assertIsNotNone(waiting.next_retry_at)
+
+    def test_batch_size_is_respected(self):
+        for i in range(3):
+            self._create_activated(f"process:service{i}")
+
+        self.assertEqual(reap_service_tasks(2), 2)
+        self.assertEqual(ServiceTask.objects.filter(state=ServiceTaskState.ACTIVATED).count(), 1)
+
+
+class RelayServiceTasksTestCase(TestCase):
+    def setUp(self):
+        self.workflow_instance = _create_workflow_instance()
+        self.service_tasks = [
+            _create_service_task(self.workflow_instance, f"process:service{i}", input_data={"i": i}) for i in range(3)
+        ]
+        for service_task in self.service_tasks:
+            ServiceTaskOutbox.objects.create(service_task=service_task, queue_name=service_task.queue_name)
+        patcher = mock.patch.object(run_service_task, "apply_async")
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tasks_are_published_and_activated(self):
+        self.assertEqual(relay_service_tasks(10), 3)
+
+        self.assertEqual(
+            [call.kwargs["args"] for call in self.apply_async.call_args_list],
+            [
+                [str(self.workflow_instance.id), str(service_task.id), {"i": i}, {}]
+                for i, service_task in enumerate(self.service_tasks)
+            ],
+        )
+        self.assertEqual({call.kwargs["queue"] for call in self.apply_async.call_args_list}, {"queue"})
+        self.assertFalse(ServiceTaskOutbox.objects.exists())
+        for service_task in ServiceTask.objects.all():
+            self.assertEqual(service_task.state, ServiceTaskState.ACTIVATED)
+            self.assertIsNotNone(service_task.lock_expires_at)
+
+    def test_batch_size_is_respected(self):
+        self.assertEqual(relay_service_tasks(2), 2)
+        self.assertEqual(ServiceTaskOutbox.objects.count(), 1)
+
+        self.assertEqual(relay_service_tasks(2), 1)
+        self.assertEqual(relay_service_tasks(2), 0)
+        self.assertEqual(self.apply_async.call_count, 3)
+
+    def test_only_the_tasks_of_the_instance_are_published(self):
+        other = _create_service_task(_create_workflow_instance(), "process:other")
+        ServiceTaskOutbox.objects.create(service_task=other, queue_name=other.queue_name)
+
+        self.assertEqual(relay_service_tasks(10, workflow_instance_id=self.workflow_instance.id), 3)
+
+        self.assertEqual(list(ServiceTaskOutbox.objects.values_list("service_task_id", flat=True)), [other.id])
+
+    def test_failed_publish_keeps_the_outbox(self):
+        self.apply_async.side_effect = ConnectionError
+
+        with self.assertRaises(ConnectionError):
+            relay_service_tasks(10)
+
+        self.assertEqual(ServiceTaskOutbox.objects.count(), 3)
+        self.assertEqual(set(ServiceTask.objects.values_list("state", flat=True)), {ServiceTaskState.NEW})
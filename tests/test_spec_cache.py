@@ -0,0 +1,92 @@
+from django.test import TestCase
+
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.workflow.cache import get_spec_stamp
+from django_bpmn_engine.core.workflow.cache import workflow_spec_cache
+from django_bpmn_engine.core.workflow.service import WorkflowService
+
+PARENT_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="parent"
+  targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="parent" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_call</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:callActivity id="call" calledElement="child">
+      <bpmn:incoming>to_call</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+    </bpmn:callActivity>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_call" sourceRef="start" targetRef="call"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="call" targetRef="end"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+CHILD_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="child"
+  targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="child" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_script</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:scriptTask id="{script_id}" scriptFormat="python">
+      <bpmn:incoming>to_script</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+      <bpmn:script>x = 1</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_script" sourceRef="start" targetRef="{script_id}"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="{script_id}" targetRef="end"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+
+
+class SpecCacheTestCase(TestCase):
+    def setUp(self):
+        workflow_spec_cache.clear()
+        self.addCleanup(workflow_spec_cache.clear)
+        self.service = WorkflowService()
+        self.parent = Workflow.objects.create(xml=PARENT_XML, workflow_process_id="parent", name="parent")
+        Workflow.objects.create(
+            xml=CHILD_XML.format(script_id="script_v2"), workflow_process_id="child", name="child", version=2
+        )
+        Workflow.objects.create(
+            xml=CHILD_XML.format(script_id="script_v1"), workflow_process_id="child", name="child", version=1
+        )
+
+    def test_call_activity_loads_the_highest_version(self):
+        cached = self.service._get_cached_spec(self.parent)
+
+        self.assertIn("script_v2", cached.subprocess_specs["child"].task_specs)
+
+    def test_hit_does_not_query_the_database(self):
+        cached = self.service._get_cached_spec(self.parent)
+
+        with self.assertNumQueries(0):
+            self.assertIs(self.service._get_cached_spec(self.parent), cached)
+
+    def test_called_workflow_deployed_by_another_process(self):
+        stale = self.service._get_cached_spec(self.parent)
+        key = workflow_spec_cache.make_key(self.parent)
+        stamp = get_spec_stamp()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Workflow.objects.create(
+                xml=CHILD_XML.format(script_id="script_v3"), workflow_process_id="child", name="child", version=3
+            )
+        self.assertNotEqual(get_spec_stamp(), stamp)
+        # The save only drops the entries of this process, the other ones still hold the stale spec
+        workflow_spec_cache.set(key, stale, stamp)
+
+        cached = self.service._get_cached_spec(self.parent)
+        self.assertIn("script_v3", cached.subprocess_specs["child"].task_specs)
+        with self.assertNumQueries(0):
+            self.assertIs(self.service._get_cached_spec(self.parent), cached)
+
+    def test_unrelated_change_keeps_the_entry(self):
+        cached = self.service._get_cached_spec(self.parent)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Workflow.objects.create(xml="", workflow_process_id="other", name="other")
+
+        with self.assertNumQueries(1):
+            self.assertIs(self.service._get_cached_spec(self.parent), cached)
+        with self.assertNumQueries(0):
+            self.service._get_cached_spec(self.parent)
@@ -0,0 +1,80 @@
+from unittest import mock
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+from SpiffWorkflow.task import TaskStateNames
+
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.models import WorkflowTaskStateCounter
+from django_bpmn_engine.core.models import WorkflowWakeup
+from django_bpmn_engine.core.workflow.service import WorkflowService
+from django_bpmn_engine.core.workflow.service import run_workflow
+
+SERVICE_TASK_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL"
+  xmlns:camunda="http://camunda.org/schema/1.0/bpmn" id="service" targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="service" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_service</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:serviceTask id="call" camunda:type="external" camunda:topic="queue">
+      <bpmn:incoming>to_service</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+    </bpmn:serviceTask>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_service" sourceRef="start" targetRef="call"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="call" targetRef="end"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+
+
+def _get_task_states(workflow_instance_id):
+    return sorted(
+        WorkflowTaskInstance.objects.filter(workflow_instance_id=workflow_instance_id).values_list(
+            "task_spec", "state"
+        )
+    )
+
+
+class StartBatchTestCase(TestCase):
+    def setUp(self):
+        self.workflow = Workflow.objects.create(xml=SERVICE_TASK_XML, workflow_process_id="service", name="service")
+        self.client = APIClient()
+        patcher = mock.patch.object(run_workflow, "apply_async")
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _start_batch(self, initial_data):
+        return self.client.post(
+            f"/api/v1/workflow/{self.workflow.id}/start-batch/", {"initial_data": initial_data}, format="json"
+        )
+
+    def test_instances_are_started_like_one_by_one(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._start_batch([{"i": i} for i in range(3)])
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([instance["initial_data"] for instance in response.json()], [{"i": i} for i in range(3)])
+        ids = [str(id) for id in WorkflowInstance.objects.values_list("id", flat=True)]
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(sorted(call.kwargs["args"][0] for call in self.apply_async.call_args_list), sorted(ids))
+        self.assertEqual(WorkflowWakeup.objects.count(), 3)
+
+        # Not run, like the instances of the batch
+        single = WorkflowInstance.objects.create(workflow=self.workflow, initial_data={"i": 0})
+        with self.captureOnCommitCallbacks():
+            WorkflowService().start_workflow(single)
+        self.assertTrue(_get_task_states(single.id))
+        for id in ids:
+            self.assertEqual(_get_task_states(id), _get_task_states(single.id))
+
+        counts = WorkflowTaskStateCounter.objects.get_counts(self.workflow.id, list(TaskStateNames))
+        WorkflowTaskStateCounter.objects.rebuild([self.workflow.id])
+        self.assertEqual(WorkflowTaskStateCounter.objects.get_counts(self.workflow.id, list(TaskStateNames)), counts)
+
+    def test_empty_batch_is_rejected(self):
+        response = self._start_batch([])
+
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertFalse(WorkflowInstance.objects.exists())
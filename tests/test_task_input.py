@@ -0,0 +1,89 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.test import override_settings
+
+from django_bpmn_engine.core.models import ServiceTask
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.workflow.service import WorkflowService
+from django_bpmn_engine.core.workflow.service import run_workflow
+
+SERVICE_TASKS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL"
+  xmlns:camunda="http://camunda.org/schema/1.0/bpmn" id="services" targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="services" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_split</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:parallelGateway id="split">
+      <bpmn:incoming>to_split</bpmn:incoming>
+      <bpmn:outgoing>to_all</bpmn:outgoing>
+      <bpmn:outgoing>to_declared</bpmn:outgoing>
+    </bpmn:parallelGateway>
+    <bpmn:serviceTask id="all" camunda:type="external" camunda:topic="queue">
+      <bpmn:incoming>to_all</bpmn:incoming>
+      <bpmn:outgoing>to_join_all</bpmn:outgoing>
+    </bpmn:serviceTask>
+    <bpmn:serviceTask id="declared" camunda:type="external" camunda:topic="queue">
+      <bpmn:extensionElements>
+        <camunda:properties><camunda:property name="inputVariables" value="order, missing " /></camunda:properties>
+      </bpmn:extensionElements>
+      <bpmn:incoming>to_declared</bpmn:incoming>
+      <bpmn:outgoing>to_join_declared</bpmn:outgoing>
+    </bpmn:serviceTask>
+    <bpmn:parallelGateway id="join">
+      <bpmn:incoming>to_join_all</bpmn:incoming>
+      <bpmn:incoming>to_join_declared</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+    </bpmn:parallelGateway>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_split" sourceRef="start" targetRef="split"/>
+    <bpmn:sequenceFlow id="to_all" sourceRef="split" targetRef="all"/>
+    <bpmn:sequenceFlow id="to_declared" sourceRef="split" targetRef="declared"/>
+    <bpmn:sequenceFlow id="to_join_all" sourceRef="all" targetRef="join"/>
+    <bpmn:sequenceFlow id="to_join_declared" sourceRef="declared" targetRef="join"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="join" targetRef="end"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+
+INITIAL_DATA = {"order": {"id": 1, "lines": [1, 2]}, "customer": "c1"}
+
+
+@override_settings(WORKFLOW_RUN_ASYNC=True)
+class TaskInputTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(xml=SERVICE_TASKS_XML, workflow_process_id="services", name="services")
+        self.workflow_instance = WorkflowInstance.objects.create(workflow=workflow, initial_data=INITIAL_DATA)
+        # The instance is only run by the tests
+        with mock.patch.object(run_workflow, "apply_async"), self.captureOnCommitCallbacks(execute=True):
+            WorkflowService().start_workflow(self.workflow_instance)
+
+    def _run(self, extra_data=None):
+        with mock.patch.object(run_workflow, "apply_async"), self.captureOnCommitCallbacks(execute=True):
+            run_workflow(str(self.workflow_instance.id), extra_data)
+
+    def _get_input_data(self, task_id: str):
+        return ServiceTask.objects.get(task_name=f"services:{task_id}").input_data
+
+    def test_input_is_all_the_data_or_the_declared_variables(self):
+        self._run()
+
+        self.assertEqual(self._get_input_data("all"), INITIAL_DATA)
+        self.assertEqual(self._get_input_data("declared"), {"order": INITIAL_DATA["order"]})
+
+    def test_data_given_to_the_run_is_merged(self):
+        self._run({"order": {"status": "paid"}, "note": "n"})
+
+        order = {"id": 1, "lines": [1, 2], "status": "paid"}
+        self.assertEqual(self._get_input_data("all"), {"order": order, "customer": "c1", "note": "n"})
+        self.assertEqual(self._get_input_data("declared"), {"order": order})
+
+    def test_input_is_only_built_when_the_task_is_created(self):
+        self._run()
+
+        with mock.patch.object(WorkflowService, "_get_input_data") as get_input_data:
+            self._run({"x": 1})
+
+        get_input_data.assert_not_called()
+        self.assertEqual(ServiceTask.objects.count(), 2)
+        self.assertEqual(self._get_input_data("all"), INITIAL_DATA)
@@ -0,0 +1,107 @@
+from django.test import TestCase
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from SpiffWorkflow.task import TaskStateNames
+
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.models import WorkflowTaskStateCounter
+from django_bpmn_engine.core.workflow.service import WorkflowService
+
+SCRIPT_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="script"
+  targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="script" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_script</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:scriptTask id="set_x" scriptFormat="python">
+      <bpmn:incoming>to_script</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+      <bpmn:script>x = 1</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_script" sourceRef="start" targetRef="set_x"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="set_x" targetRef="end"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+
+STATES = list(TaskStateNames)
+
+
+def _create_task(workflow_instance: WorkflowInstance, task_spec: str, state: int) -> WorkflowTaskInstance:
+    return WorkflowTaskInstance.objects.create(
+        workflow_instance=workflow_instance,
+        last_state_change=timezone.now(),
+        state=state,
+        task_spec=task_spec,
+        triggered=False,
+        workflow_name="process",
+    )
+
+
+class WorkflowTaskStateCounterTestCase(TestCase):
+    def setUp(self):
+        self.workflow = Workflow.objects.create(xml="", workflow_process_id="process", name="process")
+
+    def test_add_sums_the_deltas_of_each_shard(self):
+        WorkflowTaskStateCounter.objects.add(self.workflow.id, 0, {("task", 16): 2, ("task", 32): 1})
+        WorkflowTaskStateCounter.objects.add(self.workflow.id, 1, {("task", 16): 3, ("other", 16): 0})
+        WorkflowTaskStateCounter.objects.add(self.workflow.id, 0, {("task", 16): -1, ("task", 32): -1})
+
+        self.assertEqual(WorkflowTaskStateCounter.objects.get_counts(self.workflow.id, STATES), {"task": {16: 4}})
+        self.assertEqual(WorkflowTaskStateCounter.objects.get_counts(self.workflow.id, [32]), {})
+        self.assertEqual(
+            sorted(WorkflowTaskStateCounter.objects.values_list("task_spec", "state", "shard", "count")),
+            [("task", 16, 0, 1), ("task", 16, 1, 3), ("task", 32, 0, 0)],
+        )
+
+    def test_rebuild_recounts_the_tasks(self):
+        other = Workflow.objects.create(xml="", workflow_process_id="other", name="other")
+        workflow_instance = WorkflowInstance.objects.create(workflow=self.workflow)
+        other_instance = WorkflowInstance.objects.create(workflow=other)
+        for state in [16, 16, 64]:
+            _create_task(workflow_instance, "task", state)
+        _create_task(other_instance, "task", 16)
+        WorkflowTaskStateCounter.objects.add(self.workflow.id, 3, {("task", 16): 5, ("stale", 64): 1})
+        WorkflowTaskStateCounter.objects.add(other.id, 0, {("task", 16): 7})
+
+        WorkflowTaskStateCounter.objects.rebuild([self.workflow.id])
+
+        self.assertEqual(
+            WorkflowTaskStateCounter.objects.get_counts(self.workflow.id, STATES), {"task": {16: 2, 64: 1}}
+        )
+        self.assertEqual(WorkflowTaskStateCounter.objects.get_counts(other.id, STATES), {"task": {16: 7}})
+
+        WorkflowTaskStateCounter.objects.rebuild()
+
+        self.assertEqual(WorkflowTaskStateCounter.objects.get_counts(other.id, STATES), {"task": {16: 1}})
+
+    @override_settings(WORKFLOW_RUN_ASYNC=False)
+    def test_counters_follow_the_runs(self):
+        workflow = Workflow.objects.create(xml=SCRIPT_XML, workflow_process_id="script", name="script")
+        for _ in range(2):
+            workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+            with self.captureOnCommitCallbacks(execute=True):
+                WorkflowService().start_workflow(workflow_instance)
+            workflow_instance.refresh_from_db()
+            self.assertEqual(workflow_instance.state, "COMPLETED")
+
+        counts = WorkflowTaskStateCounter.objects.get_counts(workflow.id, STATES)
+        WorkflowTaskStateCounter.objects.rebuild([workflow.id])
+
+        self.assertTrue(counts)
+        self.assertEqual(WorkflowTaskStateCounter.objects.get_counts(workflow.id, STATES), counts)
+
+    @override_settings(WORKFLOW_RUN_ASYNC=False)
+    def test_stats_leave_out_the_internal_task_specs(self):
+        workflow = Workflow.objects.create(xml=SCRIPT_XML, workflow_process_id="script", name="script")
+        workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+        with self.captureOnCommitCallbacks(execute=True):
+            WorkflowService().start_workflow(workflow_instance)
+
+        response = APIClient().get(f"/api/v1/workflow/{workflow.id}/stats/")
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()["stats"], {"start": {"32": 1}, "set_x": {"32": 1}, "end": {"32": 1}})
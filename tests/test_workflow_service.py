@@ -0,0 +1,508 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.test import override_settings
+from django.utils import timezone
+from SpiffWorkflow.bpmn.workflow import BpmnWorkflow
+from SpiffWorkflow.task import TaskState
+
+from django_bpmn_engine.core.models import EventSubscription
+from django_bpmn_engine.core.models import EventSubscriptionState
+from django_bpmn_engine.core.models import Incident
+from django_bpmn_engine.core.models import MessageTaskEvent
+from django_bpmn_engine.core.models import PersistenceMode
+from django_bpmn_engine.core.models import UserTask
+from django_bpmn_engine.core.models import UserTaskState
+from django_bpmn_engine.core.models import Workflow
+from django_bpmn_engine.core.models import WorkflowInstance
+from django_bpmn_engine.core.models import WorkflowState
+from django_bpmn_engine.core.models import WorkflowTaskInstance
+from django_bpmn_engine.core.models import WorkflowTimer
+from django_bpmn_engine.core.models import WorkflowWakeup
+from django_bpmn_engine.core.workflow.cache import workflow_spec_cache
+from django_bpmn_engine.core.workflow.service import WorkflowService
+from django_bpmn_engine.core.workflow.service import broadcast_signal
+from django_bpmn_engine.core.workflow.service import fire_due_timers
+from django_bpmn_engine.core.workflow.workflow import CustomWorkflow
+
+PARKED_USER_TASKS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="parked"
+  targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="parked" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_split</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:parallelGateway id="split">
+      <bpmn:incoming>to_split</bpmn:incoming>
+      <bpmn:outgoing>to_task1</bpmn:outgoing>
+      <bpmn:outgoing>to_task2</bpmn:outgoing>
+      <bpmn:outgoing>to_task3</bpmn:outgoing>
+    </bpmn:parallelGateway>
+    <bpmn:userTask id="task1">
+      <bpmn:incoming>to_task1</bpmn:incoming>
+      <bpmn:outgoing>to_end1</bpmn:outgoing>
+    </bpmn:userTask>
+    <bpmn:userTask id="task2">
+      <bpmn:incoming>to_task2</bpmn:incoming>
+      <bpmn:outgoing>to_end2</bpmn:outgoing>
+    </bpmn:userTask>
+    <bpmn:userTask id="task3">
+      <bpmn:incoming>to_task3</bpmn:incoming>
+      <bpmn:outgoing>to_end3</bpmn:outgoing>
+    </bpmn:userTask>
+    <bpmn:endEvent id="end1"><bpmn:incoming>to_end1</bpmn:incoming></bpmn:endEvent>
+    <bpmn:endEvent id="end2"><bpmn:incoming>to_end2</bpmn:incoming></bpmn:endEvent>
+    <bpmn:endEvent id="end3"><bpmn:incoming>to_end3</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_split" sourceRef="start" targetRef="split"/>
+    <bpmn:sequenceFlow id="to_task1" sourceRef="split" targetRef="task1"/>
+    <bpmn:sequenceFlow id="to_task2" sourceRef="split" targetRef="task2"/>
+    <bpmn:sequenceFlow id="to_task3" sourceRef="split" targetRef="task3"/>
+    <bpmn:sequenceFlow id="to_end1" sourceRef="task1" targetRef="end1"/>
+    <bpmn:sequenceFlow id="to_end2" sourceRef="task2" targetRef="end2"/>
+    <bpmn:sequenceFlow id="to_end3" sourceRef="task3" targetRef="end3"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+SCRIPT_BETWEEN_USER_TASKS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL"
+  xmlns:camunda="http://camunda.org/schema/1.0/bpmn" id="review" targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="review" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_first</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:userTask id="first">
+      <bpmn:extensionElements>
+        <camunda:formData><camunda:formField id="comment" label="Comment" type="string" /></camunda:formData>
+      </bpmn:extensionElements>
+      <bpmn:incoming>to_first</bpmn:incoming>
+      <bpmn:outgoing>to_script</bpmn:outgoing>
+    </bpmn:userTask>
+    <bpmn:scriptTask id="script" scriptFormat="python">
+      <bpmn:incoming>to_script</bpmn:incoming>
+      <bpmn:outgoing>to_second</bpmn:outgoing>
+      <bpmn:script>x = 2</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:userTask id="second">
+      <bpmn:extensionElements>
+        <camunda:formData><camunda:formField id="comment" label="Comment" type="string" /></camunda:formData>
+      </bpmn:extensionElements>
+      <bpmn:incoming>to_second</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+    </bpmn:userTask>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_first" sourceRef="start" targetRef="first"/>
+    <bpmn:sequenceFlow id="to_script" sourceRef="first" targetRef="script"/>
+    <bpmn:sequenceFlow id="to_second" sourceRef="script" targetRef="second"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="second" targetRef="end"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+SIGNAL_LOOP_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="signal_loop"
+  targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="signal_loop" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_init</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:scriptTask id="init" scriptFormat="python">
+      <bpmn:incoming>to_init</bpmn:incoming>
+      <bpmn:outgoing>to_wait</bpmn:outgoing>
+      <bpmn:script>count = 0</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:intermediateCatchEvent id="wait">
+      <bpmn:incoming>to_wait</bpmn:incoming>
+      <bpmn:incoming>again</bpmn:incoming>
+      <bpmn:outgoing>to_count</bpmn:outgoing>
+      <bpmn:signalEventDefinition signalRef="go" />
+    </bpmn:intermediateCatchEvent>
+    <bpmn:scriptTask id="count" scriptFormat="python">
+      <bpmn:incoming>to_count</bpmn:incoming>
+      <bpmn:outgoing>to_gateway</bpmn:outgoing>
+      <bpmn:script>count = count + 1</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:exclusiveGateway id="gateway" default="again">
+      <bpmn:incoming>to_gateway</bpmn:incoming>
+      <bpmn:outgoing>again</bpmn:outgoing>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+    </bpmn:exclusiveGateway>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_init" sourceRef="start" targetRef="init"/>
+    <bpmn:sequenceFlow id="to_wait" sourceRef="init" targetRef="wait"/>
+    <bpmn:sequenceFlow id="to_count" sourceRef="wait" targetRef="count"/>
+    <bpmn:sequenceFlow id="to_gateway" sourceRef="count" targetRef="gateway"/>
+    <bpmn:sequenceFlow id="again" sourceRef="gateway" targetRef="wait"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="gateway" targetRef="end">
+      <bpmn:conditionExpression>count &gt;= 2</bpmn:conditionExpression>
+    </bpmn:sequenceFlow>
+  </bpmn:process>
+  <bpmn:signal id="go" name="go" />
+</bpmn:definitions>
+"""
+
+NESTED_JOINS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="joins"
+  targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="joins" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_split</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:parallelGateway id="split">
+      <bpmn:incoming>to_split</bpmn:incoming>
+      <bpmn:outgoing>to_a</bpmn:outgoing>
+      <bpmn:outgoing>to_inner_split</bpmn:outgoing>
+      <bpmn:outgoing>to_multi</bpmn:outgoing>
+    </bpmn:parallelGateway>
+    <bpmn:scriptTask id="a" scriptFormat="python">
+      <bpmn:incoming>to_a</bpmn:incoming>
+      <bpmn:outgoing>from_a</bpmn:outgoing>
+      <bpmn:script>a = 1</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:parallelGateway id="inner_split">
+      <bpmn:incoming>to_inner_split</bpmn:incoming>
+      <bpmn:outgoing>to_b1</bpmn:outgoing>
+      <bpmn:outgoing>to_b2</bpmn:outgoing>
+    </bpmn:parallelGateway>
+    <bpmn:scriptTask id="b1" scriptFormat="python">
+      <bpmn:incoming>to_b1</bpmn:incoming>
+      <bpmn:outgoing>from_b1</bpmn:outgoing>
+      <bpmn:script>b1 = 1</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:scriptTask id="b2" scriptFormat="python">
+      <bpmn:incoming>to_b2</bpmn:incoming>
+      <bpmn:outgoing>from_b2</bpmn:outgoing>
+      <bpmn:script>b2 = 1</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:parallelGateway id="inner_join">
+      <bpmn:incoming>from_b1</bpmn:incoming>
+      <bpmn:incoming>from_b2</bpmn:incoming>
+      <bpmn:outgoing>from_inner_join</bpmn:outgoing>
+    </bpmn:parallelGateway>
+    <bpmn:scriptTask id="multi" scriptFormat="python">
+      <bpmn:incoming>to_multi</bpmn:incoming>
+      <bpmn:outgoing>from_multi</bpmn:outgoing>
+      <bpmn:multiInstanceLoopCharacteristics>
+        <bpmn:loopCardinality>3</bpmn:loopCardinality>
+      </bpmn:multiInstanceLoopCharacteristics>
+      <bpmn:script>m = 1</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:parallelGateway id="join">
+      <bpmn:incoming>from_a</bpmn:incoming>
+      <bpmn:incoming>from_inner_join</bpmn:incoming>
+      <bpmn:incoming>from_multi</bpmn:incoming>
+      <bpmn:outgoing>to_done</bpmn:outgoing>
+    </bpmn:parallelGateway>
+    <bpmn:scriptTask id="done" scriptFormat="python">
+      <bpmn:incoming>to_done</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+      <bpmn:script>done = a + b1 + b2</bpmn:script>
+    </bpmn:scriptTask>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_split" sourceRef="start" targetRef="split"/>
+    <bpmn:sequenceFlow id="to_a" sourceRef="split" targetRef="a"/>
+    <bpmn:sequenceFlow id="to_inner_split" sourceRef="split" targetRef="inner_split"/>
+    <bpmn:sequenceFlow id="to_multi" sourceRef="split" targetRef="multi"/>
+    <bpmn:sequenceFlow id="from_a" sourceRef="a" targetRef="join"/>
+    <bpmn:sequenceFlow id="to_b1" sourceRef="inner_split" targetRef="b1"/>
+    <bpmn:sequenceFlow id="to_b2" sourceRef="inner_split" targetRef="b2"/>
+    <bpmn:sequenceFlow id="from_b1" sourceRef="b1" targetRef="inner_join"/>
+    <bpmn:sequenceFlow id="from_b2" sourceRef="b2" targetRef="inner_join"/>
+    <bpmn:sequenceFlow id="from_inner_join" sourceRef="inner_join" targetRef="join"/>
+    <bpmn:sequenceFlow id="from_multi" sourceRef="multi" targetRef="join"/>
+    <bpmn:sequenceFlow id="to_done" sourceRef="join" targetRef="done"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="done" targetRef="end"/>
+  </bpmn:process>
+</bpmn:definitions>
+"""
+
+
+MESSAGE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL"
+  xmlns:camunda="http://camunda.org/schema/1.0/bpmn" id="message" targetNamespace="http://bpmn.io/schema/bpmn">
+  <bpmn:process id="message" isExecutable="true">
+    <bpmn:startEvent id="start"><bpmn:outgoing>to_wait</bpmn:outgoing></bpmn:startEvent>
+    <bpmn:intermediateCatchEvent id="wait">
+      <bpmn:extensionElements>
+        <camunda:properties><camunda:property name="correlationKey" value="order_id"/></camunda:properties>
+      </bpmn:extensionElements>
+      <bpmn:incoming>to_wait</bpmn:incoming>
+      <bpmn:outgoing>to_end</bpmn:outgoing>
+      <bpmn:messageEventDefinition id="paid_definition" messageRef="paid"/>
+    </bpmn:intermediateCatchEvent>
+    <bpmn:endEvent id="end"><bpmn:incoming>to_end</bpmn:incoming></bpmn:endEvent>
+    <bpmn:sequenceFlow id="to_wait" sourceRef="start" targetRef="wait"/>
+    <bpmn:sequenceFlow id="to_end" sourceRef="wait" targetRef="end"/>
+  </bpmn:process>
+  <bpmn:message id="paid" name="order_paid"/>
+</bpmn:definitions>
+"""
+
+
+@override_settings(WORKFLOW_RUN_STEP_BUDGET=1)
+class StepBudgetTestCase(TestCase):
+    def setUp(self):
+        self.workflow = Workflow.objects.create(
+            xml=PARKED_USER_TASKS_XML, workflow_process_id="parked", name="parked"
+        )
+        self.workflow_instance = WorkflowInstance.objects.create(workflow=self.workflow)
+        with self.captureOnCommitCallbacks():
+            WorkflowService().start_workflow(self.workflow_instance)
+
+    def test_parked_tasks_do_not_use_the_budget(self):
+        service = WorkflowService()
+        service.build_workflow(self.workflow_instance)
+        runs = 1
+        while service.run_steps(self.workflow_instance):
+            runs += 1
+            self.assertLess(runs, 10, "The budget is reported exhausted without progress")
+
+        parked = service.workflow_spec.get_tasks(TaskState.READY)
+        self.assertEqual(sorted(task.task_spec.name for task in parked), ["task1", "task2", "task3"])
+        self.assertEqual(UserTask.objects.filter(workflow_instance=self.workflow_instance).count(), 3)
+        # Once the parked tasks are reached, a run makes no progress and doesn't report the budget exhausted
+        self.assertFalse(service.run_steps(self.workflow_instance))
+
+    @override_settings(WORKFLOW_RUN_ASYNC=False)
+    @mock.patch("django_bpmn_engine.core.workflow.service.run_workflow")
+    def test_exhausted_budget_is_left_to_the_runner(self, run_workflow):
+        with self.captureOnCommitCallbacks(execute=True):
+            WorkflowService().execute_workflow(self.workflow_instance)
+
+        self.assertTrue(WorkflowWakeup.objects.filter(workflow_instance=self.workflow_instance).exists())
+        run_workflow.assert_not_called()
+        run_workflow.apply_async.assert_not_called()
+
+    @override_settings(WORKFLOW_RUN_ASYNC=True)
+    @mock.patch("django_bpmn_engine.core.workflow.service.run_workflow")
+    def test_exhausted_budget_is_queued_not_run_inline(self, run_workflow):
+        with self.captureOnCommitCallbacks(execute=True):
+            WorkflowService().execute_workflow(self.workflow_instance)
+
+        run_workflow.assert_not_called()
+        run_workflow.apply_async.assert_called_once_with(
+            args=[str(self.workflow_instance.id), None], queue="run_workflow", countdown=mock.ANY, producer=mock.ANY
+        )
+
+
+def _notify_every_waiting_task(workflow, task):
+    # The notification of SpiffWorkflow, which updates every WAITING task, reporting the tasks it changed
+    waiting_tasks = workflow._get_waiting_tasks()
+    BpmnWorkflow._task_completed_notify(workflow, task)
+    released_tasks = [waiting_task for waiting_task in waiting_tasks if not waiting_task._has_state(TaskState.WAITING)]
+    workflow._get_outermost_workflow().changed_tasks.extend([task, *released_tasks])
+
+
+class ParallelJoinTestCase(TestCase):
+    def setUp(self):
+        self.addCleanup(workflow_spec_cache.clear)
+        self.workflow = Workflow.objects.create(xml=NESTED_JOINS_XML, workflow_process_id="joins", name="joins")
+
+    def _run_to_completion(self):
+        """ Returns the task states saved by each run, and the tasks completed in the end. """
+        # Multi instance tasks add task specs to the cached spec, every instance starts from the same one
+        workflow_spec_cache.clear()
+        workflow_instance = WorkflowInstance.objects.create(workflow=self.workflow)
+        with self.captureOnCommitCallbacks():
+            WorkflowService().start_workflow(workflow_instance)
+        runs = []
+        while workflow_instance.state == WorkflowState.RUNNING:
+            self.assertLess(len(runs), 100, "The workflow does not complete")
+            service = WorkflowService()
+            with self.captureOnCommitCallbacks():
+                service.execute_workflow(workflow_instance)
+            runs.append(sorted((task.task_spec.name, task.state) for task in service.workflow_spec.get_tasks()))
+            workflow_instance.refresh_from_db()
+
+        service = WorkflowService()
+        service.build_workflow(workflow_instance)
+        completed = sorted(task.task_spec.name for task in service.workflow_spec.get_tasks(TaskState.COMPLETED))
+        return runs, completed
+
+    def test_joins_complete_under_a_small_budget(self):
+        _, completed = self._run_to_completion()
+        self.assertIn("done", completed)
+        self.assertEqual(completed.count("multi"), 1)
+        self.assertEqual(len([name for name in completed if name.startswith("multi_")]), 2)
+
+        with override_settings(WORKFLOW_RUN_STEP_BUDGET=1):
+            runs, budget_completed = self._run_to_completion()
+
+        self.assertGreater(len(runs), 1)
+        self.assertEqual(budget_completed, completed)
+
+    @override_settings(WORKFLOW_RUN_STEP_BUDGET=1)
+    def test_joins_fire_like_when_every_waiting_task_is_updated(self):
+        runs, completed = self._run_to_completion()
+        with mock.patch.object(CustomWorkflow, "_task_completed_notify", _notify_every_waiting_task):
+            reference_runs, reference_completed = self._run_to_completion()
+
+        self.assertEqual(runs, reference_runs)
+        self.assertEqual(completed, reference_completed)
+
+
+class ExtraDataTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(
+            xml=SCRIPT_BETWEEN_USER_TASKS_XML, workflow_process_id="review", name="review"
+        )
+        self.workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+
+    def _run(self, extra_data=None):
+        with self.captureOnCommitCallbacks():
+            WorkflowService().execute_workflow(self.workflow_instance, extra_data)
+
+    def _assert_extra_data_is_scoped_to_its_run(self):
+        with self.captureOnCommitCallbacks():
+            WorkflowService().start_workflow(self.workflow_instance)
+        self._run({"x": 1})
+        first = UserTask.objects.get(workflow_instance=self.workflow_instance, task_name__endswith="first")
+        self.assertEqual(first.input_data["x"], 1)
+
+        first.state = UserTaskState.COMPLETED
+        first.save()
+        self._run()
+
+        second = UserTask.objects.get(workflow_instance=self.workflow_instance, task_name__endswith="second")
+        self.assertEqual(second.input_data["x"], 2)
+
+    @override_settings(WORKFLOW_PERSISTENCE_MODE=PersistenceMode.TASKS)
+    def test_tasks_mode(self):
+        self._assert_extra_data_is_scoped_to_its_run()
+
+    @override_settings(WORKFLOW_PERSISTENCE_MODE=PersistenceMode.SNAPSHOT, WORKFLOW_SNAPSHOT_PROJECTION=False)
+    def test_snapshot_mode(self):
+        self._assert_extra_data_is_scoped_to_its_run()
+
+
+class SignalLoopTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(xml=SIGNAL_LOOP_XML, workflow_process_id="signal_loop", name="signal_loop")
+        self.workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+        with self.captureOnCommitCallbacks():
+            WorkflowService().start_workflow(self.workflow_instance)
+            WorkflowService().execute_workflow(self.workflow_instance)
+
+    def _broadcast_and_run(self):
+        with self.captureOnCommitCallbacks():
+            self.assertEqual(broadcast_signal("go", chunk_size=10), 1)
+            WorkflowService().execute_workflow(self.workflow_instance)
+        self.workflow_instance.refresh_from_db()
+
+    def test_catch_event_in_a_loop_waits_for_each_signal(self):
+        self._broadcast_and_run()
+
+        self.assertEqual(self.workflow_instance.state, WorkflowState.RUNNING)
+        subscription = EventSubscription.objects.get(workflow_instance=self.workflow_instance)
+        self.assertEqual(subscription.state, EventSubscriptionState.WAITING)
+
+        self._broadcast_and_run()
+
+        self.assertEqual(self.workflow_instance.state, WorkflowState.COMPLETED)
+        self.assertFalse(EventSubscription.objects.filter(workflow_instance=self.workflow_instance).exists())
+
+    @override_settings(WORKFLOW_RUN_ASYNC=False)
+    @mock.patch("django_bpmn_engine.core.workflow.service.run_workflow")
+    def test_signal_is_left_to_the_runner(self, run_workflow):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(broadcast_signal("go", chunk_size=10), 1)
+
+        self.assertEqual(WorkflowWakeup.objects.filter(workflow_instance=self.workflow_instance).count(), 1)
+        run_workflow.assert_not_called()
+        run_workflow.apply_async.assert_not_called()
+
+    @override_settings(WORKFLOW_RUN_ASYNC=True)
+    @mock.patch("django_bpmn_engine.core.workflow.service.run_workflow")
+    def test_signal_is_enqueued_once(self, run_workflow):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(broadcast_signal("go", chunk_size=10), 1)
+
+        run_workflow.assert_not_called()
+        run_workflow.apply_async.assert_called_once_with(
+            args=[str(self.workflow_instance.id), None], queue="run_workflow", countdown=mock.ANY, producer=mock.ANY
+        )
+
+
+@mock.patch("django_bpmn_engine.core.workflow.service.run_workflow")
+class FireDueTimersTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(xml=PARKED_USER_TASKS_XML, workflow_process_id="parked", name="parked")
+        self.workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+        WorkflowTimer.objects.create(workflow_instance=self.workflow_instance, task_name="timer", due_at=timezone.now())
+
+    def _fire(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(fire_due_timers(10), 1)
+        self.assertFalse(WorkflowTimer.objects.exists())
+
+    @override_settings(WORKFLOW_RUN_ASYNC=False)
+    def test_timer_is_left_to_the_runner(self, run_workflow):
+        self._fire()
+
+        self.assertEqual(WorkflowWakeup.objects.filter(workflow_instance=self.workflow_instance).count(), 1)
+        run_workflow.assert_not_called()
+        run_workflow.apply_async.assert_not_called()
+
+    @override_settings(WORKFLOW_RUN_ASYNC=True)
+    def test_timer_is_enqueued_once(self, run_workflow):
+        self._fire()
+
+        run_workflow.assert_not_called()
+        run_workflow.apply_async.assert_called_once_with(
+            args=[str(self.workflow_instance.id), None], queue="run_workflow", countdown=mock.ANY, producer=mock.ANY
+        )
+
+
+
+class ClockSkewTestCase(TestCase):
+    def setUp(self):
+        workflow = Workflow.objects.create(xml=PARKED_USER_TASKS_XML, workflow_process_id="parked", name="parked")
+        self.workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+        with self.captureOnCommitCallbacks():
+            WorkflowService().start_workflow(self.workflow_instance)
+
+    def test_tasks_created_by_a_server_whose_clock_is_behind(self):
+        WorkflowTaskInstance.objects.update(created_at=self.workflow_instance.created_at - timedelta(minutes=5))
+
+        saved_tasks = WorkflowService()._get_saved_tasks(self.workflow_instance)
+
+        self.assertEqual(
+            sum(len(tasks) for tasks in saved_tasks.values()),
+            WorkflowTaskInstance.objects.filter(workflow_instance=self.workflow_instance).count(),
+        )
+        self.assertTrue(saved_tasks)
+
+
+class CreateIncidentTestCase(TestCase):
+    def test_stale_instance_only_writes_the_state(self):
+        workflow = Workflow.objects.create(xml=PARKED_USER_TASKS_XML, workflow_process_id="parked", name="parked")
+        workflow_instance = WorkflowInstance.objects.create(workflow=workflow)
+        WorkflowInstance.objects.filter(id=workflow_instance.id).update(last_task="task1")
+
+        WorkflowService().create_incident(workflow_instance, "task2", {"error": "boom"})
+
+        workflow_instance.refresh_from_db()
+        self.assertEqual(workflow_instance.state, WorkflowState.FAILURE)
+        self.assertEqual(workflow_instance.last_task, "task1")
+        self.assertEqual(Incident.objects.get(workflow_instance=workflow_instance).error, {"error": "boom"})
+
+
+@override_settings(WORKFLOW_RUN_ASYNC=False)
+class CorrelationKeyTestCase(TestCase):
+    def setUp(self):
+        self.workflow = Workflow.objects.create(xml=MESSAGE_XML, workflow_process_id="message", name="message")
+
+    def _start(self, initial_data) -> WorkflowInstance:
+        workflow_instance = WorkflowInstance.objects.create(workflow=self.workflow, initial_data=initial_data)
+        with self.captureOnCommitCallbacks(execute=True):
+            WorkflowService().start_workflow(workflow_instance)
+        workflow_instance.refresh_from_db()
+        return workflow_instance
+
+    def test_key_is_only_evaluated_when_the_event_is_created(self):
+        workflow_instance = self._start({"order_id": 7})
+        self.assertEqual(MessageTaskEvent.objects.get(workflow_instance=workflow_instance).correlation_key, "7")
+
+        with mock.patch.object(WorkflowService, "_get_correlation_key") as get_correlation_key:
+            with self.captureOnCommitCallbacks():
+                WorkflowService().execute_workflow(workflow_instance)
+
+        get_correlation_key.assert_not_called()
+
+    def test_missing_variable_fails_the_instance_with_an_incident(self):
+        workflow_instance = self._start({})
+
+        self.assertEqual(workflow_instance.state, WorkflowState.FAILURE)
+        self.assertEqual(Incident.objects.get(workflow_instance=workflow_instance).task_name, "wait")
+        self.assertFalse(MessageTaskEvent.objects.filter(workflow_instance=workflow_instance).exists())